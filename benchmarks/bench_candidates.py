@@ -0,0 +1,100 @@
+"""Candidate file search with ripgrep against the built-in fallback, on a synthetic tree.
+
+Usage: python -m benchmarks.bench_candidates [--files N] [--repeat N] [--workers N]
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from unpin_python.scan import iter_builtin_candidate_files, name_pattern
+
+PACKAGES = ["hatchling", "flit-core", "setuptools-scm", "poetry-core", "pdm-backend"]
+# Names that share a prefix with a searched package but aren't it
+DECOYS = ["hatchling-vcs", "hatchlingx", "flit", "setuptools", "poetry"]
+
+EXPRESSION = '''{ lib, buildPythonPackage, fetchFromGitHub, %(args)s }:
+
+buildPythonPackage rec {
+  pname = "pkg%(i)d";
+  version = "1.%(i)d";
+  src = fetchFromGitHub {
+    owner = "owner%(i)d";
+    repo = pname;
+    rev = "v${version}";
+    hash = "sha256-AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=";
+  };
+  build-system = [ %(args)s ];
+%(padding)s}
+'''
+
+def make_tree(root, count, seed=0):
+    """Writes `count` expressions in a nixpkgs-like layout, plus files both backends must skip."""
+    rng = random.Random(seed)
+    for i in range(count):
+        directory = os.path.join(root, "pkgs", f"group{i % 40}", f"sub{i % 7}", f"pkg{i}")
+        os.makedirs(directory, exist_ok=True)
+        args = rng.sample(PACKAGES + DECOYS, rng.randint(0, 2))
+        padding = "  # padding\n" * rng.randint(0, 80)
+        with open(os.path.join(directory, "default.nix"), "w") as f:
+            f.write(EXPRESSION % {"i": i, "args": ", ".join(args) or "setuptools", "padding": padding})
+        if i % 10 == 0:
+            with open(os.path.join(directory, "README.md"), "w") as f:
+                f.write("hatchling\n")
+    git_dir = os.path.join(root, ".git", "objects")
+    os.makedirs(git_dir, exist_ok=True)
+    for i in range(count // 20):
+        with open(os.path.join(git_dir, f"{i}.nix"), "w") as f:
+            f.write("hatchling\n")
+    # One package set large enough to be searched through mmap
+    with open(os.path.join(root, "pkgs", "package-set.nix"), "w") as f:
+        f.write("{\n" + "  x = 1;\n" * 200_000 + "  y = poetry-core;\n}\n")
+
+def ripgrep_files(root, package_names):
+    cmd = ["rg", "-l", "--ignore-case", "--glob", "*.nix"]
+    for package_name in package_names:
+        cmd.extend(["-e", name_pattern(package_name)])
+    cmd.append(root)
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, text=True).stdout
+    return [line for line in output.splitlines() if line]
+
+def measure(func, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, set(result)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, args.files)
+        backends = [
+            ("builtin-1", lambda: list(iter_builtin_candidate_files(root, PACKAGES, workers=1))),
+            ("builtin", lambda: list(iter_builtin_candidate_files(root, PACKAGES, workers=args.workers))),
+        ]
+        if shutil.which("rg"):
+            backends.insert(0, ("ripgrep", lambda: ripgrep_files(root, PACKAGES)))
+        else:
+            print("# rg not found; timing the built-in backend only")
+
+        print("backend\tfiles\tmatches\tseconds\tvs_first")
+        baseline = None
+        for name, func in backends:
+            seconds, found = measure(func, args.repeat)
+            if baseline is None:
+                baseline = (seconds, found)
+            elif found != baseline[1]:
+                raise SystemExit(f"{name} found {len(found)} files, expected {len(baseline[1])}")
+            print(f"{name}\t{args.files}\t{len(found)}\t{seconds:.4f}\t{seconds / baseline[0]:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Throughput of the Nix fetcher tokenizer against the lazy regex it replaced.
+
+The tokenizer runs as the scan runs it: only on text that passes the might_contain_fetchers() prefilter.
+
+Usage: python -m benchmarks.bench_nixparse [--repeat N]
+"""
+import argparse
+import re
+import time
+from unpin_python.nixparse import iter_fetchers, might_contain_fetchers
+
+# The extraction the scan used before the tokenizer
+LEGACY_BLOCK_PATTERN = re.compile(r'fetchFromGitHub\s*{\s*([\s\S]*?)\s*};', re.DOTALL)
+LEGACY_OWNER_PATTERN = re.compile(r'owner\s*=\s*"([^"]+)"')
+LEGACY_REPO_PATTERN = re.compile(r'repo\s*=\s*"([^"]+)"')
+
+PACKAGE = '''
+  pkg%(i)d = buildPythonPackage rec {
+    pname = "pkg%(i)d";
+    version = "1.%(i)d";
+    src = fetchFromGitHub {
+      owner = "owner%(i)d";
+      repo = pname;
+      rev = "v${version}";
+      hash = "sha256-AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=";
+    };
+    build-system = [ hatchling ];
+  };
+'''
+
+def legacy_extract(content):
+    found = []
+    for match in LEGACY_BLOCK_PATTERN.finditer(content):
+        owner = LEGACY_OWNER_PATTERN.search(match.group(1))
+        repo = LEGACY_REPO_PATTERN.search(match.group(1))
+        if owner and repo:
+            found.append((owner.group(1), repo.group(1)))
+    return found
+
+def package_set(count):
+    """A generated package set in the style of pkgs/top-level/python-packages.nix."""
+    return "{ fetchFromGitHub, buildPythonPackage, hatchling }:\n{\n%s}\n" % "".join(
+        PACKAGE % {"i": i} for i in range(count))
+
+def pypi_set(count):
+    """The same package set fetching from PyPI, which the prefilter rules out without tokenizing."""
+    return package_set(count).replace("fetchFromGitHub", "fetchPypi")
+
+def tokenizer_extract(content):
+    if not might_contain_fetchers(content.encode()):
+        return []
+    return list(iter_fetchers(content))
+
+def unterminated(count):
+    """Fetcher calls never followed by `};`, which makes the lazy regex rescan to the end of file."""
+    return 'fetchFromGitHub { owner = "o"; repo = "r"; }\n' * count
+
+def measure(func, content, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [
+        ("package-set-2k", package_set(2000)),
+        ("package-set-8k", package_set(8000)),
+        ("pypi-set-8k", pypi_set(8000)),
+        ("unterminated-500", unterminated(500)),
+        ("unterminated-2k", unterminated(2000)),
+    ]
+    print("case\tbytes\tregex_s\ttokenizer_s\tregex_MBps\ttokenizer_MBps")
+    for name, content in cases:
+        regex_s = measure(legacy_extract, content, args.repeat)
+        tokenizer_s = measure(tokenizer_extract, content, args.repeat)
+        size_mb = len(content) / 1e6
+        print(f"{name}\t{len(content)}\t{regex_s:.4f}\t{tokenizer_s:.4f}\t{size_mb / regex_s:.1f}\t{size_mb / tokenizer_s:.1f}")
+
+if __name__ == "__main__":
+    main()
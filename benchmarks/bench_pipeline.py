@@ -0,0 +1,83 @@
+"""End-to-end timings of scan, search and report on a synthetic nixpkgs tree and a local GitHub stand-in.
+
+Prints one JSON object per stage, so runs can be compared against a baseline without network access.
+
+Usage: python -m benchmarks.bench_pipeline [--files N] [--fetcher-density F] [--large-files N] ...
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
+from benchmarks.fake_github import FakeGitHub
+from benchmarks.synthetic import BUILD_BACKENDS, make_nixpkgs_tree
+from unpin_python.database import Database
+from unpin_python.ratelimit import RequestScheduler
+from unpin_python.report import run_matrix_report, run_report
+from unpin_python.scan import run_batch_scan
+from unpin_python.search import run_searches
+
+@contextlib.contextmanager
+def stage(name, results, **fields):
+    """Times the block with its stdout swallowed. Yields the stage's record, which can take more fields."""
+    record = {"stage": name, "seconds": None, **fields}
+    results.append(record)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield record
+    record["seconds"] = round(time.perf_counter() - start, 4)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=5000, help="Package expressions in the tree.")
+    parser.add_argument("--fetcher-density", type=float, default=0.5, help="Fraction of expressions fetching from GitHub.")
+    parser.add_argument("--large-files", type=int, default=2, help="Large package sets in the tree.")
+    parser.add_argument("--large-file-mb", type=float, default=4, help="Size of each large package set.")
+    parser.add_argument("--packages", type=int, default=len(BUILD_BACKENDS), help="Build backends to scan and search for.")
+    parser.add_argument("--search-results", type=int, default=500, help="Results per search query (at most 1000).")
+    parser.add_argument("--rate-limit", type=int, default=5000, help="Requests per minute the stand-in allows.")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Scan worker processes.")
+    args = parser.parse_args()
+
+    results = []
+    packages = BUILD_BACKENDS[:args.packages]
+    specifiers = [(name, f"{name} >= 1.0", f"{name}>=1.0") for name in packages]
+    with tempfile.TemporaryDirectory() as workdir:
+        nixpkgs_path = os.path.join(workdir, "nixpkgs")
+        db_path = os.path.join(workdir, "db.sqlite")
+
+        with stage("generate", results) as fields:
+            tree = make_nixpkgs_tree(nixpkgs_path, args.files, args.fetcher_density, args.large_files,
+                                     int(args.large_file_mb * 1024 * 1024))
+            fields.update(files=tree["files"], bytes=tree["bytes"], repositories=len(tree["repositories"]))
+
+        with stage("scan", results, packages=len(packages)) as fields:
+            run_batch_scan(packages, nixpkgs_path, db_path, args.workers)
+        with Database(db_path) as db:
+            fields["rows"] = sum(len(db.get_scan_repositories(name)) for name in packages)
+
+        with FakeGitHub(tree["repositories"], args.search_results, args.rate_limit) as github, \
+                patch.dict(os.environ, {"GITHUB_API_URL": github.url}):
+            # The stand-in enforces its own rate limit, so the client-side pacing is lifted
+            scheduler = RequestScheduler(["benchmark"], requests_per_minute=10 ** 6)
+            with stage("search", results, queries=2 * len(specifiers)) as fields:
+                run_searches(specifiers, db_path, scheduler=scheduler)
+            fields["requests"] = github.requests
+
+        with stage("report", results, specifiers=len(specifiers)):
+            for name, _, canonical in specifiers:
+                run_report(name, canonical, db_path)
+
+        out = io.StringIO()
+        with stage("report-matrix", results) as fields:
+            run_matrix_report([(name, canonical) for name, _, canonical in specifiers], db_path, 'jsonl', out)
+        fields["rows"] = out.getvalue().count("\n")
+
+    for result in results:
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
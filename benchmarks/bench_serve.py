@@ -0,0 +1,94 @@
+"""Latency of report and scan queries: a cold CLI process against a warm `serve` process.
+
+Usage: python -m benchmarks.bench_serve [--files N] [--queries N]
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+from benchmarks.fake_github import FakeGitHub
+from benchmarks.synthetic import BUILD_BACKENDS, make_nixpkgs_tree
+from unpin_python.ratelimit import RequestScheduler
+from unpin_python.scan import run_batch_scan
+from unpin_python.search import run_searches
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def cli(workdir, nixpkgs_path, *args, **kwargs):
+    env = dict(os.environ, PYTHONPATH=PACKAGE_ROOT, GITHUB_SEARCH_TOKEN="unused")
+    return subprocess.Popen([sys.executable, "-m", "unpin_python.main", "-n", nixpkgs_path, *args],
+                            cwd=workdir, env=env, **kwargs)
+
+def wait_for_server(port, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+            conn.request("GET", "/status")
+            return json.loads(conn.getresponse().read())
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit("serve didn't start")
+
+def timings(func, count):
+    seconds = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return {"median_ms": round(statistics.median(seconds) * 1000, 3), "max_ms": round(max(seconds) * 1000, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=5000, help="Package expressions in the tree.")
+    parser.add_argument("--queries", type=int, default=200, help="Queries sent to the server per kind.")
+    parser.add_argument("--cli-runs", type=int, default=5, help="Cold CLI runs to time.")
+    parser.add_argument("--port", type=int, default=18765)
+    args = parser.parse_args()
+
+    specifier = f"{BUILD_BACKENDS[0]}==1.0"
+    with tempfile.TemporaryDirectory() as workdir:
+        nixpkgs_path = os.path.join(workdir, "nixpkgs")
+        db_path = os.path.join(workdir, "db.sqlite")
+        tree = make_nixpkgs_tree(nixpkgs_path, args.files, large_files=0)
+        # The server watches git for new commits, so the tree is committed
+        for git_args in (["init", "-q"], ["add", "-A"], ["-c", "user.name=b", "-c", "user.email=b@example.com", "commit", "-q", "-m", "tree"]):
+            subprocess.run(["git", "-C", nixpkgs_path, *git_args], check=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_batch_scan(BUILD_BACKENDS, nixpkgs_path, db_path)
+            with FakeGitHub(tree["repositories"], 1000) as github, patch.dict(os.environ, {"GITHUB_API_URL": github.url}):
+                scheduler = RequestScheduler(["benchmark"], requests_per_minute=10 ** 6)
+                run_searches([(name, f"{name} == 1.0", f"{name}==1.0") for name in BUILD_BACKENDS], db_path, scheduler=scheduler)
+
+        results = [{"query": "report", "mode": "cli", **timings(
+            lambda: cli(workdir, nixpkgs_path, "report", specifier, stdout=subprocess.DEVNULL).wait(), args.cli_runs)}]
+
+        server = cli(workdir, nixpkgs_path, "serve", "--port", str(args.port), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            start = time.perf_counter()
+            status = wait_for_server(args.port)
+            results.append({"query": "startup", "mode": "serve", "seconds": round(time.perf_counter() - start, 3), **status})
+            conn = http.client.HTTPConnection("127.0.0.1", args.port)
+
+            def query(target):
+                conn.request("GET", target)
+                conn.getresponse().read()
+            for kind, target in (("report", f"/report?specifier={specifier}"), ("scan", f"/scan?specifier={BUILD_BACKENDS[0]}")):
+                results.append({"query": kind, "mode": "serve", **timings(lambda: query(target), args.queries)})
+        finally:
+            server.terminate()
+            server.wait()
+
+    for result in results:
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""A local stand-in for the GitHub code search API, so searches can be benchmarked offline."""
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+# GitHub never returns more than 1000 results for a query
+MAX_RESULTS = 1000
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.github.handle(self)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeGitHub:
+    """Serves /search/code like api.github.com: paginated items with text matches, `Link` headers
+    with `next`/`last`, and `X-RateLimit-*` headers that run out after `rate_limit` requests per
+    `reset_interval` seconds (answered with 403 until the window resets).
+
+    Each query gets `results_per_query` deterministic results, drawn from `repositories` (so they
+    overlap a scan) and from repositories nixpkgs doesn't package. Use as a context manager.
+    """
+
+    def __init__(self, repositories, results_per_query=300, rate_limit=5000, reset_interval=60):
+        self.repositories = list(repositories) or ["owner/repo"]
+        self.results_per_query = min(results_per_query, MAX_RESULTS)
+        self.rate_limit = rate_limit
+        self.reset_interval = reset_interval
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._used = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.github = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _take_quota(self):
+        """Returns (allowed, remaining, reset) for one request."""
+        with self._lock:
+            self.requests += 1
+            now = time.time()
+            if now - self._window_start >= self.reset_interval:
+                self._window_start, self._used = now, 0
+            reset = int(self._window_start + self.reset_interval)
+            if self._used >= self.rate_limit:
+                return False, 0, reset
+            self._used += 1
+            return True, self.rate_limit - self._used, reset
+
+    def _items(self, query, page, per_page):
+        quoted = re.match(r'\s*"([^"]*)"', query)
+        fragment = f'requires = ["{quoted.group(1) if quoted else query}"]'
+        offset = zlib.crc32(query.encode())
+        items = []
+        for n in range((page - 1) * per_page, min(page * per_page, self.results_per_query)):
+            # Every other result is a repository nixpkgs packages
+            if n % 2 == 0:
+                full_name = self.repositories[(offset + n // 2) % len(self.repositories)]
+            else:
+                full_name = f"elsewhere{(offset + n) % 100000}/project{n}"
+            items.append({"repository": {"full_name": full_name}, "text_matches": [{"fragment": fragment}]})
+        return items
+
+    def handle(self, request):
+        url = urlsplit(request.path)
+        if url.path != "/search/code":
+            request.send_error(404)
+            return
+        allowed, remaining, reset = self._take_quota()
+        headers = {"X-RateLimit-Limit": str(self.rate_limit), "X-RateLimit-Remaining": str(remaining),
+                   "X-RateLimit-Reset": str(reset), "Content-Type": "application/json"}
+        if not allowed:
+            body = {"message": "API rate limit exceeded"}
+            status = 403
+        else:
+            params = parse_qs(url.query)
+            query = params.get("q", [""])[0]
+            page = int(params.get("page", ["1"])[0])
+            per_page = int(params.get("per_page", ["30"])[0])
+            last_page = max(1, -(-self.results_per_query // per_page))
+            body = {"total_count": self.results_per_query, "incomplete_results": False,
+                    "items": self._items(query, page, per_page)}
+            status = 200
+
+            def page_url(number):
+                return f"{self.url}{url.path}?{urlencode({**{k: v[0] for k, v in params.items()}, 'page': number})}"
+            links = []
+            if page < last_page:
+                links.append(f'<{page_url(page + 1)}>; rel="next"')
+                links.append(f'<{page_url(last_page)}>; rel="last"')
+            if page > 1:
+                links.append(f'<{page_url(1)}>; rel="first"')
+            if links:
+                headers["Link"] = ", ".join(links)
+
+        data = json.dumps(body).encode()
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
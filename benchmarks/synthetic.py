@@ -0,0 +1,95 @@
+"""Generates a nixpkgs-like tree for benchmarks: Python modules, applications and large package sets."""
+import os
+import random
+
+BUILD_BACKENDS = ["hatchling", "setuptools", "flit-core", "poetry-core", "pdm-backend"]
+
+GITHUB_SOURCE = '''fetchFromGitHub {
+    owner = "owner%(i)d";
+    repo = pname;
+    rev = "v${version}";
+    hash = "sha256-AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=";
+  }'''
+
+PYPI_SOURCE = '''fetchPypi {
+    inherit pname version;
+    hash = "sha256-AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=";
+  }'''
+
+EXPRESSION = '''{ lib, buildPythonPackage, fetchFromGitHub, fetchPypi, %(args)s }:
+
+buildPythonPackage rec {
+  pname = "pkg%(i)d";
+  version = "1.%(i)d";
+  pyproject = true;
+
+  src = %(src)s;
+
+  build-system = [ %(deps)s ];
+
+  meta = {
+    description = "Synthetic package %(i)d";
+    license = lib.licenses.mit;
+  };
+}
+'''
+
+# An entry of a large package set: it mentions a build backend, but only in its description
+LARGE_ENTRY = '''  big%(i)d = mkDerivation {
+    pname = "big%(i)d";
+    src = fetchFromGitHub { owner = "big%(i)d"; repo = "big%(i)d"; rev = "1"; hash = ""; };
+    description = "Builds with hatchling or setuptools";
+  };
+'''
+
+def _write(root, relative_path, content):
+    path = os.path.join(root, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return len(content)
+
+def make_nixpkgs_tree(root, files=2000, fetcher_density=0.5, large_files=1, large_file_bytes=4 * 1024 * 1024, seed=0):
+    """Writes a synthetic nixpkgs checkout under `root`.
+
+    `files` package expressions are written, half as Python modules listed in
+    pkgs/top-level/python-packages.nix. A `fetcher_density` fraction of them fetch from GitHub,
+    and each depends on up to two build backends. `large_files` package sets of about
+    `large_file_bytes` each mention the backends everywhere without depending on them.
+
+    Returns {"files", "bytes", "repositories"}, where repositories are the GitHub "owner/repo"
+    names the expressions fetch.
+    """
+    rng = random.Random(seed)
+    total_bytes = 0
+    repositories = []
+    attributes = []
+    for i in range(files):
+        deps = rng.sample(BUILD_BACKENDS, rng.randint(1, 2))
+        github = rng.random() < fetcher_density
+        if github:
+            repositories.append(f"owner{i}/pkg{i}")
+        content = EXPRESSION % {"i": i, "args": ", ".join(deps), "deps": " ".join(deps),
+                                "src": GITHUB_SOURCE % {"i": i} if github else PYPI_SOURCE}
+        if i % 2 == 0:
+            relative_path = os.path.join("pkgs", "development", "python-modules", f"pkg{i}", "default.nix")
+            attributes.append(f"  pkg{i} = callPackage ../development/python-modules/pkg{i} {{ }};\n")
+        else:
+            relative_path = os.path.join("pkgs", "applications", f"group{i % 50}", f"pkg{i}", "package.nix")
+        total_bytes += _write(root, relative_path, content)
+
+    # The backends' own definitions, which must not be reported as depending on themselves
+    for backend in BUILD_BACKENDS:
+        total_bytes += _write(root, os.path.join("pkgs", "development", "python-modules", backend, "default.nix"),
+                              EXPRESSION % {"i": 0, "args": backend, "deps": "", "src": PYPI_SOURCE})
+        attributes.append(f"  {backend} = callPackage ../development/python-modules/{backend} {{ }};\n")
+    total_bytes += _write(root, os.path.join("pkgs", "top-level", "python-packages.nix"),
+                          "self: super: with self; {\n" + "".join(attributes) + "}\n")
+
+    entries_per_file = max(1, large_file_bytes // len(LARGE_ENTRY % {"i": 0}))
+    for k in range(large_files):
+        entries = "".join(LARGE_ENTRY % {"i": k * entries_per_file + j} for j in range(entries_per_file))
+        total_bytes += _write(root, os.path.join("pkgs", "development", "package-sets", f"set{k}.nix"),
+                              "{ mkDerivation, fetchFromGitHub }:\n{\n" + entries + "}\n")
+
+    return {"files": files + len(BUILD_BACKENDS) + 1 + large_files, "bytes": total_bytes, "repositories": repositories}
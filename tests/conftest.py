@@ -0,0 +1,50 @@
+import subprocess
+import pytest
+from unpin_python.database import Database
+
+NIX_TEMPLATE = """
+{ fetchFromGitHub, buildPythonPackage, %(tool)s }:
+
+buildPythonPackage rec {
+  pname = "%(repo)s";
+  src = fetchFromGitHub {
+    owner = "o";
+    repo = "%(repo)s";
+    rev = "v1.0";
+  };
+  build-system = [ %(tool)s ];
+}
+"""
+
+def run_git(path, *args):
+    subprocess.run(["git", "-C", str(path), "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                   check=True, capture_output=True)
+
+@pytest.fixture
+def mem_db():
+    db = Database(':memory:')
+    yield db
+    db.close()
+
+@pytest.fixture
+def git():
+    """Runs a git command in a repository, as a test user."""
+    return run_git
+
+@pytest.fixture
+def nix_expression():
+    """Returns a package expression that fetches o/`repo` from GitHub and builds with `tool`."""
+    return lambda repo, tool: NIX_TEMPLATE % {"repo": repo, "tool": tool}
+
+@pytest.fixture
+def nixpkgs(tmp_path, git, nix_expression):
+    """A tiny committed nixpkgs-like git repository: a.nix builds with hatchling, b.nix with setuptools."""
+    root = tmp_path / "nixpkgs"
+    (root / "pkgs").mkdir(parents=True)
+    (root / "pkgs" / "a.nix").write_text(nix_expression("a", "hatchling"))
+    (root / "pkgs" / "b.nix").write_text(nix_expression("b", "setuptools"))
+    (root / "pkgs" / "plain.nix").write_text("{ }: { }\n")
+    git(root, "init", "-q")
+    git(root, "add", "-A")
+    git(root, "commit", "-q", "-m", "init")
+    return root
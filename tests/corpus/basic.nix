@@ -0,0 +1,16 @@
+{ lib, buildPythonPackage, fetchFromGitHub, hatchling }:
+
+buildPythonPackage rec {
+  pname = "basic";
+  version = "1.0";
+  pyproject = true;
+
+  src = fetchFromGitHub {
+    owner = "basic-owner";
+    repo = "basic-repo";
+    rev = "refs/tags/v${version}";
+    hash = "sha256-AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=";
+  };
+
+  build-system = [ hatchling ];
+}
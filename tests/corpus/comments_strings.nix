@@ -0,0 +1,21 @@
+{ fetchFromGitHub }:
+
+# src = fetchFromGitHub { owner = "commented"; repo = "out"; };
+/*
+  src = fetchFromGitHub {
+    owner = "block";
+    repo = "comment";
+  };
+*/
+{
+  description = "fetchFromGitHub { owner = \"in\"; repo = \"string\"; }";
+  script = ''
+    fetchFromGitHub { owner = "in"; repo = "indented-string"; }
+  '';
+  comparison = if fetchFromGitHub == null then { } else { };
+  src = fetchFromGitHub {
+    owner = "real";
+    repo = "one";
+    rev = "v1";
+  };
+}
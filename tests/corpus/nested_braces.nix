@@ -0,0 +1,27 @@
+{ fetchFromGitHub, stdenv }:
+
+stdenv.mkDerivation {
+  pname = "nested";
+  version = "0.1";
+
+  srcs = [
+    (fetchFromGitHub {
+      owner = "first";
+      repo = "one";
+      rev = "abc";
+      postFetch = ''
+        # a "};" inside an indented string must not end the block
+        cat > $out/x.nix <<EOF
+        { a = { b = 1; }; }
+        EOF
+        echo ''${notInterpolated} ${toString { x = "}"; }}
+      '';
+    })
+    (fetchFromGitHub { owner = "second"; repo = "two"; rev = "def"; })
+  ];
+
+  passthru = {
+    extra = fetchFromGitHub { owner = "third"; repo = "three"; rev = "ghi"; meta = { description = "}; {"; }; }
+      // { };
+  };
+}
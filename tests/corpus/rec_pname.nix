@@ -0,0 +1,31 @@
+{ lib, buildPythonPackage, fetchFromGitHub, setuptools }:
+
+let
+  owner = "let-owner";
+in
+buildPythonPackage rec {
+  pname = "rec-pname";
+  version = "2.3.4";
+
+  src = fetchFromGitHub {
+    inherit owner;
+    repo = pname;
+    tag = "v${version}";
+    hash = "sha256-BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB=";
+  };
+
+  docs = fetchFromGitHub rec {
+    owner = "docs-owner";
+    repo = "${pname}-docs";
+    rev = "${repo}-${version}";
+    hash = "sha256-CCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCC=";
+  };
+
+  unresolved = fetchFromGitHub {
+    owner = someArgument;
+    repo = "unresolved";
+    rev = "v${unknownVersion}";
+  };
+
+  build-system = [ setuptools ];
+}
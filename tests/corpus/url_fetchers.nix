@@ -0,0 +1,25 @@
+{ fetchurl, fetchzip, fetchgit, fetchpatch, fetchPypi }:
+
+{
+  tarball = fetchurl {
+    url = "https://github.com/url-owner/url-repo/archive/refs/tags/v1.0.tar.gz";
+    hash = "sha256-DDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDD=";
+  };
+  zip = fetchzip {
+    url = "https://github.com/zip-owner/zip-repo/releases/download/1.0/zip-repo.zip";
+  };
+  git = fetchgit {
+    url = "https://github.com/git-owner/git-repo.git";
+    rev = "0123456789abcdef";
+  };
+  elsewhere = fetchurl {
+    url = "https://example.org/not-github/archive.tar.gz";
+  };
+  patch = fetchpatch {
+    url = "https://github.com/patch-owner/patch-repo/commit/abc.patch";
+  };
+  pypi = fetchPypi {
+    pname = "not-github";
+    version = "1.0";
+  };
+}
@@ -1,12 +1,8 @@
 import pytest
-from unpin_python.database import Database
-
-@pytest.fixture
-def mem_db():
-    """Fixture to create a fresh in-memory database for each test."""
-    db = Database(':memory:')
-    yield db
-    db.close()
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from unpin_python.database import Database, SCHEMA_VERSION, shard_of
+from unpin_python.merge import run_merge
 
 def test_create_tables(mem_db):
     """Test if tables are created successfully."""
@@ -38,6 +34,19 @@ def test_upsert_and_get_scan(mem_db):
     assert scan_result[0]['owner'] == "test"
     assert scan_result[0]['repo'] == "two"
 
+def test_upsert_scan_results_batch(mem_db):
+    """Test upserting several packages at once."""
+    results = {
+        "pkg-a": [{"path": "pkgs/a/a.nix", "owner": "test", "repo": "one"}],
+        "pkg-b": [
+            {"path": "pkgs/a/a.nix", "owner": "test", "repo": "one"},
+            {"path": "pkgs/b/b.nix", "owner": "test", "repo": "two"},
+        ],
+    }
+    assert mem_db.upsert_scan_results(results) == 3
+    assert len(mem_db.get_scan_repositories("pkg-a")) == 1
+    assert len(mem_db.get_scan_repositories("pkg-b")) == 2
+
 def test_insert_and_get_search(mem_db):
     """Test inserting and retrieving search results."""
     pkg = "test-pkg"
@@ -60,4 +69,222 @@ def test_insert_and_get_search(mem_db):
     
     # Check that only the matching repos are returned
     packages = {item['package'] for item in report_data}
-    assert packages == {pkg}
\ No newline at end of file
+    assert packages == {pkg}
+
+def test_report_join_is_case_insensitive(mem_db):
+    """GitHub names are case-insensitive, so the report join must be too."""
+    mem_db.upsert_scan_result("pkg", [{"path": "pkgs/a/a.nix", "owner": "Owner", "repo": "Repo"}])
+    mem_db.insert_search_result("pkg", "pkg==1.0", {"owner/repo"})
+    assert mem_db.get_latest_search_report("pkg", "pkg==1.0") == [{"path": "pkgs/a/a.nix", "package": "pkg"}]
+
+def test_report_queries_use_indexes(mem_db):
+    """Neither the latest-run lookup nor the owner/repo join should scan a whole table."""
+    mem_db.cursor.execute('''
+        EXPLAIN QUERY PLAN
+        SELECT r.nix_path FROM repositories r
+        JOIN search_matches sm ON sm.repo_key = r.repo_key
+        WHERE sm.search_id = 1 AND r.package_name = 'pkg'
+    ''')
+    plan = " ".join(row[-1] for row in mem_db.cursor.fetchall())
+    assert "SCAN" not in plan
+    mem_db.cursor.execute('''
+        EXPLAIN QUERY PLAN
+        SELECT id FROM search_runs WHERE package_name = 'pkg' AND search_string = 'pkg==1.0'
+        ORDER BY last_update DESC LIMIT 1
+    ''')
+    plan = " ".join(row[-1] for row in mem_db.cursor.fetchall())
+    assert "idx_search_runs_latest" in plan
+
+def test_migrate_legacy_database(tmp_path):
+    """A database created before the repo_key columns existed is upgraded in place."""
+    db_path = str(tmp_path / "legacy.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+        CREATE TABLE scans (package_name TEXT PRIMARY KEY, last_scan TEXT);
+        CREATE TABLE repositories (package_name TEXT, nix_path TEXT, owner TEXT, repo TEXT,
+                                   PRIMARY KEY (package_name, owner, repo));
+        CREATE TABLE search_runs (id INTEGER PRIMARY KEY AUTOINCREMENT, package_name TEXT,
+                                  search_string TEXT, last_update TEXT);
+        CREATE TABLE search_matches (search_id INTEGER, repo_full_name TEXT,
+                                     PRIMARY KEY (search_id, repo_full_name));
+        INSERT INTO scans VALUES ('pkg', '2025-01-01T00:00:00+00:00');
+        INSERT INTO repositories VALUES ('pkg', 'pkgs/a/a.nix', 'Owner', 'Repo');
+        INSERT INTO search_runs VALUES (1, 'pkg', 'pkg==1.0', '2025-01-02T00:00:00+00:00');
+        INSERT INTO search_matches VALUES (1, 'owner/repo');
+    ''')
+    conn.commit()
+    conn.close()
+
+    db = Database(db_path)
+    assert db.get_latest_search_report("pkg", "pkg==1.0") == [{"path": "pkgs/a/a.nix", "package": "pkg"}]
+    # Existing runs get their deltas, so they can be compacted later
+    assert db.get_search_changes("pkg", "pkg==1.0", datetime(2025, 1, 1, tzinfo=timezone.utc)) == (["owner/repo"], [])
+    db.cursor.execute("PRAGMA user_version")
+    assert db.cursor.fetchone()[0] == SCHEMA_VERSION
+    db.close()
+
+def test_migrate_drops_indexed_content(tmp_path):
+    """Version 7 drops the text of indexed files but keeps the index."""
+    db_path = str(tmp_path / "v6.sqlite")
+    with Database(db_path) as db:
+        db.update_index([("pkgs/a.nix", "abc", [], set())], [], "rev")
+        db.cursor.execute("ALTER TABLE indexed_files ADD COLUMN content TEXT")
+        db.cursor.execute("PRAGMA user_version = 6")
+
+    with Database(db_path) as db:
+        db.cursor.execute("PRAGMA table_info(indexed_files)")
+        assert [row[1] for row in db.cursor.fetchall()] == ["nix_path", "blob"]
+        assert db.get_indexed_blobs() == {"pkgs/a.nix": "abc"}
+
+def test_transaction_batches_writes_and_rolls_back(tmp_path):
+    """Writes inside a transaction are committed together, or not at all."""
+    db_path = str(tmp_path / "db.sqlite")
+    with Database(db_path) as db:
+        with db.transaction():
+            db.upsert_scan_result("pkg-a", [{"path": "a.nix", "owner": "o", "repo": "a"}])
+            db.upsert_scan_result("pkg-b", [{"path": "b.nix", "owner": "o", "repo": "b"}])
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                db.upsert_scan_result("pkg-c", [{"path": "c.nix", "owner": "o", "repo": "c"}])
+                raise RuntimeError("interrupted")
+
+    with Database(db_path) as db:
+        db.cursor.execute("SELECT package_name FROM scans ORDER BY package_name")
+        assert [row[0] for row in db.cursor.fetchall()] == ["pkg-a", "pkg-b"]
+
+def test_readers_see_committed_data_while_writing(tmp_path):
+    """In WAL mode a second connection can read while the first holds an open write transaction."""
+    db_path = str(tmp_path / "db.sqlite")
+    with Database(db_path) as writer, Database(db_path) as reader:
+        assert writer.cursor.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        writer.upsert_scan_result("pkg", [{"path": "a.nix", "owner": "o", "repo": "a"}])
+        with writer.transaction():
+            writer.upsert_scan_result("pkg", [])
+            assert reader.get_scan_repositories("pkg") == [{"path": "a.nix", "owner": "o", "repo": "a"}]
+        assert reader.get_scan_repositories("pkg") == []
+
+def test_report_matrix_uses_latest_runs(mem_db):
+    """One query covers every specifier, and only the latest complete run of each counts."""
+    mem_db.upsert_scan_result("hatchling", [{"path": "pkgs/a.nix", "owner": "o", "repo": "a"},
+                                            {"path": "pkgs/b.nix", "owner": "o", "repo": "b"}])
+    mem_db.upsert_scan_result("flit-core", [{"path": "pkgs/a.nix", "owner": "o", "repo": "a"}])
+    mem_db.insert_search_result("hatchling", "hatchling==1.27.0", {"o/a", "o/b"})
+    mem_db.cursor.execute("UPDATE search_runs SET last_update = '2000-01-01'")
+    mem_db.insert_search_result("hatchling", "hatchling==1.27.0", {"o/b"})
+    mem_db.insert_search_result("flit-core", "flit-core==3.9", {"O/A"})
+    mem_db.start_search_run("flit-core", "flit-core==3.9", {"q": "https://unfinished"})
+
+    assert list(mem_db.iter_report_matrix()) == [
+        ("pkgs/a.nix", "flit-core", "flit-core==3.9", "o/a"),
+        ("pkgs/b.nix", "hatchling", "hatchling==1.27.0", "o/b"),
+    ]
+    assert list(mem_db.iter_report_matrix([("flit-core", "flit-core==3.9")])) == [
+        ("pkgs/a.nix", "flit-core", "flit-core==3.9", "o/a"),
+    ]
+    assert list(mem_db.iter_report_matrix([])) == []
+
+HISTORY = [{"o/a", "o/b"}, {"o/b", "o/c"}, {"o/c"}, {"o/c", "o/a"}]
+
+def make_history(db):
+    db.upsert_scan_result("pkg", [])
+    ids = [db.insert_search_result("pkg", "pkg==1.0", repos) for repos in HISTORY]
+    # One run per day, ending yesterday
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for day, search_id in enumerate(ids):
+        db.cursor.execute("UPDATE search_runs SET last_update = ? WHERE id = ?",
+                          ((start + timedelta(days=day)).isoformat(), search_id))
+    return ids, start
+
+def test_compacted_runs_are_rebuilt_from_deltas(mem_db):
+    ids, _ = make_history(mem_db)
+    assert mem_db.compact_search_history(keep_runs=1, keep_age=None) == 3
+    assert mem_db.compact_search_history(keep_runs=1, keep_age=None) == 0
+    mem_db.cursor.execute("SELECT DISTINCT search_id FROM search_matches")
+    assert mem_db.cursor.fetchall() == [(ids[-1],)]
+    for search_id, repos in zip(ids, HISTORY):
+        assert set(mem_db.get_search_run_matches(search_id).values()) == repos
+
+def test_retention_keeps_recent_runs(mem_db):
+    make_history(mem_db)
+    # Every run is younger than ten years
+    assert mem_db.compact_search_history(keep_runs=1, keep_age=timedelta(days=3650)) == 0
+    assert mem_db.compact_search_history(keep_runs=3, keep_age=None) == 1
+
+def test_new_run_after_compaction_gets_a_delta(mem_db):
+    ids, _ = make_history(mem_db)
+    mem_db.compact_search_history(keep_runs=1, keep_age=None)
+    new_id = mem_db.insert_search_result("pkg", "pkg==1.0", {"o/d"})
+    mem_db.compact_search_history(keep_runs=1, keep_age=None)
+    assert set(mem_db.get_search_run_matches(ids[-1]).values()) == HISTORY[-1]
+    assert set(mem_db.get_search_run_matches(new_id).values()) == {"o/d"}
+
+def test_search_changes_since(mem_db):
+    _, start = make_history(mem_db)
+    mem_db.compact_search_history(keep_runs=1, keep_age=None)
+    # Since the first run: o/b came and went, o/a went and came back
+    assert mem_db.get_search_changes("pkg", "pkg==1.0", start) == (["o/c"], ["o/b"])
+    assert mem_db.get_search_changes("pkg", "pkg==1.0", start + timedelta(days=2)) == (["o/a"], [])
+    assert mem_db.get_search_changes("pkg", "pkg==1.0", start + timedelta(days=3)) == ([], [])
+
+def scan_shard(db, paths, shard):
+    db.start_scan_results(["pkg"])
+    db.add_scan_repositories([("pkg", {"path": path, "owner": "o", "repo": path}) for path in paths
+                              if shard is None or shard_of(path, shard[1]) == shard[0]])
+    db.finish_scan_results(["pkg"], shard=shard)
+
+def test_shard_of_is_stable():
+    assert shard_of("pkgs/a/default.nix", 4) == shard_of("pkgs\\a\\default.nix", 4)
+    assert {shard_of(f"pkgs/{i}.nix", 4) for i in range(100)} == {1, 2, 3, 4}
+
+def test_merge_sharded_scans(tmp_path, mem_db):
+    paths = [f"pkgs/{i}.nix" for i in range(20)]
+    for shard in (1, 2):
+        with Database(str(tmp_path / f"shard{shard}.sqlite")) as db:
+            scan_shard(db, paths, (shard, 2))
+    for shard in (1, 2):
+        with Database(str(tmp_path / f"shard{shard}.sqlite")) as source, mem_db.transaction():
+            assert mem_db.merge_database(source)["scans"] == 1
+    assert sorted(r["path"] for r in mem_db.get_scan_repositories("pkg")) == sorted(paths)
+
+    # Merging a shard again changes nothing; a newer full scan replaces the shards
+    with Database(str(tmp_path / "shard1.sqlite")) as source:
+        assert mem_db.merge_database(source)["scans"] == 0
+    with Database(str(tmp_path / "full.sqlite")) as db:
+        scan_shard(db, paths[:3], None)
+    with Database(str(tmp_path / "full.sqlite")) as source:
+        assert mem_db.merge_database(source)["scans"] == 1
+    assert sorted(r["path"] for r in mem_db.get_scan_repositories("pkg")) == paths[:3]
+
+def test_merge_search_runs_and_pins(tmp_path, mem_db):
+    ids, start = make_history(mem_db)
+    with Database(str(tmp_path / "other.sqlite")) as other:
+        other_ids, _ = make_history(other)
+        # The other host also ran the search a day after us, and checked a pin
+        other.cursor.execute("UPDATE search_runs SET last_update = ? WHERE id = ?",
+                             ((start + timedelta(days=len(HISTORY))).isoformat(), other_ids[0]))
+        other.compact_search_history(keep_runs=1, keep_age=None)
+        other.store_pins("pkg", {"o/a": ["pkg<2"]}, "pyproject")
+    with Database(str(tmp_path / "other.sqlite")) as source:
+        counts = mem_db.merge_database(source)
+    assert counts["search_runs"] == 1 and counts["pin_checks"] == 1
+    assert set(mem_db.get_search_run_matches(ids[-1] + 1).values()) == HISTORY[0]
+    assert mem_db.get_search_changes("pkg", "pkg==1.0", start + timedelta(days=3)) == (["o/b"], ["o/c"])
+    mem_db.compact_search_history(keep_runs=1, keep_age=None)
+    for search_id, repos in zip(ids, HISTORY):
+        assert set(mem_db.get_search_run_matches(search_id).values()) == repos
+    assert mem_db.get_cached_pins("pkg", ["o/a"], None) == {"o/a": ["pkg<2"]}
+
+def test_merge_leaves_sources_untouched(tmp_path, mem_db):
+    """Sources are read as they are; one of an older schema is migrated in a copy."""
+    paths = [str(tmp_path / "current.sqlite"), str(tmp_path / "v6.sqlite")]
+    for db_path, package_name in zip(paths, ("pkg-a", "pkg-b")):
+        with Database(db_path) as db:
+            db.upsert_scan_result(package_name, [{"path": f"{package_name}.nix", "owner": "o", "repo": package_name}])
+            if package_name == "pkg-b":
+                db.cursor.execute("ALTER TABLE indexed_files ADD COLUMN content TEXT")
+                db.cursor.execute("PRAGMA user_version = 6")
+    contents = [open(db_path, "rb").read() for db_path in paths]
+
+    run_merge(paths, mem_db)
+    assert [open(db_path, "rb").read() for db_path in paths] == contents
+    assert [r["repo"] for r in mem_db.get_scan_repositories("pkg-a") + mem_db.get_scan_repositories("pkg-b")] == ["pkg-a", "pkg-b"]
@@ -0,0 +1,35 @@
+import pytest
+from unpin_python.database import Database
+from unpin_python.gitscan import git_tree_files, iter_git_blobs, parse_new_blobs, run_revision_scan
+
+@pytest.fixture
+def nixpkgs(nixpkgs, git, nix_expression):
+    """The repository on a 'release' branch, and a newer 'unstable' one."""
+    git(nixpkgs, "branch", "-m", "release")
+    git(nixpkgs, "checkout", "-q", "-b", "unstable")
+    (nixpkgs / "pkgs" / "b.nix").write_text(nix_expression("b", "hatchling"))
+    git(nixpkgs, "commit", "-q", "-a", "-m", "switch b to hatchling")
+    # The working tree itself is never read
+    (nixpkgs / "pkgs" / "a.nix").write_text("{ }: { }\n")
+    return nixpkgs
+
+def test_iter_git_blobs(nixpkgs, nix_expression):
+    tree = git_tree_files(str(nixpkgs), "release")
+    assert sorted(tree) == ["pkgs/a.nix", "pkgs/b.nix", "pkgs/plain.nix"]
+    blobs = dict(iter_git_blobs(str(nixpkgs), [tree["pkgs/a.nix"], "0" * 40, tree["pkgs/b.nix"]]))
+    assert blobs[tree["pkgs/a.nix"]] == (nix_expression("a", "hatchling")).encode()
+    assert "0" * 40 not in blobs
+
+def test_run_revision_scan_parses_each_blob_once(nixpkgs, tmp_path):
+    """Each revision's results are stored separately, and unchanged files aren't parsed again."""
+    db_path = str(tmp_path / "db.sqlite")
+    run_revision_scan(["hatchling"], str(nixpkgs), "release", db_path, workers=1)
+    with Database(db_path) as db:
+        assert parse_new_blobs(db, str(nixpkgs), git_tree_files(str(nixpkgs), "unstable").values(), workers=1) == 1
+    run_revision_scan(["hatchling"], str(nixpkgs), "unstable", db_path, workers=1)
+
+    with Database(db_path) as db:
+        assert [r['repo'] for r in db.get_scan_repositories("hatchling", "release")] == ["a"]
+        assert [r['repo'] for r in db.get_scan_repositories("hatchling", "unstable")] == ["a", "b"]
+        assert db.get_scan_repositories("hatchling", "") == []
+        assert set(db.get_scan_revisions("hatchling")) == {"release", "unstable"}
@@ -0,0 +1,77 @@
+import json
+import pytest
+from datetime import timedelta
+from unittest.mock import MagicMock
+import requests
+from unpin_python.httpcache import ResponseCache
+
+URL = "https://api.github.com/search/code?q=x&page=2"
+
+def make_response(status_code=200, body=None, headers=None, url=URL):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.headers.update(headers or {})
+    response._content = json.dumps(body).encode() if body is not None else b""
+    return response
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    return now
+
+@pytest.fixture
+def cache(clock):
+    cache = ResponseCache(':memory:', ttl=timedelta(seconds=60), clock=lambda: clock[0])
+    yield cache
+    cache.close()
+
+def test_fresh_response_is_served_without_network(cache):
+    scheduler = MagicMock()
+    scheduler.get.return_value = make_response(body={"items": [1]}, headers={"ETag": '"abc"'})
+    assert cache.get(URL, scheduler).json() == {"items": [1]}
+
+    cached = cache.get(URL, scheduler)
+    assert cached.json() == {"items": [1]}
+    assert cached.from_cache
+    assert scheduler.get.call_count == 1
+
+def test_stale_response_is_revalidated_with_etag(cache, clock):
+    """After the TTL, an If-None-Match request is sent and a 304 serves the stored body."""
+    scheduler = MagicMock()
+    scheduler.get.return_value = make_response(body={"items": [1]}, headers={"ETag": '"abc"', "Link": '<https://next>; rel="next"'})
+    cache.get(URL, scheduler, headers={"Accept": "x"})
+
+    clock[0] += 120
+    scheduler.get.return_value = make_response(304)
+    response = cache.get(URL, scheduler, headers={"Accept": "x"})
+
+    assert response.json() == {"items": [1]}
+    assert response.links["next"]["url"] == "https://next"
+    assert scheduler.get.call_args.kwargs["headers"] == {"Accept": "x", "If-None-Match": '"abc"'}
+
+def test_offline_serves_stale_entries_and_misses(cache, clock):
+    scheduler = MagicMock()
+    scheduler.get.return_value = make_response(body={"items": []})
+    cache.get(URL, scheduler)
+    clock[0] += 3600
+
+    assert cache.get(URL, scheduler, offline=True).json() == {"items": []}
+    assert cache.get(URL + "&page=3", scheduler, offline=True) is None
+    assert scheduler.get.call_count == 1
+
+def test_least_recently_used_entries_are_evicted(cache, clock):
+    scheduler = MagicMock()
+    cache.max_bytes = 2 * len(json.dumps({"n": 0}))
+    for n in range(3):
+        clock[0] += 1
+        scheduler.get.return_value = make_response(body={"n": n}, url=f"{URL}{n}")
+        cache.get(f"{URL}{n}", scheduler)
+        if n == 1:
+            # Touch the first entry so the second becomes the least recently used
+            clock[0] += 1
+            cache.get(f"{URL}0", scheduler)
+
+    assert cache.get(f"{URL}0", scheduler, offline=True) is not None
+    assert cache.get(f"{URL}1", scheduler, offline=True) is None
+    assert cache.get(f"{URL}2", scheduler, offline=True) is not None
@@ -0,0 +1,40 @@
+from unpin_python.index import update_index, git_blob_hash
+
+def test_git_blob_hash():
+    """The blob hash must match `git hash-object` for an empty file."""
+    assert git_blob_hash(b"") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+
+def test_update_index_full_then_incremental(nixpkgs, mem_db, git, nix_expression):
+    """A first update indexes every file; later ones only re-parse files changed since the indexed commit."""
+    assert update_index(mem_db, str(nixpkgs)) == 3
+    assert [r['repo'] for r in mem_db.find_indexed_repositories("HATCHLING")] == ["a"]
+
+    # Nothing changed, nothing to re-parse
+    assert update_index(mem_db, str(nixpkgs)) == 0
+
+    (nixpkgs / "pkgs" / "b.nix").write_text(nix_expression("b", "hatchling"))
+    (nixpkgs / "pkgs" / "plain.nix").unlink()
+    git(nixpkgs, "commit", "-q", "-a", "-m", "switch b to hatchling")
+
+    assert update_index(mem_db, str(nixpkgs)) == 1
+    assert sorted(r['repo'] for r in mem_db.find_indexed_repositories("hatchling")) == ["a", "b"]
+    assert "pkgs/plain.nix" not in mem_db.get_indexed_blobs()
+
+def test_update_index_drops_renamed_files(nixpkgs, mem_db, git):
+    update_index(mem_db, str(nixpkgs))
+    git(nixpkgs, "mv", "pkgs/a.nix", "pkgs/c.nix")
+    git(nixpkgs, "commit", "-q", "-m", "rename a")
+
+    update_index(mem_db, str(nixpkgs))
+    assert [r['path'] for r in mem_db.find_indexed_repositories("hatchling")] == ["pkgs/c.nix"]
+    assert "pkgs/a.nix" not in mem_db.get_indexed_blobs()
+
+def test_update_index_rereads_reverted_edits(nixpkgs, mem_db, git, nix_expression):
+    """A file indexed while dirty is re-read after it is reverted, though the diff no longer lists it."""
+    (nixpkgs / "pkgs" / "b.nix").write_text(nix_expression("b", "hatchling"))
+    update_index(mem_db, str(nixpkgs))
+    assert sorted(r['repo'] for r in mem_db.find_indexed_repositories("hatchling")) == ["a", "b"]
+
+    git(nixpkgs, "checkout", "--", "pkgs/b.nix")
+    assert update_index(mem_db, str(nixpkgs)) == 1
+    assert [r['repo'] for r in mem_db.find_indexed_repositories("hatchling")] == ["a"]
@@ -1,30 +1,42 @@
+import os
+import subprocess
+import sys
 import pytest
-from unpin_python.main import parse_specifier
+import argparse
+from unpin_python.main import parse_shard
 
-def test_parse_specifier_with_version():
-    """Test parsing a specifier with a version."""
-    name, with_spaces, canonical = parse_specifier("hatchling==1.27.0")
-    assert name == "hatchling"
-    assert with_spaces == "hatchling == 1.27.0"
-    assert canonical == "hatchling==1.27.0"
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def test_parse_specifier_with_spaces():
-    """Test parsing a specifier with spaces around the operator."""
-    name, with_spaces, canonical = parse_specifier("hatchling >= 1.27.0")
-    assert name == "hatchling"
-    assert with_spaces == "hatchling >= 1.27.0"
-    assert canonical == "hatchling>=1.27.0"
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    assert parse_shard(" 1 / 1 ") == (1, 1)
+    for bad in ("0/4", "5/4", "4", "a/b"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(bad)
 
-def test_parse_specifier_no_version():
-    """Test parsing a specifier with no version, which implies a search for pinning."""
-    name, with_spaces, canonical = parse_specifier("hatchling")
-    assert name == "hatchling"
-    assert with_spaces == "hatchling == "
-    assert canonical == "hatchling=="
+# Generous enough for a slow CI runner; importing requests and tqdm alone takes longer than this
+IMPORT_BUDGET_SECONDS = 0.15
+HEAVY_MODULES = {'requests', 'tqdm', 'dotenv'}
 
-def test_parse_specifier_with_extra_spaces():
-    """Test parsing with extra whitespace."""
-    name, with_spaces, canonical = parse_specifier("  hatchling  !=  1.0  ")
-    assert name == "hatchling"
-    assert with_spaces == "hatchling != 1.0"
-    assert canonical == "hatchling!=1.0"
+def import_times(*args, cwd=None):
+    """Runs Python with -X importtime and returns {module: cumulative seconds}."""
+    env = dict(os.environ, PYTHONPATH=PACKAGE_ROOT)
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+def test_main_imports_within_budget():
+    times = import_times("-c", "import unpin_python.main")
+    assert not HEAVY_MODULES & set(times)
+    assert times["unpin_python.main"] < IMPORT_BUDGET_SECONDS
+
+def test_database_commands_skip_heavy_imports(tmp_path):
+    for command in (["report", "--all"], ["reset", "nothing"], ["compact"], ["merge", "missing.sqlite"]):
+        times = import_times("-m", "unpin_python.main", *command, cwd=tmp_path)
+        assert not HEAVY_MODULES & set(times), command
@@ -0,0 +1,59 @@
+import json
+import pytest
+from pathlib import Path
+from unpin_python.nixparse import iter_dependency_names, iter_fetchers, tokenize, might_contain_fetchers
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+EXPECTED = json.loads((CORPUS_DIR / "expected.json").read_text())
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_corpus(name):
+    """Every corpus file must yield exactly the recorded fetchers."""
+    content = (CORPUS_DIR / name).read_text()
+    assert list(iter_fetchers(content)) == EXPECTED[name]
+
+def test_corpus_is_complete():
+    """New corpus files need an entry in expected.json."""
+    assert sorted(p.name for p in CORPUS_DIR.glob("*.nix")) == sorted(EXPECTED)
+
+def test_tokenize_strings_and_interpolations():
+    """Strings are single tokens, and code inside their interpolations is not yielded."""
+    tokens = list(tokenize('x = "a${ { y = "}"; } }b"; # c\n'))
+    assert tokens == [('ident', 'x'), ('=', '='), ('str', 'a${ { y = "}"; } }b'), (';', ';')]
+
+def test_fetcher_without_trailing_semicolon():
+    """The lazy regex needed `};`; the tokenizer finds blocks however they end."""
+    content = 'fetchFromGitHub { owner = "o"; repo = "r"; }\n' * 2000
+    fetchers = list(iter_fetchers(content))
+    assert len(fetchers) == 2000
+    assert fetchers[0]['owner'] == "o"
+
+def test_might_contain_fetchers():
+    assert might_contain_fetchers(b"src = fetchFromGitHub {")
+    assert might_contain_fetchers(b'url = "https://github.com/o/r";')
+    assert not might_contain_fetchers(b"src = fetchPypi { };")
+
+def test_iter_dependency_names():
+    """Function arguments and dependency lists count; descriptions, strings and other bindings don't."""
+    content = """
+{ lib, python3Packages }:
+python3Packages.buildPythonApplication {
+  pname = "flit";
+  nativeBuildInputs = with python3Packages; [ hatchling ] ++ lib.optionals true [ flit-core ];
+  pythonRelaxDeps = [ "setuptools" ];
+  optional-dependencies = { socks = [ python3Packages.pysocks ]; };
+  meta.description = "Uses poetry";
+  wheel = null;
+}
+"""
+    names = set(iter_dependency_names(content))
+    assert {"python3Packages", "hatchling", "flit-core", "pysocks"} <= names
+    assert not names & {"flit", "setuptools", "poetry", "wheel", "pname"}
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_tokens_are_reusable(name):
+    """Dependencies and fetchers read from one token list match those read from the text."""
+    content = (CORPUS_DIR / name).read_text()
+    tokens = list(tokenize(content))
+    assert list(iter_fetchers(content, tokens)) == EXPECTED[name]
+    assert list(iter_dependency_names(content, tokens)) == list(iter_dependency_names(content))
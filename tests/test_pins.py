@@ -0,0 +1,76 @@
+import pytest
+from unpin_python.pins import extract_requirements, parse_search_string, parse_specifier, requirement_satisfies, version_key
+
+PYPROJECT = """
+[build-system]
+requires = ["hatchling==1.27.0", "hatch-vcs>=0.4"]
+
+[project]
+dependencies = ['Hatchling[extra] >= 1.20, < 2', "hatchling"]
+"""
+
+def test_extract_requirements():
+    """Only constrained requirements for the exact package are returned."""
+    assert extract_requirements(PYPROJECT, "hatchling") == ["hatchling==1.27.0", "Hatchling[extra] >= 1.20, < 2"]
+
+def test_parse_search_string():
+    assert parse_search_string("hatchling>=1.26") == (">=", "1.26")
+    assert parse_search_string("hatchling==") == ("==", "")
+
+def test_version_key_ordering():
+    versions = ["1.0.dev1", "1.0a1", "1.0rc1", "1.0", "1.0.post1", "1.0.1", "1.10"]
+    assert sorted(versions, key=version_key) == versions
+    assert version_key("1.27") == version_key("1.27.0")
+
+def test_version_key_compares_suffix_numbers():
+    """Suffix numbers compare as numbers, and dev releases come before what they lead up to."""
+    versions = ["1.0.dev2", "1.0.dev10", "1.0a1.dev1", "1.0a1", "1.0rc2", "1.0rc10", "1.0",
+                "1.0.post1.dev1", "1.0.post1", "1.0.post10"]
+    assert sorted(reversed(versions), key=version_key) == versions
+    assert version_key("1.0-1") == version_key("1.0.post1")
+    assert version_key("1.0+local") == version_key("1.0")
+
+@pytest.mark.parametrize("requirement, operator, version, expected", [
+    ("hatchling==1.27.0", "==", "1.27.0", True),
+    ("hatchling==1.27.0", "==", "1.27", True),
+    ("hatchling==1.27.0", ">=", "1.26", True),
+    ("hatchling==1.27.0", "<", "1.27", False),
+    ("hatchling==1.27.0", "!=", "1.27.0", False),
+    ("hatchling==1.27.0", "==", "", True),
+    ("hatchling>=1.26", ">=", "1.26", True),
+    ("hatchling>=1.26", ">=", "1.20", False),
+    ("hatchling==1.*", ">=", "1.0", False),
+    ("hatchling==1.0rc10", ">=", "1.0rc2", True),
+    ("hatchling==1.0rc10", "<", "1.0", True),
+    ("hatchling==1.0.post2", ">", "1.0.post10", False),
+])
+def test_requirement_satisfies(requirement, operator, version, expected):
+    assert requirement_satisfies(requirement, operator, version) is expected
+
+def test_parse_specifier_with_version():
+    """Test parsing a specifier with a version."""
+    name, with_spaces, canonical = parse_specifier("hatchling==1.27.0")
+    assert name == "hatchling"
+    assert with_spaces == "hatchling == 1.27.0"
+    assert canonical == "hatchling==1.27.0"
+
+def test_parse_specifier_with_spaces():
+    """Test parsing a specifier with spaces around the operator."""
+    name, with_spaces, canonical = parse_specifier("hatchling >= 1.27.0")
+    assert name == "hatchling"
+    assert with_spaces == "hatchling >= 1.27.0"
+    assert canonical == "hatchling>=1.27.0"
+
+def test_parse_specifier_no_version():
+    """Test parsing a specifier with no version, which implies a search for pinning."""
+    name, with_spaces, canonical = parse_specifier("hatchling")
+    assert name == "hatchling"
+    assert with_spaces == "hatchling == "
+    assert canonical == "hatchling=="
+
+def test_parse_specifier_with_extra_spaces():
+    """Test parsing with extra whitespace."""
+    name, with_spaces, canonical = parse_specifier("  hatchling  !=  1.0  ")
+    assert name == "hatchling"
+    assert with_spaces == "hatchling != 1.0"
+    assert canonical == "hatchling!=1.0"
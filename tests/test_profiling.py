@@ -0,0 +1,52 @@
+import json
+import pytest
+from unpin_python import profiling
+from unpin_python.scan import extract_files
+
+@pytest.fixture
+def profile():
+    yield profiling.enable()
+    profiling.disable()
+
+def test_disabled_profiling_records_nothing():
+    profiling.disable()
+    with profiling.span("stage"):
+        profiling.count("things")
+    assert profiling.take() is None
+    assert not profiling.enabled()
+
+def test_spans_and_counters_are_summarized(profile):
+    with profiling.span("stage"):
+        profiling.count("things", 3)
+    with profiling.span("stage"):
+        profiling.count("things")
+    profiling.add_time("sleep", 1.5)
+    summary = profile.summary()
+    assert summary["spans"]["stage"]["calls"] == 2
+    assert summary["spans"]["sleep"] == {"calls": 1, "seconds": 1.5}
+    assert summary["counters"] == {"things": 4}
+
+def test_take_and_merge_move_counts_between_profiles(profile):
+    profiling.count("things", 2)
+    state = profiling.take()
+    assert profile.summary()["counters"] == {}
+    profiling.merge(state)
+    profiling.merge(state)
+    assert profile.summary()["counters"] == {"things": 4}
+
+def test_worker_counters_reach_the_parent(profile, tmp_path, monkeypatch):
+    """Files read in worker processes are counted once, in the parent's profile."""
+    monkeypatch.setattr('unpin_python.scan.PARALLEL_MIN_FILES', 2)
+    files = []
+    for i in range(6):
+        path = tmp_path / f"f{i}.nix"
+        path.write_text("{ hatchling }: fetchFromGitHub { owner = \"o\"; repo = \"r\"; }")
+        files.append(str(path))
+    list(extract_files(iter(files), str(tmp_path), ["hatchling"], workers=2))
+    assert profile.summary()["counters"]["scan.files_read"] == 6
+
+def test_write_summary(profile, tmp_path):
+    profiling.count("things")
+    output = tmp_path / "profile.json"
+    profiling.write_summary(str(output))
+    assert json.loads(output.read_text())["counters"] == {"things": 1}
@@ -0,0 +1,90 @@
+import pytest
+from unittest.mock import MagicMock
+from unpin_python.ratelimit import RequestScheduler, TokenBucket, load_tokens
+
+def make_response(status_code=200, headers=None, text=""):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.text = text
+    return response
+
+def make_scheduler(tokens, responses, now=1000):
+    session = MagicMock()
+    session.get.side_effect = responses
+    sleeps = []
+    scheduler = RequestScheduler(tokens, session=session, clock=lambda: now, sleep=sleeps.append)
+    # Keep pacing out of the way; these tests are about rate-limit responses
+    scheduler.bucket = TokenBucket(rate=1000, capacity=1000)
+    return scheduler, session, sleeps
+
+def test_load_tokens(monkeypatch):
+    """Tokens from both variables are combined, deduplicated and placeholders dropped."""
+    monkeypatch.setenv("GITHUB_SEARCH_TOKENS", "a, b\nc")
+    monkeypatch.setenv("GITHUB_SEARCH_TOKEN", "a")
+    assert load_tokens() == ["a", "b", "c"]
+    monkeypatch.delenv("GITHUB_SEARCH_TOKENS")
+    monkeypatch.setenv("GITHUB_SEARCH_TOKEN", "your_github_token_here")
+    assert load_tokens() == []
+
+def test_token_bucket_paces_after_burst():
+    """Once the burst capacity is spent, callers wait 1/rate per token."""
+    now = [0.0]
+    sleeps = []
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleeps.append)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(1.0)
+    assert sleeps == [pytest.approx(0.5), pytest.approx(1.0)]
+
+def test_exhausted_token_rotates_without_sleeping():
+    """A 403 with no remaining quota switches to another token instead of sleeping."""
+    scheduler, session, sleeps = make_scheduler(["t1", "t2"], [
+        make_response(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1060"}),
+        make_response(200, {"X-RateLimit-Remaining": "9"}),
+    ])
+    assert scheduler.get("https://api.github.com/x").status_code == 200
+    tokens_used = [call.kwargs["headers"]["Authorization"] for call in session.get.call_args_list]
+    assert tokens_used == ["Bearer t1", "Bearer t2"]
+    assert sleeps == []
+
+def test_waits_for_reset_when_all_tokens_exhausted():
+    """With every token exhausted, the scheduler sleeps until the earliest reset."""
+    scheduler, session, sleeps = make_scheduler(["t1"], [
+        make_response(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1030"}),
+        make_response(200),
+    ])
+    assert scheduler.get("https://api.github.com/x").status_code == 200
+    assert sleeps == [31]
+
+def test_retry_after_is_honored():
+    scheduler, session, sleeps = make_scheduler(["t1"], [
+        make_response(429, {"Retry-After": "7"}),
+        make_response(200),
+    ])
+    assert scheduler.get("https://api.github.com/x").status_code == 200
+    assert sleeps == [7]
+
+def test_only_secondary_limits_back_off():
+    """A 403 naming the secondary rate limit is retried; any other 403 fails at once."""
+    scheduler, session, sleeps = make_scheduler(["t1"], [
+        make_response(403, {"X-RateLimit-Remaining": "9"}, '{"message": "You have exceeded a secondary rate limit."}'),
+        make_response(200),
+    ])
+    assert scheduler.get("https://api.github.com/x").status_code == 200
+    assert len(sleeps) == 1
+
+    scheduler, session, sleeps = make_scheduler(["t1"], [
+        make_response(403, {"X-RateLimit-Remaining": "9"}, '{"message": "Resource protected by organization SAML enforcement."}'),
+        make_response(200),
+    ])
+    assert scheduler.get("https://api.github.com/x").status_code == 403
+    assert session.get.call_count == 1
+    assert sleeps == []
+
+def test_gives_up_after_max_retries():
+    scheduler, session, sleeps = make_scheduler(["t1"], [make_response(502)] * 10)
+    scheduler.max_retries = 2
+    assert scheduler.get("https://api.github.com/x").status_code == 502
+    assert session.get.call_count == 3
@@ -0,0 +1,42 @@
+import io
+import json
+from unpin_python.database import Database
+from datetime import datetime, timezone
+from unpin_python.report import run_changes_report, run_matrix_report
+
+def make_db():
+    db = Database(':memory:')
+    db.upsert_scan_result("hatchling", [{"path": "pkgs/a.nix", "owner": "o", "repo": "a"}])
+    db.upsert_scan_result("flit-core", [{"path": "pkgs/a.nix", "owner": "o", "repo": "a"},
+                                        {"path": "pkgs/b.nix", "owner": "o", "repo": "b"}])
+    db.insert_search_result("hatchling", "hatchling==1.27.0", {"o/a"})
+    db.insert_search_result("flit-core", "flit-core==3.9", {"o/a", "o/b"})
+    return db
+
+def test_run_matrix_report_formats():
+    """The same matrix streams as JSON Lines, CSV, or text grouped per path."""
+    db = make_db()
+    outputs = {}
+    for output_format in ('jsonl', 'csv', 'text'):
+        outputs[output_format] = io.StringIO()
+        run_matrix_report(None, db, output_format, outputs[output_format])
+    db.close()
+
+    rows = [json.loads(line) for line in outputs['jsonl'].getvalue().splitlines()]
+    assert rows[0] == {"path": "pkgs/a.nix", "package": "flit-core", "search_string": "flit-core==3.9", "repository": "o/a"}
+    assert [(row['path'], row['package']) for row in rows] == [
+        ("pkgs/a.nix", "flit-core"), ("pkgs/a.nix", "hatchling"), ("pkgs/b.nix", "flit-core")]
+    assert outputs['csv'].getvalue().splitlines()[:2] == [
+        "path,package,search_string,repository", "pkgs/a.nix,flit-core,flit-core==3.9,o/a"]
+    assert outputs['text'].getvalue() == "pkgs/a.nix\tflit-core==3.9, hatchling==1.27.0\npkgs/b.nix\tflit-core==3.9\n"
+
+def test_run_changes_report(capsys):
+    db = make_db()
+    since = datetime.now(timezone.utc)
+    db.insert_search_result("flit-core", "flit-core==3.9", {"o/b", "x/new"})
+    run_changes_report("flit-core", "flit-core==3.9", db, since)
+    run_changes_report("hatchling", "hatchling==1.27.0", db, since)
+    db.close()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1:3] == ["+ x/new", "- o/a\tpkgs/a.nix"]
+    assert lines[-1] == "No changes."
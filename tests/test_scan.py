@@ -1,7 +1,10 @@
 import pytest
 import os
-from unpin_python.scan import run_scan, extract_repo_info
-from unittest.mock import MagicMock, patch
+import re
+from unpin_python.scan import (run_scan, run_batch_scan, extract_files, name_pattern,
+                               build_python_attribute_index, iter_candidate_files, iter_builtin_candidate_files)
+from unittest.mock import patch
+from unpin_python.database import Database, shard_of
 
 # A mock of a nix file content
 MOCK_NIX_FILE_CONTENT = """
@@ -22,40 +25,217 @@ python3Packages.buildPythonApplication rec {
 }
 """
 
-def test_extract_repo_info(tmp_path):
-    """Test extracting repository info from a mock nix file."""
-    nix_file = tmp_path / "default.nix"
+@patch('unpin_python.scan.iter_candidate_files')
+def test_run_scan_requires_a_declared_dependency(mock_find_files, tmp_path):
+    """A single-package scan applies the batch scan's rules: a mere mention doesn't count."""
+    declared = tmp_path / "declared.nix"
+    declared.write_text(MOCK_NIX_FILE_CONTENT)
+    mentioned = tmp_path / "mentioned.nix"
+    mentioned.write_text(MOCK_NIX_FILE_CONTENT.replace("buildInputs = [ python3Packages.hatchling ];",
+                                                       'description = "Not built with hatchling";'))
+    mock_find_files.return_value = iter([str(declared), str(mentioned)])
+    db_path = str(tmp_path / "db.sqlite")
+
+    run_scan("hatchling", str(tmp_path), db_path)
+
+    with Database(db_path) as db:
+        assert db.get_scan_repositories("hatchling") == [{"path": "declared.nix", "owner": "test-owner", "repo": "test-repo"}]
+
+@patch('unpin_python.scan.iter_candidate_files')
+def test_run_batch_scan(mock_find_files, tmp_path):
+    """Test that a batch scan assigns each file's repos to every package it mentions."""
+    shared_file = tmp_path / "shared.nix"
+    shared_file.write_text(MOCK_NIX_FILE_CONTENT.replace("python3Packages.hatchling", "hatchling flit-core"))
+    flit_file = tmp_path / "flit.nix"
+    flit_file.write_text(MOCK_NIX_FILE_CONTENT.replace("hatchling", "flit-core").replace("test-repo", "flit-repo"))
+    mock_find_files.return_value = iter([str(shared_file), str(flit_file)])
+    db_path = str(tmp_path / "db.sqlite")
+
+    run_batch_scan(["hatchling", "flit-core"], str(tmp_path), db_path)
+
+    mock_find_files.assert_called_once_with(str(tmp_path), ["hatchling", "flit-core"])
+    db = Database(db_path)
+    assert db.get_scan_repositories("hatchling") == [{"path": "shared.nix", "owner": "test-owner", "repo": "test-repo"}]
+    assert sorted(r["repo"] for r in db.get_scan_repositories("flit-core")) == ["flit-repo", "test-repo"]
+    db.close()
+
+@patch('unpin_python.scan.iter_candidate_files')
+def test_run_batch_scan_keeps_search_runs(mock_find_files, tmp_path):
+    """Rescanning replaces a package's repositories but not its search history."""
+    nix_file = tmp_path / "a.nix"
     nix_file.write_text(MOCK_NIX_FILE_CONTENT)
-    
-    nixpkgs_root = str(tmp_path)
-    result = extract_repo_info(str(nix_file), nixpkgs_root)
-    
-    assert len(result) == 1
-    assert result[0]['owner'] == 'test-owner'
-    assert result[0]['repo'] == 'test-repo'
-    assert result[0]['path'] == 'default.nix'
-
-@patch('unpin_python.scan.find_package_files')
-@patch('unpin_python.scan.extract_repo_info')
-@patch('unpin_python.scan.Database')
-def test_run_scan(MockDatabase, mock_extract_repo, mock_find_files, tmp_path):
-    """Test the main run_scan function using mocks."""
-    # Setup mocks
-    mock_db_instance = MockDatabase.return_value
-    mock_find_files.return_value = ["/fake/nixpkgs/pkgs/a/a.nix"]
-    mock_extract_repo.return_value = [{"path": "pkgs/a/a.nix", "owner": "test", "repo": "one"}]
-
-    nixpkgs_path = str(tmp_path)
-    os.makedirs(nixpkgs_path, exist_ok=True) # Ensure the directory exists
-
-    run_scan("test-pkg", nixpkgs_path, ":memory:")
-
-    # Assertions
-    mock_find_files.assert_called_once_with(nixpkgs_path, "test-pkg")
-    mock_extract_repo.assert_called_once_with("/fake/nixpkgs/pkgs/a/a.nix", nixpkgs_path)
-    mock_db_instance.upsert_scan_result.assert_called_once()
-    # Check that the data passed to upsert is correct
-    call_args = mock_db_instance.upsert_scan_result.call_args[0]
-    assert call_args[0] == "test-pkg"
-    assert call_args[1] == [{"path": "pkgs/a/a.nix", "owner": "test", "repo": "one"}]
-    mock_db_instance.close.assert_called_once()
+    db_path = str(tmp_path / "db.sqlite")
+    db = Database(db_path)
+    db.upsert_scan_result("hatchling", [{"path": "old.nix", "owner": "old", "repo": "old"}])
+    db.insert_search_result("hatchling", "hatchling==1.0", {"test-owner/test-repo"})
+    db.close()
+    mock_find_files.return_value = iter([str(nix_file)])
+
+    run_batch_scan(["hatchling"], str(tmp_path), db_path)
+
+    db = Database(db_path)
+    assert db.get_latest_search_report("hatchling", "hatchling==1.0") == [{"path": "a.nix", "package": "hatchling"}]
+    db.close()
+
+@patch('unpin_python.scan.iter_candidate_files')
+def test_run_batch_scan_commits_in_batches(mock_find_files, tmp_path, monkeypatch):
+    """Other connections can write between batches, and read the previous scan until the last one."""
+    files = []
+    for i in range(3):
+        nix_file = tmp_path / f"{i}.nix"
+        nix_file.write_text(MOCK_NIX_FILE_CONTENT.replace("test-repo", f"repo{i}"))
+        files.append(str(nix_file))
+    mock_find_files.return_value = iter(files)
+    db_path = str(tmp_path / "db.sqlite")
+    with Database(db_path) as db:
+        db.upsert_scan_result("hatchling", [{"path": "old.nix", "owner": "old", "repo": "old"}])
+    monkeypatch.setattr('unpin_python.scan.WRITE_BATCH_SIZE', 1)
+    add_scan_repositories = Database.add_scan_repositories
+    seen = []
+
+    def add_and_check(db, batch, *args):
+        add_scan_repositories(db, batch, *args)
+        with Database(db_path) as other:
+            other.conn.execute("PRAGMA busy_timeout = 0")
+            other.insert_search_result("hatchling", "hatchling==1.0", set())
+            seen.append([r["path"] for r in other.get_scan_repositories("hatchling")])
+    monkeypatch.setattr(Database, 'add_scan_repositories', add_and_check)
+
+    run_batch_scan(["hatchling"], str(tmp_path), db_path)
+
+    assert seen == [["old.nix"]] * 4
+    with Database(db_path) as db:
+        assert sorted(r["path"] for r in db.get_scan_repositories("hatchling")) == ["0.nix", "1.nix", "2.nix"]
+
+@patch('unpin_python.scan.iter_candidate_files')
+def test_run_batch_scan_reads_files_that_arent_utf8(mock_find_files, tmp_path):
+    """Invalid bytes are replaced, as the index and revision scans do, instead of dropping the file."""
+    nix_file = tmp_path / "latin1.nix"
+    nix_file.write_bytes(MOCK_NIX_FILE_CONTENT.replace('"1.0"', '"1.0"; # Caf\xe9').encode('latin-1'))
+    mock_find_files.return_value = iter([str(nix_file)])
+    db_path = str(tmp_path / "db.sqlite")
+
+    run_batch_scan(["hatchling"], str(tmp_path), db_path)
+
+    with Database(db_path) as db:
+        assert db.get_scan_repositories("hatchling") == [{"path": "latin1.nix", "owner": "test-owner", "repo": "test-repo"}]
+
+def test_extract_files_parallel_matches_sequential(tmp_path):
+    """The process pool must return the same results as the in-process path."""
+    files = []
+    for i in range(8):
+        nix_file = tmp_path / f"pkg{i}.nix"
+        nix_file.write_text(MOCK_NIX_FILE_CONTENT.replace("test-repo", f"repo{i}"))
+        files.append(str(nix_file))
+    (tmp_path / "no-fetcher.nix").write_text("{ hatchling }: hatchling\n")
+    files.append(str(tmp_path / "no-fetcher.nix"))
+    patterns = ["hatchling"]
+
+    sequential = list(extract_files(files, str(tmp_path), patterns, workers=1))
+    with patch('unpin_python.scan.PARALLEL_MIN_FILES', 0):
+        # A stream of paths, as ripgrep produces them
+        parallel = list(extract_files(iter(files), str(tmp_path), patterns, workers=2))
+
+    assert parallel == sequential
+    assert sequential[-1] == ([], [])
+    assert sequential[3] == (["hatchling"], [{"path": "pkg3.nix", "owner": "test-owner", "repo": "repo3"}])
+
+def test_name_pattern_matches_whole_identifiers():
+    pattern = re.compile(name_pattern("flit_core"), re.IGNORECASE)
+    assert pattern.search("build-system = [ flit-core ];")
+    assert pattern.search("python3Packages.Flit-Core")
+    assert not pattern.search("build-system = [ flit-core-ext ];")
+    assert not pattern.search("myflit-core")
+
+def test_run_batch_scan_skips_own_definition(tmp_path):
+    """The file defining a Python attribute names it, but isn't a package that depends on it."""
+    modules = tmp_path / "pkgs" / "development" / "python-modules"
+    (modules / "hatchling").mkdir(parents=True)
+    (modules / "hatchling" / "default.nix").write_text(
+        MOCK_NIX_FILE_CONTENT.replace("python3Packages }", "python3Packages, hatchling }").replace("test-repo", "hatch"))
+    (modules / "user").mkdir()
+    (modules / "user" / "default.nix").write_text(MOCK_NIX_FILE_CONTENT)
+    top_level = tmp_path / "pkgs" / "top-level"
+    top_level.mkdir()
+    (top_level / "python-packages.nix").write_text(
+        "{\n  hatchling = callPackage ../development/python-modules/hatchling { };\n}\n")
+
+    assert build_python_attribute_index(str(tmp_path)) == {
+        "hatchling": {os.path.join("pkgs", "development", "python-modules", "hatchling", "default.nix")},
+        "user": {os.path.join("pkgs", "development", "python-modules", "user", "default.nix")},
+    }
+    db_path = str(tmp_path / "db.sqlite")
+    with patch('unpin_python.scan.iter_candidate_files') as mock_find_files:
+        mock_find_files.return_value = iter([str(modules / "hatchling" / "default.nix"), str(modules / "user" / "default.nix")])
+        run_batch_scan(["hatchling"], str(tmp_path), db_path)
+
+    db = Database(db_path)
+    assert [repo['repo'] for repo in db.get_scan_repositories("hatchling")] == ["test-repo"]
+    db.close()
+
+def test_iter_candidate_files_streams_ripgrep_output(tmp_path, monkeypatch, capsys):
+    """Paths are yielded line by line, and ripgrep's 'no match' exit status isn't an error."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake_rg = bin_dir / "rg"
+    fake_rg.write_text("#!/bin/sh\nprintf 'a.nix\\nb.nix\\n'\nexit ${RG_STATUS:-0}\n")
+    fake_rg.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    assert list(iter_candidate_files(str(tmp_path), ["hatchling"])) == ["a.nix", "b.nix"]
+    monkeypatch.setenv("RG_STATUS", "1")
+    list(iter_candidate_files(str(tmp_path), ["hatchling"]))
+    assert "Error" not in capsys.readouterr().err
+    monkeypatch.setenv("RG_STATUS", "2")
+    list(iter_candidate_files(str(tmp_path), ["hatchling"]))
+    assert "Error during file search" in capsys.readouterr().err
+
+def make_search_tree(root):
+    files = {
+        "pkgs/a/default.nix": "{ hatchling }: 1",
+        "pkgs/a/b/package.nix": "nativeBuildInputs = [ Flit_Core ];",
+        "pkgs/c/default.nix": "hatchling-vcs",  # a different identifier
+        "pkgs/c/notes.md": "hatchling",
+        "pkgs/.hidden/default.nix": "hatchling",
+        ".git/objects/x.nix": "hatchling",
+        "pkgs/d/big.nix": "x" * 4096 + "\n  HATCHLING\n",
+        "pkgs/d/empty.nix": "",
+    }
+    for path, content in files.items():
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(content)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_builtin_candidate_files_match_ripgrep_rules(tmp_path, monkeypatch, workers):
+    """Whole identifiers, case-insensitive, *.nix only, hidden entries skipped, large files mmapped."""
+    monkeypatch.setattr('unpin_python.scan.MMAP_MIN_BYTES', 1024)
+    make_search_tree(tmp_path)
+    found = iter_builtin_candidate_files(str(tmp_path), ["hatchling", "flit-core"], workers=workers)
+    assert sorted(os.path.relpath(path, tmp_path) for path in found) == [
+        "pkgs/a/b/package.nix", "pkgs/a/default.nix", "pkgs/d/big.nix"]
+
+def test_iter_candidate_files_falls_back_without_ripgrep(tmp_path, capsys):
+    make_search_tree(tmp_path)
+    with patch('unpin_python.scan.shutil.which', return_value=None):
+        found = list(iter_candidate_files(str(tmp_path), ["hatchling"]))
+    assert sorted(os.path.relpath(path, tmp_path) for path in found) == ["pkgs/a/default.nix", "pkgs/d/big.nix"]
+    assert "built-in file search" in capsys.readouterr().err
+
+@patch('unpin_python.scan.iter_candidate_files')
+def test_run_batch_scan_shard(mock_find_files, tmp_path):
+    """A sharded scan only parses the files of its shard."""
+    files = []
+    for i in range(8):
+        nix_file = tmp_path / f"{i}.nix"
+        nix_file.write_text(MOCK_NIX_FILE_CONTENT.replace("test-repo", f"repo{i}"))
+        files.append(str(nix_file))
+    db_path = str(tmp_path / "db.sqlite")
+    found = set()
+    for shard in (1, 2, 3):
+        mock_find_files.return_value = iter(files)
+        run_batch_scan(["hatchling"], str(tmp_path), db_path, shard=(shard, 3))
+        with Database(db_path) as db:
+            paths = {r["path"] for r in db.get_scan_repositories("hatchling")}
+        assert all(shard_of(path, 3) == shard for path in paths)
+        found |= paths
+    assert found == {f"{i}.nix" for i in range(8)}
@@ -1,45 +1,196 @@
 import pytest
-from unpin_python.search import run_search, search_github_all_repos
+import requests
+from unpin_python.database import Database
+from unpin_python.search import run_search, run_searches, fetch_search_page, fetch_repo_pins, with_page, search_url
 from unittest.mock import MagicMock, patch
 
-# Mock response from GitHub API
-MOCK_GITHUB_API_RESPONSE = {
-    "total_count": 1,
-    "incomplete_results": False,
-    "items": [
-        {
-            "repository": {
-                "full_name": "test-owner/test-repo"
-            }
-        }
-    ]
-}
+def make_page(items, next_url=None, last_url=None):
+    response = MagicMock()
+    response.json.return_value = {"items": items}
+    response.links = {"next": {"url": next_url}} if next_url else {}
+    if last_url:
+        response.links["last"] = {"url": last_url}
+    return response
 
-@patch('unpin_python.search.search_github_all_repos')
-@patch('unpin_python.search.Database')
+@patch('unpin_python.search.fetch_search_page')
+@patch('unpin_python.search.open_database')
 @patch('unpin_python.search.load_dotenv') # Don't need to load .env in tests
-def test_run_search(mock_dotenv, MockDatabase, mock_search_github):
+def test_run_search(mock_dotenv, mock_open_database, mock_iter_pages):
     """Test the main run_search function using mocks."""
     # Setup mocks
-    mock_db_instance = MockDatabase.return_value
+    mock_db_instance = mock_open_database.return_value.__enter__.return_value
     mock_db_instance.get_scan_repositories.return_value = [
         {"path": "pkgs/a/a.nix", "owner": "test-owner", "repo": "test-repo"},
         {"path": "pkgs/b/b.nix", "owner": "another-owner", "repo": "another-repo"}
     ]
-    mock_search_github.return_value = MOCK_GITHUB_API_RESPONSE['items']
+    mock_db_instance.start_search_run.return_value = 7
+    mock_iter_pages.return_value = ([{"full_name": "test-owner/test-repo", "fragments": []}], {})
 
     run_search("test-pkg", "test-pkg==1.0", "test-pkg==1.0", ":memory:")
     
     # Assertions
     mock_db_instance.get_scan_repositories.assert_called_once_with("test-pkg")
-    mock_search_github.assert_called_once()
-    mock_db_instance.insert_search_result.assert_called_once()
-    
-    # Check that the data passed to insert_search_result is correct
-    call_args = mock_db_instance.insert_search_result.call_args[0]
-    assert call_args[0] == "test-pkg" # package_name
-    assert call_args[1] == "test-pkg==1.0" # canonical_search_string
-    # The set of found repos on GH
-    assert call_args[2] == {"test-owner/test-repo"}
+    mock_iter_pages.assert_called_once()
+    mock_db_instance.start_search_run.assert_called_once()
+    assert mock_db_instance.start_search_run.call_args[0][:2] == ("test-pkg", "test-pkg==1.0")
+
+    # The page is stored with its (exhausted) cursor, then the run is completed
+    mock_db_instance.add_search_page.assert_called_once_with(
+        7, '"test-pkg==1.0"+filename:pyproject.toml', {"test-owner/test-repo"}, None)
+    mock_db_instance.finish_search_run.assert_called_once_with(7)
     
-    mock_db_instance.close.assert_called_once()
+    mock_open_database.return_value.__exit__.assert_called_once()
+
+def test_fetch_search_page_keeps_only_names_and_fragments():
+    scheduler = MagicMock()
+    scheduler.get.return_value = make_page(
+        [{"repository": {"full_name": "a/one", "id": 1}, "text_matches": [{"fragment": "x==1"}]},
+         {"repository": {"full_name": "b/two", "id": 2}}], "https://next")
+
+    matches, links = fetch_search_page("https://first", scheduler)
+
+    assert matches == [{"full_name": "a/one", "fragments": ["x==1"]}, {"full_name": "b/two", "fragments": []}]
+    assert links == {"next": "https://next"}
+
+@patch('unpin_python.search.get_scheduler')
+@patch('unpin_python.search.load_dotenv')
+def test_run_searches_prefetches_pages_of_every_specifier(mock_dotenv, mock_get_scheduler, tmp_path, monkeypatch):
+    """Once the last page is known the rest are fetched together, and variants merge into one run per specifier."""
+    monkeypatch.setenv("GITHUB_SEARCH_TOKEN", "token")
+    db_path = str(tmp_path / "db.sqlite")
+    db = Database(db_path)
+    db.upsert_scan_result("pkg", [{"path": "pkgs/a.nix", "owner": "a", "repo": "one"},
+                                  {"path": "pkgs/c.nix", "owner": "c", "repo": "three"}])
+    db.upsert_scan_result("other", [{"path": "pkgs/b.nix", "owner": "b", "repo": "two"}])
+    db.close()
+
+    def respond(url, headers=None):
+        if "other" in url:
+            return make_page([{"repository": {"full_name": "b/two"}}])
+        if "pkg%20==" in url or "pkg ==" in url:
+            return make_page([{"repository": {"full_name": "a/one"}}])
+        if "page=3" in url:
+            return make_page([{"repository": {"full_name": "c/three"}}])
+        if "page=2" in url:
+            return make_page([])
+        return make_page([], with_page(url, 2), with_page(url, 3))
+    scheduler = mock_get_scheduler.return_value
+    scheduler.get.side_effect = respond
+
+    run_searches([("pkg", "pkg == 1.0", "pkg==1.0"), ("other", "other==2", "other==2")], db_path, workers=4)
+
+    urls = [call[0][0] for call in scheduler.get.call_args_list]
+    assert len(urls) == 5 and len(set(urls)) == 5
+    db = Database(db_path)
+    assert sorted(m['path'] for m in db.get_latest_search_report("pkg", "pkg==1.0")) == ["pkgs/a.nix", "pkgs/c.nix"]
+    assert [m['path'] for m in db.get_latest_search_report("other", "other==2")] == ["pkgs/b.nix"]
+    db.close()
+
+def test_with_page():
+    assert with_page("https://x/search?q=a&per_page=100", 2) == "https://x/search?q=a&per_page=100&page=2"
+    assert with_page("https://x/search?q=a&page=2&per_page=100", 7) == "https://x/search?q=a&page=7&per_page=100"
+
+def test_search_url_honors_github_api_url(monkeypatch):
+    monkeypatch.delenv("GITHUB_API_URL", raising=False)
+    assert search_url("q").startswith("https://api.github.com/search/code?q=q")
+    monkeypatch.setenv("GITHUB_API_URL", "http://127.0.0.1:8080/")
+    assert search_url("q") == "http://127.0.0.1:8080/search/code?q=q&per_page=100"
+
+@patch('unpin_python.search.get_scheduler')
+@patch('unpin_python.search.load_dotenv')
+def test_run_search_resumes_interrupted_run(mock_dotenv, mock_get_scheduler, tmp_path, monkeypatch):
+    """A search that dies mid-way keeps its pages, and --resume continues from the stored cursor."""
+    monkeypatch.setenv("GITHUB_SEARCH_TOKEN", "token")
+    db_path = str(tmp_path / "db.sqlite")
+    db = Database(db_path)
+    db.upsert_scan_result("pkg", [
+        {"path": "pkgs/a.nix", "owner": "a", "repo": "one"},
+        {"path": "pkgs/b.nix", "owner": "b", "repo": "two"},
+    ])
+    db.close()
+    scheduler = mock_get_scheduler.return_value
+    failure = requests.exceptions.ConnectionError("connection reset")
+    scheduler.get.side_effect = [make_page([{"repository": {"full_name": "a/one"}}], "https://page2"), failure]
+
+    run_search("pkg", "pkg==1.0", "pkg==1.0", db_path)
+    db = Database(db_path)
+    assert db.get_latest_search_report("pkg", "pkg==1.0") is None
+    db.close()
+
+    scheduler.get.side_effect = [make_page([{"repository": {"full_name": "b/two"}}])]
+    run_search("pkg", "pkg==1.0", "pkg==1.0", db_path, resume=True)
+
+    assert scheduler.get.call_args[0][0] == "https://page2"
+    db = Database(db_path)
+    assert sorted(m['path'] for m in db.get_latest_search_report("pkg", "pkg==1.0")) == ["pkgs/a.nix", "pkgs/b.nix"]
+    db.close()
+
+@patch('unpin_python.search.fetch_pyproject')
+def test_fetch_repo_pins(mock_fetch):
+    """Requirements are extracted per repo; repos that couldn't be fetched are left out."""
+    pyprojects = {
+        ("a", "pinned"): '[build-system]\nrequires = ["Hatchling==1.27.0"]\n',
+        ("b", "spaced"): '[build-system]\nrequires = ["hatchling == 1.27.0"]\n',
+        ("c", "unpinned"): '[build-system]\nrequires = ["hatchling"]\n',
+        ("d", "missing"): '',
+        ("e", "error"): None,
+    }
+    mock_fetch.side_effect = lambda session, owner, repo: pyprojects[(owner, repo)]
+
+    pins = fetch_repo_pins(list(pyprojects), "hatchling", workers=2)
+
+    assert pins == {
+        "a/pinned": ["Hatchling==1.27.0"],
+        "b/spaced": ["hatchling == 1.27.0"],
+        "c/unpinned": [],
+        "d/missing": [],
+    }
+    assert mock_fetch.call_count == 5
+
+@patch('unpin_python.search.fetch_repo_pins')
+@patch('unpin_python.search.load_dotenv')
+def test_run_search_targeted_uses_pin_cache(mock_dotenv, mock_fetch_pins, tmp_path):
+    """A second specifier for the same package is answered from cached pins without fetching."""
+    db_path = str(tmp_path / "db.sqlite")
+    db = Database(db_path)
+    db.upsert_scan_result("hatchling", [
+        {"path": "pkgs/a.nix", "owner": "a", "repo": "pinned"},
+        {"path": "pkgs/c.nix", "owner": "c", "repo": "unpinned"},
+    ])
+    db.close()
+    mock_fetch_pins.return_value = {"a/pinned": ["hatchling==1.27.0"], "c/unpinned": []}
+
+    run_search("hatchling", "hatchling == 1.27.0", "hatchling==1.27.0", db_path, targeted=True)
+    run_search("hatchling", "hatchling >= 1.26", "hatchling>=1.26", db_path, targeted=True)
+    run_search("hatchling", "hatchling < 1.27", "hatchling<1.27", db_path, targeted=True)
+
+    mock_fetch_pins.assert_called_once()
+    db = Database(db_path)
+    assert [m['path'] for m in db.get_latest_search_report("hatchling", "hatchling==1.27.0")] == ["pkgs/a.nix"]
+    assert [m['path'] for m in db.get_latest_search_report("hatchling", "hatchling>=1.26")] == ["pkgs/a.nix"]
+    assert db.get_latest_search_report("hatchling", "hatchling<1.27") == []
+    db.close()
+
+@patch('unpin_python.search.fetch_search_page')
+@patch('unpin_python.search.load_dotenv')
+def test_run_search_answers_from_complete_pin_cache(mock_dotenv, mock_fetch_page, tmp_path, monkeypatch):
+    """Without --targeted too, fresh pins for every scanned repository answer a specifier locally."""
+    monkeypatch.setenv("GITHUB_SEARCH_TOKEN", "token")
+    db_path = str(tmp_path / "db.sqlite")
+    with Database(db_path) as db:
+        db.upsert_scan_result("hatchling", [
+            {"path": "pkgs/a.nix", "owner": "a", "repo": "pinned"},
+            {"path": "pkgs/b.nix", "owner": "b", "repo": "unknown"},
+        ])
+        db.store_pins("hatchling", {"a/pinned": ["hatchling==1.0rc10"]}, "pyproject")
+    mock_fetch_page.return_value = ([], {})
+
+    # One repository has no pins yet, so GitHub is searched
+    run_search("hatchling", "hatchling >= 1.0rc2", "hatchling>=1.0rc2", db_path)
+    assert mock_fetch_page.call_count == 2
+    with Database(db_path) as db:
+        db.store_pins("hatchling", {"b/unknown": []}, "pyproject")
+    run_search("hatchling", "hatchling >= 1.0rc2", "hatchling>=1.0rc2", db_path)
+    assert mock_fetch_page.call_count == 2
+    with Database(db_path) as db:
+        assert [m['path'] for m in db.get_latest_search_report("hatchling", "hatchling>=1.0rc2")] == ["pkgs/a.nix"]
@@ -0,0 +1,107 @@
+import http.client
+import json
+import socket
+import threading
+import pytest
+from unpin_python.database import Database
+from unpin_python.report import run_report
+from unpin_python.serve import QueryServer, make_server, run_serve
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "db.sqlite"))
+    db.upsert_scan_result("hatchling", [{"path": "pkgs/a.nix", "owner": "o", "repo": "a"},
+                                        {"path": "pkgs/b.nix", "owner": "O", "repo": "B"}])
+    db.insert_search_result("hatchling", "hatchling==1.27.0", {"o/a", "o/b"})
+    yield db
+    db.close()
+
+def request(server, target, method="GET"):
+    """Sends one request from another thread while this one handles it; returns (status, body)."""
+    response = {}
+
+    def client():
+        if isinstance(server.server_address, str):
+            conn = http.client.HTTPConnection("localhost")
+            conn.sock = socket.socket(socket.AF_UNIX)
+            conn.sock.connect(server.server_address)
+        else:
+            conn = http.client.HTTPConnection(*server.server_address[:2])
+        conn.request(method, target)
+        reply = conn.getresponse()
+        response.update(status=reply.status, body=reply.read().decode())
+        conn.close()
+
+    thread = threading.Thread(target=client)
+    thread.start()
+    server.handle_request()
+    thread.join()
+    return response["status"], response["body"]
+
+@pytest.fixture
+def server(db, nixpkgs):
+    queries = QueryServer(db, str(nixpkgs), watch_interval=0)
+    queries.refresh()
+    server = make_server(queries, port=0)
+    yield server
+    server.server_close()
+
+def test_report_matches_run_report(server, db, capsys):
+    for specifier, package, search in (("hatchling==1.27.0", "hatchling", "hatchling==1.27.0"),
+                                       ("hatchling==2", "hatchling", "hatchling==2")):
+        run_report(package, search, db)
+        expected = capsys.readouterr().out
+        # The second query is answered from memory
+        assert request(server, f"/report?specifier={specifier}") == (200, expected)
+        assert request(server, f"/report?specifier={specifier}") == (200, expected)
+
+def test_report_sees_new_searches(server, tmp_path):
+    assert "pkgs/b.nix" in request(server, "/report?specifier=hatchling==1.27.0")[1]
+    with Database(str(tmp_path / "db.sqlite")) as other:
+        other.insert_search_result("hatchling", "hatchling==1.27.0", {"o/a"})
+    assert "pkgs/b.nix" not in request(server, "/report?specifier=hatchling==1.27.0")[1]
+
+def test_scan_follows_new_commits(server, nixpkgs, git, nix_expression):
+    status, body = request(server, "/scan?specifier=hatchling")
+    assert status == 200
+    assert [json.loads(line) for line in body.splitlines()] == [
+        {"path": "pkgs/a.nix", "package": "hatchling", "repository": "o/a"}]
+
+    (nixpkgs / "pkgs" / "b.nix").write_text(nix_expression("b", "hatchling"))
+    (nixpkgs / "pkgs" / "a.nix").unlink()
+    git(nixpkgs, "commit", "-q", "-a", "-m", "move hatchling to b")
+    server.service_actions()
+    assert [json.loads(line)["path"] for line in request(server, "/scan?specifier=hatchling")[1].splitlines()] == ["pkgs/b.nix"]
+
+def test_bad_requests(server):
+    assert request(server, "/report")[0] == 400
+    assert request(server, "/nothing")[0] == 404
+    assert request(server, "/status", method="POST")[0] == 404
+    assert json.loads(request(server, "/refresh", method="POST")[1])["files"] == 2
+
+def test_unix_socket(db, tmp_path):
+    socket_path = str(tmp_path / "unpin.sock")
+    server = make_server(QueryServer(db, None), socket_path=socket_path)
+    try:
+        assert request(server, "/status")[0] == 200
+        assert request(server, "/scan?specifier=hatchling")[0] == 503
+    finally:
+        server.server_close()
+
+def test_socket_path_guards(db, tmp_path, capsys):
+    not_a_socket = tmp_path / "db.sqlite"
+    with pytest.raises(FileExistsError, match="not a socket"):
+        make_server(QueryServer(db, None), socket_path=str(not_a_socket))
+    run_serve(db, None, socket_path=str(not_a_socket))
+    assert "is not a socket" in capsys.readouterr().out
+    assert not_a_socket.stat().st_size > 0
+
+    socket_path = str(tmp_path / "unpin.sock")
+    server = make_server(QueryServer(db, None), socket_path=socket_path)
+    try:
+        with pytest.raises(FileExistsError, match="listening"):
+            make_server(QueryServer(db, None), socket_path=socket_path)
+    finally:
+        server.server_close()
+    # A socket nobody answers on is replaced
+    make_server(QueryServer(db, None), socket_path=socket_path).server_close()
@@ -0,0 +1,12 @@
+from .database import SEARCH_KEEP_AGE, SEARCH_KEEP_RUNS, open_database
+
+def run_compact(db_path, keep_runs=SEARCH_KEEP_RUNS, keep_age=SEARCH_KEEP_AGE):
+    """Applies the search history retention policy, then VACUUMs and ANALYZEs the database."""
+    with open_database(db_path) as db:
+        with db.transaction():
+            compacted = db.compact_search_history(keep_runs, keep_age)
+        print(f"Compacted {compacted} old search runs into deltas.")
+        size_before = db.file_size()
+        db.vacuum()
+        size_after = db.file_size()
+        print(f"Database rebuilt: {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB.")
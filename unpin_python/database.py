@@ -1,19 +1,119 @@
+import re
 import sqlite3
+import pathlib
 import json
-from datetime import datetime, timezone
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from . import profiling
+
+# Bumped whenever an existing database needs a migration step (see Database._migrate)
+SCHEMA_VERSION = 7
+# Seconds a connection waits for another process's write lock before giving up
+BUSY_TIMEOUT = 30
+# Page cache per connection, in KiB
+CACHE_SIZE_KIB = 64 * 1024
+# Prepared statements kept per connection; every query here is reused with parameters only
+CACHED_STATEMENTS = 256
+# The `revision` recorded for scans of the nixpkgs working tree
+WORKING_TREE = ''
+# Search runs kept with their full match lists; older runs only keep their delta (see compact_search_history)
+SEARCH_KEEP_RUNS = 5
+SEARCH_KEEP_AGE = timedelta(days=30)
+
+def repo_key(full_name):
+    """Normalized owner/repo used for joins; GitHub names are case-insensitive."""
+    return full_name.lower()
+
+def package_key(name):
+    """Normalized package or attribute name: case-insensitive, with runs of '-', '_' and '.' equivalent."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def shard_of(nix_path, shard_count):
+    """The shard (1 to `shard_count`) a Nixpkgs-relative path belongs to, the same on every host."""
+    return zlib.crc32(nix_path.replace('\\', '/').encode()) % shard_count + 1
 
 class Database:
-    """A wrapper class for all database interactions using a normalized SQLite schema."""
+    """A wrapper class for all database interactions using a normalized SQLite schema.
+
+    Can be used as a context manager, which commits (or rolls back) and closes the connection.
+    """
+
+    def __init__(self, db_path, read_only=False):
+        """Opens (or creates) the database at `db_path` and migrates it to the current schema.
 
-    def __init__(self, db_path):
-        self.conn = sqlite3.connect(db_path)
+        With `read_only`, the file is opened as it is: nothing is written to it, not even a migration.
+        """
+        if read_only:
+            db_path = pathlib.Path(db_path).resolve().as_uri() + "?mode=ro"
+        self.conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS, uri=read_only)
         self.cursor = self.conn.cursor()
+        self._batch_depth = 0
         # Enable foreign key support
         self.cursor.execute("PRAGMA foreign_keys = ON")
-        self._create_tables()
+        # WAL lets reports read while a scan or search is writing, and with synchronous=NORMAL
+        # a commit no longer waits for an fsync
+        if not read_only:
+            self.cursor.execute("PRAGMA journal_mode = WAL")
+        self.cursor.execute("PRAGMA synchronous = NORMAL")
+        self.cursor.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        self.cursor.execute("PRAGMA temp_store = MEMORY")
+        self.conn.create_function("shard_of", 2, shard_of, deterministic=True)
+        if not read_only:
+            self._create_tables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._commit_now()
+        else:
+            self.conn.rollback()
+        self.close()
+
+    @contextmanager
+    def transaction(self):
+        """Groups every write made inside the block into a single transaction.
+
+        Nested blocks join the outermost one, which commits at its end or rolls back on error.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.conn.rollback()
+            raise
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            self._commit_now()
+
+    def _commit(self):
+        if not self._batch_depth:
+            self._commit_now()
+
+    def _commit_now(self):
+        with profiling.span("db.commit"):
+            self.conn.commit()
+
+    def _rollback(self):
+        # Inside a batch the error propagates to transaction(), which rolls back everything
+        if not self._batch_depth:
+            self.conn.rollback()
 
     def _create_tables(self):
-        """Creates the necessary tables with a normalized schema."""
+        """Creates the necessary tables with a normalized schema, migrating older databases first."""
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scans'")
+        existing = self.cursor.fetchone() is not None
+        self.cursor.execute("PRAGMA user_version")
+        version = self.cursor.fetchone()[0]
+        if existing and version < SCHEMA_VERSION:
+            self._migrate(version)
+        else:
+            version = SCHEMA_VERSION
+
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS scans (
                 package_name TEXT PRIMARY KEY,
@@ -24,67 +124,355 @@ class Database:
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS repositories (
                 package_name TEXT,
+                revision TEXT DEFAULT '', -- nixpkgs git revision scanned; '' for the working tree
                 nix_path TEXT,
                 owner TEXT,
                 repo TEXT,
-                PRIMARY KEY (package_name, owner, repo),
+                repo_key TEXT, -- lower(owner/repo)
+                PRIMARY KEY (package_name, revision, owner, repo),
                 FOREIGN KEY (package_name) REFERENCES scans(package_name) ON DELETE CASCADE
             )
         ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_revisions (
+                package_name TEXT,
+                revision TEXT, -- as given on the command line, e.g. 'nixos-unstable'
+                commit_sha TEXT, -- what it resolved to when scanned
+                last_scan TEXT,
+                PRIMARY KEY (package_name, revision),
+                FOREIGN KEY (package_name) REFERENCES scans(package_name) ON DELETE CASCADE
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_shards (
+                package_name TEXT,
+                revision TEXT,
+                shard INTEGER, -- 1 to shard_count, see shard_of()
+                shard_count INTEGER,
+                last_scan TEXT,
+                PRIMARY KEY (package_name, revision, shard),
+                FOREIGN KEY (package_name) REFERENCES scans(package_name) ON DELETE CASCADE
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pending_repositories (
+                -- Repositories found by a scan in progress, moved to `repositories` when it completes
+                package_name TEXT,
+                revision TEXT,
+                nix_path TEXT,
+                owner TEXT,
+                repo TEXT,
+                repo_key TEXT,
+                PRIMARY KEY (package_name, revision, owner, repo)
+            )
+        ''')
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS search_runs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 package_name TEXT,
                 search_string TEXT,
                 last_update TEXT,
+                status TEXT DEFAULT 'complete', -- 'running' until every query has been paged through
+                compacted INTEGER DEFAULT 0, -- 1 once its search_matches were dropped in favor of its delta
                 FOREIGN KEY (package_name) REFERENCES scans(package_name) ON DELETE CASCADE
             )
         ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS search_cursors (
+                search_id INTEGER,
+                query TEXT,
+                next_url TEXT, -- the page to fetch next; NULL once the query is exhausted
+                PRIMARY KEY (search_id, query),
+                FOREIGN KEY (search_id) REFERENCES search_runs(id) ON DELETE CASCADE
+            )
+        ''')
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS search_matches (
                 search_id INTEGER,
                 repo_full_name TEXT, -- owner/repo
+                repo_key TEXT, -- lower(repo_full_name)
                 PRIMARY KEY (search_id, repo_full_name),
                 FOREIGN KEY (search_id) REFERENCES search_runs(id) ON DELETE CASCADE
             )
         ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS search_deltas (
+                search_id INTEGER,
+                repo_full_name TEXT,
+                repo_key TEXT,
+                change TEXT, -- 'added' or 'removed' relative to the previous complete run
+                PRIMARY KEY (search_id, repo_key),
+                FOREIGN KEY (search_id) REFERENCES search_runs(id) ON DELETE CASCADE
+            )
+        ''')
+        # --- Persistent fetchFromGitHub index of the nixpkgs tree ---
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS index_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS indexed_files (
+                nix_path TEXT PRIMARY KEY,
+                blob TEXT -- git blob hash of the file contents
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS indexed_fetchers (
+                nix_path TEXT,
+                owner TEXT,
+                repo TEXT,
+                PRIMARY KEY (nix_path, owner, repo),
+                FOREIGN KEY (nix_path) REFERENCES indexed_files(nix_path) ON DELETE CASCADE
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS indexed_dependencies (
+                nix_path TEXT,
+                name TEXT, -- package_key() of a declared dependency
+                PRIMARY KEY (name, nix_path),
+                FOREIGN KEY (nix_path) REFERENCES indexed_files(nix_path) ON DELETE CASCADE
+            )
+        ''')
+        # --- Fetchers and dependencies per git blob, shared by scans of any revision ---
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS parsed_blobs (
+                blob TEXT PRIMARY KEY -- git blob hash; the rows below are only kept for blobs with fetchers
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blob_fetchers (
+                blob TEXT,
+                owner TEXT,
+                repo TEXT,
+                PRIMARY KEY (blob, owner, repo),
+                FOREIGN KEY (blob) REFERENCES parsed_blobs(blob) ON DELETE CASCADE
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blob_dependencies (
+                blob TEXT,
+                name TEXT, -- package_key() of a declared dependency
+                PRIMARY KEY (name, blob),
+                FOREIGN KEY (blob) REFERENCES parsed_blobs(blob) ON DELETE CASCADE
+            )
+        ''')
+        # --- Pinned requirements found per repository, reused across specifiers ---
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pin_checks (
+                package_name TEXT,
+                repo_key TEXT,
+                repo_full_name TEXT,
+                source TEXT, -- 'pyproject' (whole file) or 'fragment' (code search text match)
+                checked_at TEXT,
+                PRIMARY KEY (package_name, repo_key)
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pins (
+                package_name TEXT,
+                repo_key TEXT,
+                requirement TEXT, -- e.g. 'hatchling==1.27.0'
+                PRIMARY KEY (package_name, repo_key, requirement),
+                FOREIGN KEY (package_name, repo_key) REFERENCES pin_checks(package_name, repo_key) ON DELETE CASCADE
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_repositories_repo_key ON repositories (repo_key)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_matches_repo_key ON search_matches (search_id, repo_key)')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_search_runs_latest
+            ON search_runs (package_name, search_string, last_update)
+        ''')
+        if version < 4:
+            # Existing scans were all of the working tree
+            self.cursor.execute('''
+                INSERT INTO repositories (package_name, revision, nix_path, owner, repo, repo_key)
+                SELECT package_name, '', nix_path, owner, repo, repo_key FROM repositories_v3
+            ''')
+            self.cursor.execute('DROP TABLE repositories_v3')
+        if version < 5:
+            # Give every existing run its delta, oldest first, so any of them can be compacted
+            self.cursor.execute("SELECT id FROM search_runs WHERE status = 'complete' ORDER BY last_update, id")
+            for (search_id,) in self.cursor.fetchall():
+                self._record_search_delta(search_id)
+        if version < 6:
+            # Working tree scans are recorded in scan_revisions too, so merges can tell them apart
+            self.cursor.execute('''
+                INSERT OR IGNORE INTO scan_revisions (package_name, revision, commit_sha, last_scan)
+                SELECT s.package_name, '', NULL, s.last_scan FROM scans s
+                WHERE EXISTS (SELECT 1 FROM repositories r WHERE r.package_name = s.package_name AND r.revision = '')
+                    OR NOT EXISTS (SELECT 1 FROM scan_revisions sv WHERE sv.package_name = s.package_name)
+            ''')
+        self.cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         self.conn.commit()
 
+    def _migrate(self, version):
+        """Upgrades a database created with an older schema, one version at a time."""
+        if version < 1:
+            # Add and backfill the normalized join keys
+            self.cursor.execute('ALTER TABLE repositories ADD COLUMN repo_key TEXT')
+            self.cursor.execute("UPDATE repositories SET repo_key = lower(owner || '/' || repo)")
+            self.cursor.execute('ALTER TABLE search_matches ADD COLUMN repo_key TEXT')
+            self.cursor.execute('UPDATE search_matches SET repo_key = lower(repo_full_name)')
+        if version < 2:
+            # Runs stored before checkpointing existed were always complete
+            self.cursor.execute("ALTER TABLE search_runs ADD COLUMN status TEXT DEFAULT 'complete'")
+        if version < 3:
+            # The fetcher index now records dependencies; drop it so the next `scan --index` rebuilds it
+            self.cursor.execute('DROP TABLE IF EXISTS indexed_fetchers')
+            self.cursor.execute('DROP TABLE IF EXISTS indexed_files')
+            self.cursor.execute('DROP TABLE IF EXISTS index_state')
+        if version < 4:
+            # `revision` joins the primary key, which needs a new table; rows are copied over
+            # once it has been created (see _create_tables)
+            self.cursor.execute('DROP INDEX IF EXISTS idx_repositories_repo_key')
+            self.cursor.execute('ALTER TABLE repositories RENAME TO repositories_v3')
+        if version < 5:
+            # Deltas are backfilled once the table exists (see _create_tables)
+            self.cursor.execute('ALTER TABLE search_runs ADD COLUMN compacted INTEGER DEFAULT 0')
+        if version < 7:
+            # The text of indexed files is no longer read; `compact` returns the space it took
+            self.cursor.execute('PRAGMA table_info(indexed_files)')
+            if 'content' in {row[1] for row in self.cursor.fetchall()}:
+                self.cursor.execute('ALTER TABLE indexed_files DROP COLUMN content')
+
     def delete_all_data(self):
         """Deletes all rows from all tables."""
         self.cursor.execute('DELETE FROM search_matches')
+        self.cursor.execute('DELETE FROM search_deltas')
+        self.cursor.execute('DELETE FROM search_cursors')
         self.cursor.execute('DELETE FROM search_runs')
         self.cursor.execute('DELETE FROM repositories')
+        self.cursor.execute('DELETE FROM scan_revisions')
+        self.cursor.execute('DELETE FROM scan_shards')
+        self.cursor.execute('DELETE FROM pending_repositories')
         self.cursor.execute('DELETE FROM scans')
-        self.conn.commit()
+        self.cursor.execute('DELETE FROM pins')
+        self.cursor.execute('DELETE FROM pin_checks')
+        self.cursor.execute('DELETE FROM indexed_dependencies')
+        self.cursor.execute('DELETE FROM blob_dependencies')
+        self.cursor.execute('DELETE FROM blob_fetchers')
+        self.cursor.execute('DELETE FROM parsed_blobs')
+        self.cursor.execute('DELETE FROM indexed_fetchers')
+        self.cursor.execute('DELETE FROM indexed_files')
+        self.cursor.execute('DELETE FROM index_state')
+        self._commit()
 
     def delete_package_data(self, package_name):
         """Deletes all data associated with a specific package name."""
         # Due to "ON DELETE CASCADE", deleting from 'scans' will cascade
         # to repositories, search_runs, and search_matches.
         self.cursor.execute('DELETE FROM scans WHERE package_name = ?', (package_name,))
-        self.conn.commit()
+        # Pin data isn't tied to a scan, so it is removed explicitly
+        self.cursor.execute('DELETE FROM pin_checks WHERE package_name = ?', (package_name,))
+        self._commit()
 
     def upsert_scan_result(self, package_name, repositories):
-        self.cursor.execute('INSERT OR REPLACE INTO scans (package_name, last_scan) VALUES (?, ?)', 
-                            (package_name, datetime.now(timezone.utc).isoformat()))
-        
-        # Clear old repositories for this package before inserting new ones
-        self.cursor.execute('DELETE FROM repositories WHERE package_name = ?', (package_name,))
-        
-        repo_data = [(package_name, repo['path'], repo['owner'], repo['repo']) for repo in repositories]
+        count = self._write_scan_result(package_name, repositories)
+        self._commit()
+        return count
+
+    def upsert_scan_results(self, results):
+        """Upserts the scan results of several packages in a single transaction."""
+        count = 0
+        try:
+            for package_name, repositories in results.items():
+                count += self._write_scan_result(package_name, repositories)
+        except Exception:
+            self._rollback()
+            raise
+        self._commit()
+        return count
+
+    def _write_scan_result(self, package_name, repositories):
+        self._clear_scan_results([package_name])
+        self._insert_repositories((package_name, repo) for repo in repositories)
+        return len(repositories)
+
+    def _clear_scan_results(self, package_names, revision=WORKING_TREE, commit_sha=None, shard=None):
+        # An upsert rather than INSERT OR REPLACE, which would cascade to the package's search runs
+        now = datetime.now(timezone.utc).isoformat()
         self.cursor.executemany('''
-            INSERT OR REPLACE INTO repositories (package_name, nix_path, owner, repo)
+            INSERT INTO scans (package_name, last_scan) VALUES (?, ?)
+            ON CONFLICT (package_name) DO UPDATE SET last_scan = excluded.last_scan
+        ''', [(package_name, now) for package_name in package_names])
+        self.cursor.executemany('''
+            INSERT OR REPLACE INTO scan_revisions (package_name, revision, commit_sha, last_scan)
             VALUES (?, ?, ?, ?)
-        ''', repo_data)
-        self.conn.commit()
-        return len(repositories)
+        ''', [(package_name, revision, commit_sha, now) for package_name in package_names])
+        self.cursor.executemany('DELETE FROM scan_shards WHERE package_name = ? AND revision = ?',
+                                [(package_name, revision) for package_name in package_names])
+        if shard is not None:
+            self.cursor.executemany('''
+                INSERT INTO scan_shards (package_name, revision, shard, shard_count, last_scan) VALUES (?, ?, ?, ?, ?)
+            ''', [(package_name, revision, *shard, now) for package_name in package_names])
+        # Clear old repositories for these packages before inserting new ones
+        self.cursor.executemany('DELETE FROM repositories WHERE package_name = ? AND revision = ?',
+                                [(package_name, revision) for package_name in package_names])
+
+    def _insert_repositories(self, package_repositories, revision=WORKING_TREE, table='repositories'):
+        self.cursor.executemany(f'''
+            INSERT OR REPLACE INTO {table} (package_name, revision, nix_path, owner, repo, repo_key)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(package_name, revision, repo['path'], repo['owner'], repo['repo'], repo_key(f"{repo['owner']}/{repo['repo']}"))
+              for package_name, repo in package_repositories])
+
+    def start_scan_results(self, package_names, revision=WORKING_TREE):
+        """Starts a scan whose results arrive in batches through add_scan_repositories().
+
+        Each batch is committed on its own, so other connections can write in between; readers
+        keep seeing the previous results until finish_scan_results() swaps the new ones in.
+        """
+        self._clear_pending_repositories(package_names, revision)
+        self._commit()
+
+    def add_scan_repositories(self, package_repositories, revision=WORKING_TREE):
+        """Stores a batch of (package_name, repository) pairs found by a scan in progress."""
+        self._insert_repositories(package_repositories, revision, table='pending_repositories')
+        self._commit()
+
+    def finish_scan_results(self, package_names, revision=WORKING_TREE, commit_sha=None, shard=None):
+        """Marks the packages as scanned now and replaces their repositories for `revision` with the
+        batches added since start_scan_results(), in one transaction.
 
-    def get_scan_repositories(self, package_name):
-        self.cursor.execute('SELECT nix_path, owner, repo FROM repositories WHERE package_name = ?', (package_name,))
+        `shard` is (shard, shard_count) when the scan only covers the paths shard_of() assigns to that shard.
+        """
+        try:
+            self._clear_scan_results(package_names, revision, commit_sha, shard)
+            self.cursor.executemany('''
+                INSERT OR REPLACE INTO repositories (package_name, revision, nix_path, owner, repo, repo_key)
+                SELECT package_name, revision, nix_path, owner, repo, repo_key FROM pending_repositories
+                WHERE package_name = ? AND revision = ?
+            ''', [(package_name, revision) for package_name in package_names])
+            self._clear_pending_repositories(package_names, revision)
+        except Exception:
+            self._rollback()
+            raise
+        self._commit()
+
+    def _clear_pending_repositories(self, package_names, revision):
+        # Also drops what an interrupted scan left behind
+        self.cursor.executemany('DELETE FROM pending_repositories WHERE package_name = ? AND revision = ?',
+                                [(package_name, revision) for package_name in package_names])
+
+    def get_scan_repositories(self, package_name, revision=None):
+        """Returns the repositories found for a package at `revision` (None: at any scanned revision)."""
+        if revision is None:
+            self.cursor.execute('SELECT DISTINCT nix_path, owner, repo FROM repositories WHERE package_name = ?',
+                                (package_name,))
+        else:
+            self.cursor.execute('SELECT nix_path, owner, repo FROM repositories WHERE package_name = ? AND revision = ?',
+                                (package_name, revision))
         rows = self.cursor.fetchall()
         return [{'path': r[0], 'owner': r[1], 'repo': r[2]} for r in rows]
 
+    def get_scan_revisions(self, package_name):
+        """Returns {revision: commit_sha} for the git revisions a package was scanned at."""
+        self.cursor.execute('SELECT revision, commit_sha FROM scan_revisions WHERE package_name = ? AND revision != ?',
+                            (package_name, WORKING_TREE))
+        return dict(self.cursor.fetchall())
+
     def insert_search_result(self, package_name, search_string, found_repos_on_github):
         self.cursor.execute('''
             INSERT INTO search_runs (package_name, search_string, last_update)
@@ -93,33 +481,555 @@ class Database:
         search_id = self.cursor.lastrowid
         
         if found_repos_on_github:
-            match_data = [(search_id, repo_full_name) for repo_full_name in found_repos_on_github]
-            self.cursor.executemany('INSERT OR IGNORE INTO search_matches (search_id, repo_full_name) VALUES (?, ?)', match_data)
-        self.conn.commit()
+            match_data = [(search_id, repo_full_name, repo_key(repo_full_name)) for repo_full_name in found_repos_on_github]
+            self.cursor.executemany('INSERT OR IGNORE INTO search_matches (search_id, repo_full_name, repo_key) VALUES (?, ?, ?)', match_data)
+        self._record_search_delta(search_id)
+        self._commit()
+        return search_id
+
+    def start_search_run(self, package_name, search_string, queries):
+        """Creates a checkpointed search run. `queries` maps each query to its first page URL."""
+        self.cursor.execute('''
+            INSERT INTO search_runs (package_name, search_string, last_update, status)
+            VALUES (?, ?, ?, 'running')
+        ''', (package_name, search_string, datetime.now(timezone.utc).isoformat()))
+        search_id = self.cursor.lastrowid
+        self.cursor.executemany('INSERT INTO search_cursors (search_id, query, next_url) VALUES (?, ?, ?)',
+                                [(search_id, query, url) for query, url in queries.items()])
+        self._commit()
         return search_id
 
-    def get_latest_search_report(self, package_name, search_string):
+    def add_search_page(self, search_id, query, repo_full_names, next_url):
+        """Stores one page of matches and advances the query's cursor in the same transaction."""
+        self.cursor.executemany('INSERT OR IGNORE INTO search_matches (search_id, repo_full_name, repo_key) VALUES (?, ?, ?)',
+                                [(search_id, name, repo_key(name)) for name in repo_full_names])
+        self.cursor.execute('UPDATE search_cursors SET next_url = ? WHERE search_id = ? AND query = ?',
+                            (next_url, search_id, query))
+        self._commit()
+
+    def finish_search_run(self, search_id):
+        self.cursor.execute("UPDATE search_runs SET status = 'complete', last_update = ? WHERE id = ?",
+                            (datetime.now(timezone.utc).isoformat(), search_id))
+        self._record_search_delta(search_id)
+        self._commit()
+
+    def _complete_runs_around(self, search_id, newer):
+        """Returns [(id, compacted)] of the other complete runs of the same specifier finished after
+        (`newer`) or before `search_id`, nearest first."""
+        comparison, order = ('>', 'ASC') if newer else ('<', 'DESC')
+        self.cursor.execute(f'''
+            SELECT other.id, other.compacted
+            FROM search_runs run
+            JOIN search_runs other ON other.package_name = run.package_name AND other.search_string = run.search_string
+            WHERE run.id = ? AND other.status = 'complete'
+                AND (other.last_update, other.id) {comparison} (run.last_update, run.id)
+            ORDER BY other.last_update {order}, other.id {order}
+        ''', (search_id,))
+        return self.cursor.fetchall()
+
+    def _record_search_delta(self, search_id):
+        """Stores which repositories a complete run added or removed relative to the previous one."""
+        previous = self._complete_runs_around(search_id, newer=False)
+        before = self.get_search_run_matches(previous[0][0]) if previous else {}
+        self._write_search_delta(search_id, before, self.get_search_run_matches(search_id))
+
+    def _write_search_delta(self, search_id, before, after):
+        """Replaces a run's delta with the difference of two {repo_key: repo_full_name} maps."""
+        delta = [(search_id, name, key, 'added') for key, name in after.items() if key not in before]
+        delta += [(search_id, name, key, 'removed') for key, name in before.items() if key not in after]
+        self.cursor.execute('DELETE FROM search_deltas WHERE search_id = ?', (search_id,))
+        self.cursor.executemany('''
+            INSERT INTO search_deltas (search_id, repo_full_name, repo_key, change) VALUES (?, ?, ?, ?)
+        ''', delta)
+
+    def _search_delta(self, search_id):
+        self.cursor.execute('SELECT repo_full_name, repo_key, change FROM search_deltas WHERE search_id = ?', (search_id,))
+        return self.cursor.fetchall()
+
+    def get_search_run_matches(self, search_id):
+        """Returns {repo_key: repo_full_name} found by a run, rebuilt from deltas if it was compacted.
+
+        A compacted run is recovered from the nearest newer run still kept in full, undoing the
+        deltas of every run in between.
+        """
+        self.cursor.execute('SELECT compacted FROM search_runs WHERE id = ?', (search_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return {}
+        if not row[0]:
+            self.cursor.execute('SELECT repo_key, repo_full_name FROM search_matches WHERE search_id = ?', (search_id,))
+            return dict(self.cursor.fetchall())
+
+        undo = []
+        for newer_id, compacted in self._complete_runs_around(search_id, newer=True):
+            undo.append(newer_id)
+            if not compacted:
+                break
+        else:
+            # The latest run is never compacted, so this only happens to a damaged history
+            return {}
+        matches = self.get_search_run_matches(undo[-1])
+        for newer_id in reversed(undo):
+            for name, key, change in self._search_delta(newer_id):
+                if change == 'added':
+                    matches.pop(key, None)
+                else:
+                    matches[key] = name
+        return matches
+
+    def get_search_changes(self, package_name, search_string, since):
+        """Returns (added, removed) repository names between the state at `since` and the latest run.
+
+        Answered from the deltas of the complete runs finished after `since` (a datetime).
+        """
+        self.cursor.execute('''
+            SELECT d.repo_full_name, d.repo_key, d.change
+            FROM search_runs sr
+            JOIN search_deltas d ON d.search_id = sr.id
+            WHERE sr.package_name = ? AND sr.search_string = ? AND sr.status = 'complete' AND sr.last_update > ?
+            ORDER BY sr.last_update, sr.id
+        ''', (package_name, search_string, since.isoformat()))
+        first, last, names = {}, {}, {}
+        for name, key, change in self.cursor.fetchall():
+            first.setdefault(key, change)
+            last[key] = change
+            names[key] = name
+        # A repository added and removed again within the window is no change at all
+        added = sorted(names[key] for key, change in last.items() if change == first[key] == 'added')
+        removed = sorted(names[key] for key, change in last.items() if change == first[key] == 'removed')
+        return added, removed
+
+    def compact_search_history(self, keep_runs=SEARCH_KEEP_RUNS, keep_age=SEARCH_KEEP_AGE):
+        """Drops the match lists of old complete search runs, which keep only their deltas.
+
+        A run stays in full if it is among the latest `keep_runs` of its (package, search string) or
+        younger than `keep_age` (None: age keeps nothing). The latest run always stays in full.
+        Returns how many runs were compacted.
+        """
+        cutoff = (datetime.now(timezone.utc) - keep_age).isoformat() if keep_age is not None else None
+        self.cursor.execute('''
+            SELECT id FROM (
+                SELECT id, last_update, compacted, ROW_NUMBER() OVER (
+                    PARTITION BY package_name, search_string ORDER BY last_update DESC, id DESC) AS recency
+                FROM search_runs
+                WHERE status = 'complete'
+            )
+            WHERE recency > ? AND (? IS NULL OR last_update < ?) AND compacted = 0
+        ''', (max(keep_runs, 1), cutoff, cutoff))
+        doomed = [(search_id,) for (search_id,) in self.cursor.fetchall()]
+        self.cursor.executemany('DELETE FROM search_matches WHERE search_id = ?', doomed)
+        self.cursor.executemany('DELETE FROM search_cursors WHERE search_id = ?', doomed)
+        self.cursor.executemany('UPDATE search_runs SET compacted = 1 WHERE id = ?', doomed)
+        self._commit()
+        return len(doomed)
+
+    def _complete_runs_of(self, package_name, search_string):
+        self.cursor.execute('''
+            SELECT id FROM search_runs
+            WHERE package_name = ? AND search_string = ? AND status = 'complete'
+            ORDER BY last_update, id
+        ''', (package_name, search_string))
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def _scan_state(self, package_name, revision):
+        """Returns (last_scan, shard_count, {shard: last_scan}) for a scanned package and revision, or None.
+
+        shard_count is None unless the stored paths come from sharded scans.
+        """
+        self.cursor.execute('SELECT last_scan FROM scan_revisions WHERE package_name = ? AND revision = ?',
+                            (package_name, revision))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        self.cursor.execute('SELECT shard, shard_count, last_scan FROM scan_shards WHERE package_name = ? AND revision = ?',
+                            (package_name, revision))
+        shards = self.cursor.fetchall()
+        return row[0], shards[0][1] if shards else None, {shard: last_scan for shard, _, last_scan in shards}
+
+    def merge_database(self, source):
+        """Merges the scans, search runs, pins and parsed blobs of another Database into this one.
+
+        Call it inside transaction(). Returns the number of scans, search runs, pin checks and blobs
+        taken from `source`.
+        """
+        return {
+            'scans': self._merge_scans(source),
+            'search_runs': self._merge_search_runs(source),
+            'pin_checks': self._merge_pins(source),
+            'blobs': self._merge_blobs(source),
+        }
+
+    def _merge_scans(self, source):
+        """Takes each (package, revision) scan of `source` that is newer than ours.
+
+        Shards of the same partition are combined instead: the paths of each shard come from its
+        newest scan. Any other pair of scans (full, or sharded differently) is replaced whole.
+        """
+        merged = 0
+        source.cursor.execute('SELECT package_name, revision, commit_sha, last_scan FROM scan_revisions')
+        for package_name, revision, commit_sha, last_scan in source.cursor.fetchall():
+            _, shard_count, shards = source._scan_state(package_name, revision)
+            existing = self._scan_state(package_name, revision)
+            if existing and shard_count and existing[1] == shard_count:
+                replaced = [shard for shard, scanned in shards.items() if scanned > existing[2].get(shard, '')]
+                if not replaced:
+                    continue
+            elif existing and existing[0] >= last_scan:
+                continue
+            else:
+                replaced = None
+
+            repos = [(package_name, repo) for repo in source.get_scan_repositories(package_name, revision)]
+            if replaced is None:
+                self.cursor.execute('DELETE FROM repositories WHERE package_name = ? AND revision = ?',
+                                    (package_name, revision))
+                self.cursor.execute('DELETE FROM scan_shards WHERE package_name = ? AND revision = ?',
+                                    (package_name, revision))
+                replaced = list(shards)
+            else:
+                self.cursor.executemany('''
+                    DELETE FROM repositories WHERE package_name = ? AND revision = ? AND shard_of(nix_path, ?) = ?
+                ''', [(package_name, revision, shard_count, shard) for shard in replaced])
+                repos = [(name, repo) for name, repo in repos if shard_of(repo['path'], shard_count) in replaced]
+            self.cursor.execute('''
+                INSERT INTO scans (package_name, last_scan) VALUES (?, ?)
+                ON CONFLICT (package_name) DO UPDATE SET last_scan = max(last_scan, excluded.last_scan)
+            ''', (package_name, last_scan))
+            self.cursor.execute('''
+                INSERT INTO scan_revisions (package_name, revision, commit_sha, last_scan) VALUES (?, ?, ?, ?)
+                ON CONFLICT (package_name, revision) DO UPDATE SET
+                    commit_sha = CASE WHEN excluded.last_scan > last_scan THEN excluded.commit_sha ELSE commit_sha END,
+                    last_scan = max(last_scan, excluded.last_scan)
+            ''', (package_name, revision, commit_sha, last_scan))
+            self.cursor.executemany('''
+                INSERT OR REPLACE INTO scan_shards (package_name, revision, shard, shard_count, last_scan) VALUES (?, ?, ?, ?, ?)
+            ''', [(package_name, revision, shard, shard_count, shards[shard]) for shard in replaced])
+            self._insert_repositories(repos, revision)
+            merged += 1
+        return merged
+
+    def _merge_search_runs(self, source):
+        """Copies the search runs we don't have (by specifier and time) under new ids.
+
+        Compacted runs arrive with their full matches, and the deltas of every specifier that
+        gained runs are rewritten in the merged order.
+        """
+        # {(package_name, search_string): {search_id: matches}} of complete runs, read before any change
+        histories = {}
+        copied = 0
+        source.cursor.execute('SELECT id, package_name, search_string, last_update, status FROM search_runs ORDER BY last_update, id')
+        for source_id, package_name, search_string, last_update, status in source.cursor.fetchall():
+            self.cursor.execute('''
+                SELECT 1 FROM search_runs WHERE package_name = ? AND search_string = ? AND last_update = ?
+            ''', (package_name, search_string, last_update))
+            if self.cursor.fetchone():
+                continue
+            specifier = (package_name, search_string)
+            if status == 'complete' and specifier not in histories:
+                histories[specifier] = {search_id: self.get_search_run_matches(search_id)
+                                        for search_id in self._complete_runs_of(package_name, search_string)}
+
+            matches = source.get_search_run_matches(source_id)
+            self.cursor.execute('''
+                INSERT INTO search_runs (package_name, search_string, last_update, status) VALUES (?, ?, ?, ?)
+            ''', (package_name, search_string, last_update, status))
+            search_id = self.cursor.lastrowid
+            self.cursor.executemany('INSERT INTO search_matches (search_id, repo_full_name, repo_key) VALUES (?, ?, ?)',
+                                    [(search_id, name, key) for key, name in matches.items()])
+            source.cursor.execute('SELECT query, next_url FROM search_cursors WHERE search_id = ?', (source_id,))
+            self.cursor.executemany('INSERT INTO search_cursors (search_id, query, next_url) VALUES (?, ?, ?)',
+                                    [(search_id, query, next_url) for query, next_url in source.cursor.fetchall()])
+            if status == 'complete':
+                histories[specifier][search_id] = matches
+            copied += 1
+
+        for (package_name, search_string), matches_by_run in histories.items():
+            before = {}
+            for search_id in self._complete_runs_of(package_name, search_string):
+                self._write_search_delta(search_id, before, matches_by_run[search_id])
+                before = matches_by_run[search_id]
+        return copied
+
+    def _merge_pins(self, source):
+        """Takes the pin checks of `source` that are newer than ours, with their pins."""
+        self.cursor.execute('SELECT package_name, repo_key, checked_at FROM pin_checks')
+        checked = {(package_name, key): checked_at for package_name, key, checked_at in self.cursor.fetchall()}
+        source.cursor.execute('SELECT package_name, repo_key, repo_full_name, source, checked_at FROM pin_checks')
+        newer = [row for row in source.cursor.fetchall() if row[4] > checked.get((row[0], row[1]), '')]
+        self.cursor.executemany('DELETE FROM pin_checks WHERE package_name = ? AND repo_key = ?',
+                                [row[:2] for row in newer])
+        self.cursor.executemany('''
+            INSERT INTO pin_checks (package_name, repo_key, repo_full_name, source, checked_at) VALUES (?, ?, ?, ?, ?)
+        ''', newer)
+        wanted = {row[:2] for row in newer}
+        source.cursor.execute('SELECT package_name, repo_key, requirement FROM pins')
+        self.cursor.executemany('INSERT OR IGNORE INTO pins (package_name, repo_key, requirement) VALUES (?, ?, ?)',
+                                [row for row in source.cursor.fetchall() if row[:2] in wanted])
+        return len(newer)
+
+    def _merge_blobs(self, source):
+        """Adds the parsed blobs we don't have; a blob's contents never change."""
+        known = self.get_parsed_blobs()
+        source.cursor.execute('SELECT blob FROM parsed_blobs')
+        new_blobs = [row for row in source.cursor.fetchall() if row[0] not in known]
+        self.cursor.executemany('INSERT INTO parsed_blobs (blob) VALUES (?)', new_blobs)
+        source.cursor.execute('SELECT blob, owner, repo FROM blob_fetchers')
+        self.cursor.executemany('INSERT OR IGNORE INTO blob_fetchers (blob, owner, repo) VALUES (?, ?, ?)',
+                                [row for row in source.cursor.fetchall() if row[0] not in known])
+        source.cursor.execute('SELECT blob, name FROM blob_dependencies')
+        self.cursor.executemany('INSERT OR IGNORE INTO blob_dependencies (blob, name) VALUES (?, ?)',
+                                [row for row in source.cursor.fetchall() if row[0] not in known])
+        return len(new_blobs)
+
+    def file_size(self):
+        """The size of the database in bytes, as SQLite sees it (WAL excluded)."""
+        page_count = self.cursor.execute('PRAGMA page_count').fetchone()[0]
+        return page_count * self.cursor.execute('PRAGMA page_size').fetchone()[0]
+
+    def vacuum(self):
+        """Refreshes the query planner's statistics, rebuilds the database file without free pages
+        and truncates the write-ahead log. Must not be called inside transaction()."""
+        self._commit_now()
+        self.cursor.execute('ANALYZE')
+        self.cursor.execute('VACUUM')
+        self.cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def get_resumable_search_run(self, package_name, search_string):
+        """Returns (search_id, {query: next_url}) for the latest unfinished run, or None."""
+        self.cursor.execute('''
+            SELECT id FROM search_runs
+            WHERE package_name = ? AND search_string = ? AND status = 'running'
+            ORDER BY last_update DESC
+            LIMIT 1
+        ''', (package_name, search_string))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        self.cursor.execute('SELECT query, next_url FROM search_cursors WHERE search_id = ?', (row[0],))
+        return row[0], dict(self.cursor.fetchall())
+
+    def count_search_matches(self, search_id):
+        self.cursor.execute('SELECT COUNT(*) FROM search_matches WHERE search_id = ?', (search_id,))
+        return self.cursor.fetchone()[0]
+
+    def get_latest_search_id(self, package_name, search_string):
+        """The id of the latest complete search run for the specifier, or None."""
         self.cursor.execute('''
             SELECT id FROM search_runs
-            WHERE package_name = ? AND search_string = ?
+            WHERE package_name = ? AND search_string = ? AND status = 'complete'
             ORDER BY last_update DESC
             LIMIT 1
         ''', (package_name, search_string))
         row = self.cursor.fetchone()
-        if not row: return None
-        latest_search_id = row[0]
+        return row[0] if row else None
+
+    def get_latest_search_report(self, package_name, search_string, revision=WORKING_TREE):
+        latest_search_id = self.get_latest_search_id(package_name, search_string)
+        if latest_search_id is None: return None
         
         self.cursor.execute('''
             SELECT DISTINCT
                 r.nix_path,
                 r.package_name
             FROM repositories r
-            JOIN search_matches sm ON (r.owner || '/' || r.repo) = sm.repo_full_name
-            WHERE sm.search_id = ? AND r.package_name = ?
-        ''', (latest_search_id, package_name))
+            JOIN search_matches sm ON sm.repo_key = r.repo_key
+            WHERE sm.search_id = ? AND r.package_name = ? AND r.revision = ?
+        ''', (latest_search_id, package_name, revision))
         
         rows = self.cursor.fetchall()
         return [{'path': r[0], 'package': r[1]} for r in rows]
 
+    def iter_report_matrix(self, specifiers=None, revision=WORKING_TREE):
+        """Yields (nix_path, package_name, search_string, repo_full_name) over the latest complete runs.
+
+        `specifiers` is a list of (package_name, search_string) pairs, or None for every pair that has
+        been searched. Paths are those of the nixpkgs `revision`. Rows come in nix_path order straight
+        from the cursor, so the matrix is never held in memory.
+        """
+        params = []
+        wanted = ''
+        if specifiers is not None:
+            if not specifiers:
+                return
+            wanted = ('JOIN (VALUES ' + ', '.join(['(?, ?)'] * len(specifiers)) + ') AS w '
+                      'ON w.column1 = sr.package_name AND w.column2 = sr.search_string')
+            params = [value for specifier in specifiers for value in specifier]
+        yield from self.conn.execute(f'''
+            WITH latest AS (
+                SELECT sr.package_name, sr.search_string, MAX(sr.last_update) AS last_update
+                FROM search_runs sr
+                {wanted}
+                WHERE sr.status = 'complete'
+                GROUP BY sr.package_name, sr.search_string
+            )
+            SELECT DISTINCT r.nix_path, r.package_name, sr.search_string, r.owner || '/' || r.repo
+            FROM latest l
+            JOIN search_runs sr ON sr.package_name = l.package_name AND sr.search_string = l.search_string
+                AND sr.last_update = l.last_update AND sr.status = 'complete'
+            JOIN search_matches sm ON sm.search_id = sr.id
+            JOIN repositories r ON r.repo_key = sm.repo_key AND r.package_name = sr.package_name AND r.revision = ?
+            ORDER BY r.nix_path, r.package_name, sr.search_string
+        ''', params + [revision])
+
+    def store_pins(self, package_name, pins_by_repo, source):
+        """Records the requirements found per repository (`{owner/repo: [requirement, ...]}`)."""
+        checked_at = datetime.now(timezone.utc).isoformat()
+        try:
+            for repo_full_name, requirements in pins_by_repo.items():
+                key = repo_key(repo_full_name)
+                self.cursor.execute('SELECT source FROM pin_checks WHERE package_name = ? AND repo_key = ?', (package_name, key))
+                row = self.cursor.fetchone()
+                if row and row[0] == 'pyproject' and source != 'pyproject':
+                    # A partial text match never replaces a check of the whole file
+                    continue
+                self.cursor.execute('DELETE FROM pin_checks WHERE package_name = ? AND repo_key = ?', (package_name, key))
+                self.cursor.execute('''
+                    INSERT INTO pin_checks (package_name, repo_key, repo_full_name, source, checked_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (package_name, key, repo_full_name, source, checked_at))
+                self.cursor.executemany('INSERT OR IGNORE INTO pins (package_name, repo_key, requirement) VALUES (?, ?, ?)',
+                                        [(package_name, key, requirement) for requirement in requirements])
+        except Exception:
+            self._rollback()
+            raise
+        self._commit()
+
+    def get_cached_pins(self, package_name, repo_full_names, max_age):
+        """Returns `{owner/repo: [requirement, ...]}` for the repos checked within `max_age` (None: ever)."""
+        cutoff = (datetime.now(timezone.utc) - max_age).isoformat() if max_age is not None else ''
+        cached = {}
+        for repo_full_name in repo_full_names:
+            key = repo_key(repo_full_name)
+            self.cursor.execute('''
+                SELECT 1 FROM pin_checks
+                WHERE package_name = ? AND repo_key = ? AND checked_at >= ?
+            ''', (package_name, key, cutoff))
+            if self.cursor.fetchone() is None:
+                continue
+            self.cursor.execute('SELECT requirement FROM pins WHERE package_name = ? AND repo_key = ?', (package_name, key))
+            cached[repo_full_name] = [row[0] for row in self.cursor.fetchall()]
+        return cached
+
+    def get_index_revision(self):
+        self.cursor.execute("SELECT value FROM index_state WHERE key = 'revision'")
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def get_index_dirty_paths(self):
+        """The files that were dirty in the working tree when the index was last updated."""
+        self.cursor.execute("SELECT value FROM index_state WHERE key = 'dirty'")
+        row = self.cursor.fetchone()
+        return {path for path in row[0].split('\n') if path} if row else set()
+
+    def get_indexed_blobs(self, paths=None):
+        """Returns {nix_path: blob} for the given paths, or for every indexed file."""
+        if paths is None:
+            self.cursor.execute('SELECT nix_path, blob FROM indexed_files')
+            return dict(self.cursor.fetchall())
+        blobs = {}
+        for path in paths:
+            self.cursor.execute('SELECT blob FROM indexed_files WHERE nix_path = ?', (path,))
+            row = self.cursor.fetchone()
+            if row:
+                blobs[path] = row[0]
+        return blobs
+
+    def update_index(self, entries, removed_paths, revision, dirty_paths=()):
+        """Replaces index entries and records the revision they were taken from, in one transaction.
+
+        `entries` is a list of (nix_path, blob, repositories, dependencies) tuples.
+        `dirty_paths` are the files whose working tree contents differed from `revision`.
+        """
+        try:
+            self.cursor.executemany('DELETE FROM indexed_files WHERE nix_path = ?',
+                                    [(path,) for path in removed_paths])
+            for nix_path, blob, repositories, dependencies in entries:
+                self.cursor.execute('DELETE FROM indexed_files WHERE nix_path = ?', (nix_path,))
+                self.cursor.execute('INSERT INTO indexed_files (nix_path, blob) VALUES (?, ?)', (nix_path, blob))
+                self.cursor.executemany('''
+                    INSERT OR IGNORE INTO indexed_fetchers (nix_path, owner, repo)
+                    VALUES (?, ?, ?)
+                ''', [(nix_path, repo['owner'], repo['repo']) for repo in repositories])
+                if repositories:
+                    self.cursor.executemany('INSERT OR IGNORE INTO indexed_dependencies (nix_path, name) VALUES (?, ?)',
+                                            [(nix_path, package_key(name)) for name in dependencies])
+            self.cursor.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES ('revision', ?)",
+                                (revision,))
+            self.cursor.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES ('dirty', ?)",
+                                ('\n'.join(dirty_paths),))
+        except Exception:
+            self._rollback()
+            raise
+        self._commit()
+
+    def get_indexed_fetchers(self):
+        """Returns (nix_path, owner, repo) for every fetcher in the index."""
+        self.cursor.execute('SELECT nix_path, owner, repo FROM indexed_fetchers')
+        return self.cursor.fetchall()
+
+    def get_indexed_dependencies(self):
+        """Returns (nix_path, normalized name) for every dependency in the index."""
+        self.cursor.execute('SELECT nix_path, name FROM indexed_dependencies')
+        return self.cursor.fetchall()
+
+    def find_indexed_repositories(self, package_name):
+        """Returns the fetchers of every indexed file declaring the package as a dependency."""
+        self.cursor.execute('''
+            SELECT f.nix_path, f.owner, f.repo
+            FROM indexed_dependencies d
+            JOIN indexed_fetchers f ON f.nix_path = d.nix_path
+            WHERE d.name = ?
+        ''', (package_key(package_name),))
+        rows = self.cursor.fetchall()
+        return [{'path': r[0], 'owner': r[1], 'repo': r[2]} for r in rows]
+
+    def get_parsed_blobs(self):
+        """Returns the set of git blob hashes whose fetchers and dependencies are already stored."""
+        self.cursor.execute('SELECT blob FROM parsed_blobs')
+        return {row[0] for row in self.cursor.fetchall()}
+
+    def store_parsed_blobs(self, entries):
+        """Stores what was extracted from git blobs: (blob, [(owner, repo), ...], [dependency, ...]) tuples."""
+        try:
+            for blob, fetchers, dependencies in entries:
+                self.cursor.execute('INSERT OR IGNORE INTO parsed_blobs (blob) VALUES (?)', (blob,))
+                self.cursor.executemany('INSERT OR IGNORE INTO blob_fetchers (blob, owner, repo) VALUES (?, ?, ?)',
+                                        [(blob, owner, repo) for owner, repo in fetchers])
+                if fetchers:
+                    self.cursor.executemany('INSERT OR IGNORE INTO blob_dependencies (blob, name) VALUES (?, ?)',
+                                            [(blob, package_key(name)) for name in dependencies])
+        except Exception:
+            self._rollback()
+            raise
+        self._commit()
+
+    def find_blob_repositories(self, package_name):
+        """Returns (blob, owner, repo) for every parsed blob declaring the package as a dependency."""
+        self.cursor.execute('''
+            SELECT d.blob, f.owner, f.repo
+            FROM blob_dependencies d
+            JOIN blob_fetchers f ON f.blob = d.blob
+            WHERE d.name = ?
+        ''', (package_key(package_name),))
+        return self.cursor.fetchall()
+
+    def schema_version(self):
+        """The schema version of the file; below SCHEMA_VERSION only for a database opened read-only."""
+        return self.cursor.execute('PRAGMA user_version').fetchone()[0]
+
+    def data_version(self):
+        """A number that changes whenever another connection commits to the database."""
+        return self.cursor.execute('PRAGMA data_version').fetchone()[0]
+
     def close(self):
+        profiling.count("db.rows_changed", self.conn.total_changes)
         self.conn.close()
+
+@contextmanager
+def open_database(db):
+    """Yields `db` if it is already an open Database, which is left open; otherwise opens one at the path `db`."""
+    if isinstance(db, Database):
+        yield db
+    else:
+        with Database(db) as database:
+            yield database
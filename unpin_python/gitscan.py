@@ -0,0 +1,171 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from .database import open_database, package_key, shard_of
+from .index import run_git
+from .nixparse import iter_dependency_names, iter_fetchers, might_contain_fetchers, tokenize
+from .scan import (CHUNK_SIZE, PARALLEL_MIN_FILES, PYTHON_PACKAGES_FILE, QUEUED_CHUNKS_PER_WORKER, WRITE_BATCH_SIZE,
+                   bounded_map, chunks, python_attribute_index)
+
+def resolve_commit(nixpkgs_path, revision):
+    """Returns the commit hash `revision` names in the nixpkgs repository, or None."""
+    output = run_git(nixpkgs_path, "rev-parse", "--verify", "--quiet", f"{revision}^{{commit}}")
+    return output.strip() if output else None
+
+def git_tree_files(nixpkgs_path, commit):
+    """Returns {relative path: blob hash} for every .nix file in a commit's tree, or None if git fails."""
+    output = run_git(nixpkgs_path, "ls-tree", "-r", "-z", "--full-tree", commit)
+    if output is None:
+        return None
+    files = {}
+    for entry in output.split('\0'):
+        if not entry:
+            continue
+        info, path = entry.split('\t', 1)
+        _, object_type, blob = info.split()
+        if object_type == 'blob' and path.endswith('.nix'):
+            files[path] = blob
+    return files
+
+def iter_git_blobs(nixpkgs_path, blobs):
+    """Yields (blob, contents) for each blob hash, read through one long-lived `git cat-file --batch`.
+
+    Hashes are written from a separate thread, so git never waits for us to read before it can
+    take the next request. Blobs git doesn't have are skipped.
+    """
+    blobs = list(blobs)
+    proc = subprocess.Popen(["git", "-C", nixpkgs_path, "cat-file", "--batch"],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def request():
+        try:
+            for blob in blobs:
+                proc.stdin.write(f"{blob}\n".encode())
+            proc.stdin.close()
+        except (BrokenPipeError, ValueError):
+            # The reader stopped early and closed the process
+            pass
+
+    writer = threading.Thread(target=request, daemon=True)
+    writer.start()
+    try:
+        for blob in blobs:
+            header = proc.stdout.readline().split()
+            if len(header) != 3:
+                continue
+            data = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)  # the newline after the contents
+            yield blob, data
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+        writer.join()
+
+def extract_blob(data):
+    """Returns ([(owner, repo), ...], [dependency, ...]) for the contents of a .nix blob."""
+    content = data.decode('utf-8', errors='replace')
+    tokens = list(tokenize(content))
+    fetchers = list(dict.fromkeys((fetcher['owner'], fetcher['repo']) for fetcher in iter_fetchers(content, tokens)
+                                  if fetcher['owner'] and fetcher['repo']))
+    dependencies = sorted(set(iter_dependency_names(content, tokens))) if fetchers else []
+    return fetchers, dependencies
+
+def _extract_blob_chunk(blob_chunk):
+    return [(blob, *extract_blob(data)) for blob, data in blob_chunk]
+
+def parse_new_blobs(db, nixpkgs_path, blobs, workers=None):
+    """Reads and parses the blobs the database doesn't know yet, storing the results in batches.
+
+    Returns how many blobs were parsed.
+    """
+    known = db.get_parsed_blobs()
+    new_blobs = sorted(set(blobs) - known)
+    if not new_blobs:
+        return 0
+    workers = workers or os.cpu_count() or 1
+
+    def candidates(progress):
+        # Blobs without a fetcher marker are recorded as parsed without tokenizing them
+        empty = []
+        for blob, data in iter_git_blobs(nixpkgs_path, new_blobs):
+            progress.update(1)
+            if might_contain_fetchers(data):
+                yield blob, data
+            else:
+                empty.append((blob, [], []))
+                if len(empty) >= WRITE_BATCH_SIZE:
+                    db.store_parsed_blobs(empty)
+                    empty = []
+        db.store_parsed_blobs(empty)
+
+    with tqdm(total=len(new_blobs), desc="Parsing blobs") as progress:
+        blob_chunks = chunks(candidates(progress), CHUNK_SIZE)
+        if workers == 1 or len(new_blobs) < PARALLEL_MIN_FILES:
+            for blob_chunk in blob_chunks:
+                db.store_parsed_blobs(_extract_blob_chunk(blob_chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for entries in bounded_map(executor, _extract_blob_chunk, blob_chunks, workers * QUEUED_CHUNKS_PER_WORKER):
+                    db.store_parsed_blobs(entries)
+    return len(new_blobs)
+
+def run_revision_scan(package_names, nixpkgs_path, revision, db_path, workers=None, shard=None):
+    """Like run_batch_scan, but reads the files of a nixpkgs git revision from the object store.
+
+    Fetchers and dependencies are cached per blob hash, so only files that differ from every
+    revision scanned before are parsed. Results are stored under `revision`. `shard` limits the
+    scan to one shard of the paths, as in run_batch_scan.
+    """
+    package_names = list(dict.fromkeys(package_names))
+    if not nixpkgs_path or not os.path.isdir(nixpkgs_path):
+        print(f"Error: Nixpkgs directory not found at {nixpkgs_path}")
+        return
+    commit = resolve_commit(nixpkgs_path, revision)
+    if not commit:
+        print(f"Error: '{revision}' is not a commit in {nixpkgs_path}")
+        return
+    tree = git_tree_files(nixpkgs_path, commit)
+    if tree is None:
+        print(f"Error: could not list the files of {commit[:12]}")
+        return
+
+    of_shard = f", shard {shard[0]} of {shard[1]}" if shard else ""
+    print(f"--- Starting Nixpkgs Scan for {', '.join(repr(p) for p in package_names)} at {revision} ({commit[:12]}{of_shard}) ---")
+    python_packages_blob = tree.get(PYTHON_PACKAGES_FILE)
+    python_packages_text = ''
+    if python_packages_blob:
+        for _, data in iter_git_blobs(nixpkgs_path, [python_packages_blob]):
+            python_packages_text = data.decode('utf-8', errors='replace')
+    # A package's own definition mentions its name but doesn't depend on it
+    definitions = python_attribute_index(tree, python_packages_text)
+
+    if shard:
+        tree = {path: blob for path, blob in tree.items() if shard_of(path, shard[1]) == shard[0]}
+    paths_by_blob = {}
+    for path, blob in tree.items():
+        paths_by_blob.setdefault(blob, []).append(path)
+
+    with open_database(db_path) as db, db.transaction():
+        parsed = parse_new_blobs(db, nixpkgs_path, paths_by_blob, workers)
+        print(f"{len(tree)} files in {len(paths_by_blob)} distinct blobs; parsed {parsed}, the rest were cached.")
+
+        db.start_scan_results(package_names, revision)
+        counts = {}
+        for name in package_names:
+            own_files = definitions.get(package_key(name), ())
+            repos = {(path, owner, repo)
+                     for blob, owner, repo in db.find_blob_repositories(name)
+                     for path in paths_by_blob.get(blob, ())
+                     if path not in own_files}
+            db.add_scan_repositories([(name, {"path": path, "owner": owner, "repo": repo})
+                                      for path, owner, repo in sorted(repos)], revision)
+            counts[name] = len(repos)
+        db.finish_scan_results(package_names, revision, commit, shard)
+
+    for name, count in counts.items():
+        print(f"Upserted {count} unique repositories for '{name}' at {revision}.")
+    print(f"Scan complete. Upserted {sum(counts.values())} unique repositories for {len(counts)} packages.")
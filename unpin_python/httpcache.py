@@ -0,0 +1,131 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+import requests
+from requests.structures import CaseInsensitiveDict
+from . import profiling
+
+DEFAULT_TTL = timedelta(hours=1)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+class ResponseCache:
+    """A persistent, size-bounded LRU cache of GitHub API responses, stored in SQLite.
+
+    Responses younger than `ttl` are served without touching the network; older ones are
+    revalidated with `If-None-Match`/`If-Modified-Since`, and a 304 refreshes the stored copy.
+    """
+
+    def __init__(self, db_path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, clock=time.time):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, -- URL plus Accept header
+                url TEXT,
+                status INTEGER,
+                headers TEXT, -- JSON object
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at)')
+        self.conn.commit()
+
+    @staticmethod
+    def _key(url, headers):
+        return f"{url}\n{(headers or {}).get('Accept', '')}"
+
+    def _load(self, key):
+        row = self.conn.execute('''
+            SELECT url, status, headers, body, etag, last_modified, fetched_at FROM responses WHERE key = ?
+        ''', (key,)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, etag, last_modified, fetched_at = row
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = body
+        response.encoding = 'utf-8'
+        response.from_cache = True
+        return response, etag, last_modified, fetched_at
+
+    def _touch(self, key, refetched=False):
+        now = self.clock()
+        if refetched:
+            self.conn.execute('UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+        else:
+            self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+        self.conn.commit()
+
+    def _store(self, key, response):
+        now = self.clock()
+        body = response.content
+        self.conn.execute('''
+            INSERT OR REPLACE INTO responses
+                (key, url, status, headers, body, etag, last_modified, fetched_at, accessed_at, size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (key, response.url, response.status_code, json.dumps(dict(response.headers)), body,
+              response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now, len(body)))
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        """Drops least recently used responses until the cache fits in `max_bytes`."""
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', doomed)
+
+    def get(self, url, scheduler, headers=None, offline=False):
+        """Returns the response for `url`, from the cache when possible.
+
+        Offline, only cached responses are returned (regardless of age), or None on a miss.
+        """
+        key = self._key(url, headers)
+        with self._lock:
+            cached = self._load(key)
+        if cached:
+            response, etag, last_modified, fetched_at = cached
+            if offline or self.clock() - fetched_at < self.ttl.total_seconds():
+                profiling.count("http.cache_hits")
+                with self._lock:
+                    self._touch(key)
+                return response
+        elif offline:
+            return None
+
+        request_headers = dict(headers or {})
+        if cached and etag:
+            request_headers['If-None-Match'] = etag
+        elif cached and last_modified:
+            request_headers['If-Modified-Since'] = last_modified
+        fresh = scheduler.get(url, headers=request_headers)
+
+        with self._lock:
+            if fresh.status_code == 304 and cached:
+                profiling.count("http.not_modified")
+                self._touch(key, refetched=True)
+                return cached[0]
+            if fresh.status_code == 200:
+                self._store(key, fresh)
+        return fresh
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import subprocess
+import sys
+from tqdm import tqdm
+from .database import open_database, package_key
+from .nixparse import iter_dependency_names, might_contain_fetchers, tokenize
+from .scan import build_python_attribute_index, parse_repo_info, unique_repositories
+
+def git_blob_hash(data):
+    """Hashes file contents the same way `git hash-object` does."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def run_git(nixpkgs_path, *args):
+    """Returns the output of a git command in the nixpkgs checkout, or None if it fails."""
+    try:
+        proc = subprocess.run(["git", "-C", nixpkgs_path, *args], capture_output=True, text=True, check=True)
+        return proc.stdout
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return None
+
+def git_revision(nixpkgs_path):
+    output = run_git(nixpkgs_path, "rev-parse", "HEAD")
+    return output.strip() if output else None
+
+def git_changed_files(nixpkgs_path, since_revision):
+    """Returns the .nix files that differ from `since_revision` in the working tree, or None if git can't tell.
+
+    A renamed file is listed under both its old and its new path.
+    """
+    changed = run_git(nixpkgs_path, "diff", "--name-only", "--no-renames", since_revision, "--", "*.nix")
+    untracked = run_git(nixpkgs_path, "ls-files", "--others", "--exclude-standard", "--", "*.nix")
+    if changed is None or untracked is None:
+        return None
+    return sorted({line for line in (changed + untracked).split('\n') if line})
+
+def walk_nix_files(nixpkgs_path):
+    for root, dirs, files in os.walk(nixpkgs_path):
+        dirs[:] = [d for d in dirs if d != '.git']
+        for name in files:
+            if name.endswith('.nix'):
+                yield os.path.relpath(os.path.join(root, name), start=nixpkgs_path)
+
+def index_file(nixpkgs_path, relative_path, known_blob=None):
+    """Parses one file for the index. Returns None if its blob is unchanged or it can't be read."""
+    try:
+        with open(os.path.join(nixpkgs_path, relative_path), 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        tqdm.write(f"Could not process file {relative_path}: {e}", file=sys.stderr)
+        return None
+    blob = git_blob_hash(data)
+    if blob == known_blob:
+        return None
+    if not might_contain_fetchers(data):
+        return relative_path, blob, [], set()
+    content = data.decode('utf-8', errors='replace')
+    tokens = list(tokenize(content))
+    repositories = parse_repo_info(content, relative_path, tokens)
+    dependencies = set(iter_dependency_names(content, tokens)) if repositories else set()
+    return relative_path, blob, repositories, dependencies
+
+def update_index(db, nixpkgs_path):
+    """Brings the persistent fetcher index up to date with the nixpkgs working tree.
+
+    If the index was built from a git revision, only files changed since then are re-read;
+    otherwise the whole tree is walked and only files whose blob hash changed are re-parsed.
+    Returns the number of files re-parsed.
+    """
+    entries, _ = sync_index(db, nixpkgs_path)
+    return len(entries)
+
+def sync_index(db, nixpkgs_path):
+    """update_index(), returning the re-parsed index entries and the set of removed paths."""
+    revision = git_revision(nixpkgs_path)
+    indexed_revision = db.get_index_revision()
+
+    changed = git_changed_files(nixpkgs_path, indexed_revision) if revision and indexed_revision else None
+    if changed is not None:
+        # Files that were dirty when indexed: reverting them leaves no trace in the diff
+        changed = sorted(set(changed) | db.get_index_dirty_paths())
+    if changed is None:
+        print(f"--- Building fetcher index for {nixpkgs_path} ---")
+        known_blobs = db.get_indexed_blobs()
+        candidates = list(walk_nix_files(nixpkgs_path))
+        removed = set(known_blobs) - set(candidates)
+    else:
+        print(f"--- Updating fetcher index: {len(changed)} files changed since {indexed_revision[:12]} ---")
+        known_blobs = db.get_indexed_blobs(changed)
+        candidates = [path for path in changed if os.path.isfile(os.path.join(nixpkgs_path, path))]
+        removed = set(changed) - set(candidates)
+
+    entries = []
+    for path in tqdm(candidates, desc="Indexing files", leave=False):
+        entry = index_file(nixpkgs_path, path, known_blobs.get(path))
+        if entry:
+            entries.append(entry)
+
+    # The revision is HEAD, but the contents came from the working tree
+    dirty = git_changed_files(nixpkgs_path, revision) if revision else None
+    db.update_index(entries, removed, revision or "", dirty or ())
+    print(f"Index updated: {len(entries)} files re-parsed, {len(removed)} removed.")
+    return entries, removed
+
+def run_index_scan(package_names, nixpkgs_path, db_path):
+    """Like run_batch_scan, but answers package lookups from the persistent fetcher index."""
+    if not nixpkgs_path:
+        print("--- Skipping Nixpkgs Scan: --nixpkgs-path not provided ---")
+        return
+
+    package_names = list(dict.fromkeys(package_names))
+    if not os.path.isdir(nixpkgs_path):
+        print(f"Error: Nixpkgs directory not found at {nixpkgs_path}")
+        return
+
+    definitions = build_python_attribute_index(nixpkgs_path)
+    with open_database(db_path) as db, db.transaction():
+        update_index(db, nixpkgs_path)
+        results = {name: unique_repositories([repo for repo in db.find_indexed_repositories(name)
+                                              if repo['path'] not in definitions.get(package_key(name), ())])
+                   for name in package_names}
+        upserted_count = db.upsert_scan_results(results)
+
+    for name, repos in results.items():
+        print(f"Upserted {len(repos)} unique repositories for '{name}'.")
+    print(f"Scan complete. Upserted {upserted_count} unique repositories for {len(results)} packages.")
@@ -1,34 +1,32 @@
 import argparse
 import os
 import re
+import sys
+from datetime import datetime, timedelta, timezone
 
-from .scan import run_scan
-from .search import run_search
-from .report import run_report
-from .reset import run_reset
+# Only light modules here: each command imports what it needs when it runs, so a report or a
+# reset never loads requests or tqdm
+from . import profiling
+from .database import SEARCH_KEEP_AGE, SEARCH_KEEP_RUNS, WORKING_TREE, Database
+from .pins import parse_specifier
+from .report import REPORT_FORMATS
 
 DB_PATH = 'db.sqlite'
+CACHE_PATH = 'http_cache.sqlite'
 
-def parse_specifier(spec_str):
-    match = re.search(r'(==|!=|>=|<=|>|<)', spec_str)
-    if match:
-        op = match.group(1)
-        parts = re.split(f'({re.escape(op)})', spec_str, maxsplit=1)
-        if len(parts) >= 3:
-            package_name = parts[0].strip()
-            version_part = parts[2].strip()
-            search_string_with_spaces = f"{package_name} {op} {version_part}"
-            canonical_search_string = f"{package_name}{op}{version_part}"
-            return package_name, search_string_with_spaces, canonical_search_string
-    # Fallback for no operator or malformed specifier
-    package_name = spec_str.strip()
-    search_string_with_spaces = f"{package_name} == "
-    canonical_search_string = f"{package_name}=="
-    return package_name, search_string_with_spaces, canonical_search_string
+def parse_shard(shard_str):
+    """Parses 'K/N' into (K, N), for the K-th of N shards."""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', shard_str)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"expected K/N with 1 <= K <= N, got '{shard_str}'")
+    return int(match.group(1)), int(match.group(2))
 
 def main():
     parser = argparse.ArgumentParser(description="A tool to correlate Nixpkgs packages with GitHub search results.")
     parser.add_argument("-n", "--nixpkgs-path", default=os.environ.get("NIXPKGS", os.path.abspath("../nixpkgs")), help="Path to your local nixpkgs clone. Can also be set via the NIXPKGS environment variable.")
+    parser.add_argument("--profile", action="store_true", help="Record per-stage timings and counters and print a JSON summary to stderr at exit.")
+    parser.add_argument("--profile-output", metavar="FILE", help="With --profile, write the JSON summary to FILE instead of stderr.")
+    parser.add_argument("--cprofile", metavar="FILE", help="Also dump cProfile statistics to FILE (readable with pstats).")
     
     subparsers = parser.add_subparsers(dest="command", required=True, help="The command to execute.")
 
@@ -36,36 +34,155 @@ def main():
     specifier_commands = ['scan', 'search', 'report', 'all']
     for cmd in specifier_commands:
         cmd_parser = subparsers.add_parser(cmd, help=f"{cmd.capitalize()} the database for given package specifiers.")
-        cmd_parser.add_argument("specifiers", nargs='+', help="One or more package specifiers (e.g., 'hatchling', 'gcovr==7.2').")
+        cmd_parser.add_argument("specifiers", nargs='*' if cmd == 'report' else '+', help="One or more package specifiers (e.g., 'hatchling', 'gcovr==7.2').")
+        if cmd == 'report':
+            cmd_parser.add_argument("--all", action="store_true", help="Report on the latest search of every specifier in the database.")
+            cmd_parser.add_argument("--format", choices=REPORT_FORMATS, default="text", help="Output format. 'jsonl' and 'csv' stream one row per path, package, search and repository (default: text).")
+            cmd_parser.add_argument("--rev", default=WORKING_TREE, metavar="REVISION", help="Report on the paths found by 'scan --rev REVISION' instead of the working tree scan.")
+            cmd_parser.add_argument("--changed-since", type=float, metavar="HOURS", help="List the repositories that searches of the last HOURS added (+) or removed (-), from the stored deltas.")
+        if cmd in ('search', 'all'):
+            cmd_parser.add_argument("--targeted", action="store_true", help="Check the pyproject.toml of each scanned repository instead of searching all of GitHub.")
+            cmd_parser.add_argument("--pin-max-age", type=float, default=24, metavar="HOURS", help="With --targeted, reuse pins fetched within this many hours (default: 24; 0 refetches everything).")
+            cmd_parser.add_argument("--offline", action="store_true", help="Serve GitHub results only from the response and pin caches; make no network requests.")
+            cmd_parser.add_argument("--resume", action="store_true", help="Continue an interrupted GitHub-wide search from its last stored page.")
+            cmd_parser.add_argument("--cache-ttl", type=float, default=1, metavar="HOURS", help="Serve cached GitHub responses younger than this without revalidating (default: 1).")
+            cmd_parser.add_argument("--search-workers", type=int, default=None, help="Number of search result pages fetched concurrently across all specifiers (default: 8).")
+        if cmd in ('scan', 'all'):
+            cmd_parser.add_argument("--index", action="store_true", help="Answer the scan from the persistent fetcher index, re-parsing only files changed since it was built.")
+            cmd_parser.add_argument("-j", "--workers", type=int, default=None, help="Number of processes used to extract fetchers from files (default: CPU count).")
+            cmd_parser.add_argument("--shard", type=parse_shard, metavar="K/N", help="Only scan the K-th of N deterministic shards of the nixpkgs paths; combine the shard databases with 'merge'.")
+        if cmd == 'scan':
+            cmd_parser.add_argument("--rev", action="append", metavar="REVISION", help="Scan a git revision of nixpkgs (branch, tag or commit) from its object store instead of the working tree. May be repeated.")
 
     # --- Parser for the reset command ---
     reset_parser = subparsers.add_parser("reset", help="Delete data from the database.")
     reset_parser.add_argument("packages", nargs='+', help="One or more package names to reset, or '*' to reset the entire database.")
 
+    # --- Parser for the merge command ---
+    merge_parser = subparsers.add_parser("merge", help="Merge the scans and search data of other databases into this one.")
+    merge_parser.add_argument("databases", nargs='+', help="Database files to merge, e.g. one per scan shard.")
+
+    # --- Parser for the compact command ---
+    compact_parser = subparsers.add_parser("compact", help="Reduce old search runs to deltas, then VACUUM and ANALYZE the database.")
+    compact_parser.add_argument("--keep-runs", type=int, default=SEARCH_KEEP_RUNS, help=f"Keep the full matches of the latest N runs per specifier (default: {SEARCH_KEEP_RUNS}).")
+    compact_parser.add_argument("--keep-days", type=float, default=SEARCH_KEEP_AGE.days, help=f"Also keep the full matches of runs younger than this (default: {SEARCH_KEEP_AGE.days}).")
+
+    # --- Parser for the serve command ---
+    serve_parser = subparsers.add_parser("serve", help="Answer scan and report queries over HTTP from memory, re-indexing nixpkgs as it changes.")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1).")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765).")
+    serve_parser.add_argument("--socket", metavar="PATH", help="Listen on a Unix socket at PATH instead of a TCP port.")
+    serve_parser.add_argument("--watch-interval", type=float, default=10, metavar="SECONDS", help="How often to check the nixpkgs checkout for a new commit (default: 10).")
+
     args = parser.parse_args()
-    
-    if args.command == "reset":
-        run_reset(args.packages, DB_PATH)
-        return
-
-    # --- Logic for commands with specifiers ---
-    for specifier in args.specifiers:
-        package_name, search_string_with_spaces, canonical_search_string = parse_specifier(specifier)
-        
+    if args.command == "report" and not args.specifiers and not args.all:
+        parser.error("report needs at least one specifier, or --all")
+    if getattr(args, 'shard', None) and args.index:
+        parser.error("--shard can't be combined with --index")
+    if args.command == "report" and args.changed_since is not None and not args.specifiers:
+        parser.error("report --changed-since needs at least one specifier")
+
+    if args.profile:
+        profiling.enable()
+    profiler = None
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run_command(args)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        profiling.write_summary(args.profile_output, sys.stderr)
+
+def run_command(args):
+    # One connection serves the whole invocation
+    with Database(DB_PATH) as db:
+        if args.command == "reset":
+            from .reset import run_reset
+            with profiling.span("reset"):
+                run_reset(args.packages, db)
+            return
+
+        if args.command == "merge":
+            from .merge import run_merge
+            with profiling.span("merge"):
+                run_merge(args.databases, db)
+            return
+        if args.command == "serve":
+            from .serve import run_serve
+            run_serve(db, args.nixpkgs_path, args.host, args.port, args.socket, args.watch_interval)
+            return
+        if args.command == "compact":
+            from .compact import run_compact
+            with profiling.span("compact"):
+                run_compact(db, args.keep_runs, timedelta(days=args.keep_days))
+            return
+
+        parsed_specifiers = [(specifier, *parse_specifier(specifier)) for specifier in args.specifiers]
+        package_names = [parsed[1] for parsed in parsed_specifiers]
+
+        # --- Scanning is done in one pass over nixpkgs for all specifiers ---
+        def scan(package_names, nixpkgs_path, db):
+            if getattr(args, 'rev', None):
+                from .gitscan import run_revision_scan
+                for revision in args.rev:
+                    run_revision_scan(package_names, nixpkgs_path, revision, db, workers=args.workers, shard=args.shard)
+            elif args.index:
+                from .index import run_index_scan
+                run_index_scan(package_names, nixpkgs_path, db)
+            else:
+                from .scan import run_batch_scan
+                run_batch_scan(package_names, nixpkgs_path, db, workers=args.workers, shard=args.shard)
+
         if args.command == "scan":
-            run_scan(package_name, args.nixpkgs_path, DB_PATH)
-        elif args.command == "search":
-            run_search(package_name, search_string_with_spaces, canonical_search_string, DB_PATH)
-        elif args.command == "report":
-            run_report(package_name, canonical_search_string, DB_PATH)
-        elif args.command == "all":
-            print(f"--- Running all steps for specifier '{specifier}' ---")
+            with profiling.span("scan"):
+                scan(package_names, args.nixpkgs_path, db)
+            return
+        if args.command == "all":
             if args.nixpkgs_path and os.path.isdir(args.nixpkgs_path):
-                run_scan(package_name, args.nixpkgs_path, DB_PATH)
+                with profiling.span("scan"):
+                    scan(package_names, args.nixpkgs_path, db)
             else:
-                print(f"--- Skipping Nixpkgs Scan for '{package_name}': --nixpkgs-path not provided or invalid ---")
-            run_search(package_name, search_string_with_spaces, canonical_search_string, DB_PATH)
-            run_report(package_name, canonical_search_string, DB_PATH)
+                print(f"--- Skipping Nixpkgs Scan for {', '.join(repr(p) for p in package_names)}: --nixpkgs-path not provided or invalid ---")
+
+        # --- Searching fans out over all specifiers and query variants at once ---
+        if args.command in ("search", "all"):
+            if args.command == "all":
+                print(f"--- Running search for {', '.join(repr(specifier) for specifier, *_ in parsed_specifiers)} ---")
+            from .httpcache import ResponseCache
+            from .search import SEARCH_WORKERS, run_searches
+            cache = ResponseCache(CACHE_PATH, ttl=timedelta(hours=args.cache_ttl))
+            with profiling.span("search"):
+                run_searches([parsed[1:] for parsed in parsed_specifiers], db, targeted=args.targeted,
+                             pin_max_age=timedelta(hours=args.pin_max_age), cache=cache, offline=args.offline,
+                             resume=args.resume, workers=args.search_workers or SEARCH_WORKERS)
+            cache.close()
+
+        # --- The whole matrix comes out of one query ---
+        from .report import run_changes_report, run_matrix_report, run_report
+        if args.command == "report" and args.changed_since is not None:
+            since = datetime.now(timezone.utc) - timedelta(hours=args.changed_since)
+            for _, package_name, _, canonical_search_string in parsed_specifiers:
+                with profiling.span("report"):
+                    run_changes_report(package_name, canonical_search_string, db, since)
+            return
+        if args.command == "report" and (args.all or args.format != "text"):
+            specifiers = None if args.all else [(package_name, canonical_search_string)
+                                                for _, package_name, _, canonical_search_string in parsed_specifiers]
+            with profiling.span("report"):
+                run_matrix_report(specifiers, db, args.format, revision=args.rev)
+            return
+
+        # --- Logic for commands with specifiers ---
+        if args.command in ("report", "all"):
+            for specifier, package_name, search_string_with_spaces, canonical_search_string in parsed_specifiers:
+                if args.command == "all":
+                    print(f"--- Running report for specifier '{specifier}' ---")
+                with profiling.span("report"):
+                    run_report(package_name, canonical_search_string, db, revision=getattr(args, 'rev', WORKING_TREE))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
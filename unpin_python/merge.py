@@ -0,0 +1,38 @@
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from .database import SCHEMA_VERSION, Database, open_database
+
+@contextmanager
+def read_source(source_path):
+    """Yields the Database at `source_path` without writing to it.
+
+    A source of an older schema is copied to a temporary file, and the copy is migrated.
+    """
+    with Database(source_path, read_only=True) as source:
+        if source.schema_version() >= SCHEMA_VERSION:
+            yield source
+            return
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            copy_path = os.path.join(tmp_dir, "source.sqlite")
+            copy = sqlite3.connect(copy_path)
+            source.conn.backup(copy)
+            copy.close()
+            with Database(copy_path) as migrated:
+                yield migrated
+
+def run_merge(source_paths, db_path):
+    """Merges other databases, such as those of sharded scans, into this one; one transaction per source.
+
+    The sources are only read, so they can sit on read-only media and stay as they were if a merge fails.
+    """
+    with open_database(db_path) as db:
+        for source_path in source_paths:
+            if not os.path.isfile(source_path):
+                print(f"Error: database not found at {source_path}")
+                continue
+            with read_source(source_path) as source, db.transaction():
+                counts = db.merge_database(source)
+            print(f"Merged {source_path}: {counts['scans']} scans, {counts['search_runs']} search runs, "
+                  f"{counts['pin_checks']} pin checks and {counts['blobs']} parsed blobs.")
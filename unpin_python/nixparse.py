@@ -0,0 +1,284 @@
+import re
+
+# Fetchers whose source lives on GitHub
+GITHUB_FETCHERS = {'fetchFromGitHub'}
+# Generic fetchers that count when their `url` points at github.com
+URL_FETCHERS = {'fetchgit', 'fetchurl', 'fetchzip', 'fetchTarball'}
+# A file without any of these substrings cannot contain a GitHub-backed fetcher
+FETCHER_MARKERS = (b'fetchFromGitHub', b'github.com')
+# Attributes whose value lists a derivation's dependencies
+DEPENDENCY_ATTRS = {
+    'build-system', 'dependencies', 'optional-dependencies', 'buildInputs', 'nativeBuildInputs',
+    'propagatedBuildInputs', 'propagatedNativeBuildInputs', 'checkInputs', 'nativeCheckInputs', 'pythonPath',
+}
+
+# Whitespace and line comments are skipped as part of matching the next token
+_CODE_TOKEN = re.compile(r'''
+    (?:\s+|\#[^\n]*)*
+    (?:
+    (?P<ident>[A-Za-z_][A-Za-z0-9_'-]*)
+  | (?P<operator>[!<>=]=)
+  | (?P<punct>[=;])
+  | (?P<open>\$\{|\{)
+  | (?P<close>\})
+  | (?P<simple_string>"(?:[^"\\$]|\\.|\$(?!\{))*")
+  | (?P<dstring>")
+  | (?P<istring>'')
+  | (?P<block_comment>/\*)
+  | (?P<other>[^\sA-Za-z_\#/"'{}$=;!<>]+|.)
+  | (?P<eof>$)
+    )
+''', re.VERBOSE | re.DOTALL)
+
+# String bodies stop at the closing quote or at the start of an interpolation
+_STRING_BODY = {
+    '"': re.compile(r'(?:[^"\\$]+|\\.|\$\$|\$(?!\{))*', re.DOTALL),
+    "''": re.compile(r"(?:[^'$]+|'(?!')|''(?:'|\$|\\.)|\$\$|\$(?!\{))*", re.DOTALL),
+}
+
+_INTERPOLATION = re.compile(r"\$\{\s*([A-Za-z_][A-Za-z0-9_'-]*)\s*\}")
+_GITHUB_URL = re.compile(r'^(?:https?|git|ssh)://(?:[^@/]+@)?github\.com[/:]([^/]+)/([^/#?]+?)(?:\.git)?(?:[/#?]|$)')
+
+_MAX_RESOLVE_DEPTH = 8
+
+def might_contain_fetchers(data):
+    """Cheap bytes-level prefilter run before tokenizing a file."""
+    return any(marker in data for marker in FETCHER_MARKERS)
+
+def tokenize(text):
+    """Yields (kind, value) tokens for the top-level code of a Nix file in a single pass.
+
+    Kinds are 'ident', 'str', '{', '}', '=', ';' and 'other'. String literals are yielded as one
+    'str' token holding their raw text; code inside their `${...}` interpolations is skipped.
+    """
+    pos, end = 0, len(text)
+    # Contexts entered from top-level code: quote strings, or brace depths of interpolations
+    stack = []
+    string_start = 0
+    while pos < end:
+        if stack and isinstance(stack[-1], str):
+            quote = stack[-1]
+            pos = _STRING_BODY[quote].match(text, pos).end()
+            if text.startswith('${', pos):
+                stack.append(0)
+                pos += 2
+                continue
+            stack.pop()
+            if not stack:
+                yield 'str', text[string_start:pos]
+            pos += len(quote)
+            continue
+
+        match = _CODE_TOKEN.match(text, pos)
+        kind = match.lastgroup
+        value = match.group(kind)
+        pos = match.end()
+        if kind == 'eof':
+            break
+        if kind == 'block_comment':
+            close = text.find('*/', pos)
+            pos = end if close < 0 else close + 2
+            continue
+        if kind == 'simple_string':
+            # A string without interpolations, matched whole
+            if not stack:
+                yield 'str', value[1:-1]
+            continue
+        if kind in ('dstring', 'istring'):
+            if not stack:
+                string_start = pos
+            stack.append(value)
+            continue
+
+        if stack:
+            # Inside an interpolation: only track where it ends
+            if kind == 'open':
+                stack[-1] += 1
+            elif kind == 'close':
+                if stack[-1]:
+                    stack[-1] -= 1
+                else:
+                    stack.pop()
+            continue
+
+        if kind == 'open':
+            yield '{', value
+        elif kind == 'close':
+            yield '}', value
+        elif kind == 'punct':
+            yield value, value
+        elif kind == 'ident':
+            yield 'ident', value
+        else:
+            yield 'other', value
+
+def iter_dependency_names(text, tokens=None):
+    """Yields the identifiers a Nix file declares as dependencies.
+
+    These are the arguments of the file's top-level function (`{ lib, hatchling }:`) and every
+    identifier in the value of a dependency attribute, e.g. `build-system = [ hatchling ];`,
+    `python3Packages.hatchling` or `with ps; [ hatchling ] ++ lib.optionals ...`.
+    `tokens`, the list of tokenize(text), lets iter_fetchers() reuse the same pass.
+    """
+    if tokens is None:
+        tokens = list(tokenize(text))
+    pos = 0
+    if tokens and tokens[0][0] == '{':
+        depth, pos = 1, 1
+        arguments = []
+        while pos < len(tokens) and depth:
+            kind, value = tokens[pos]
+            if kind == '{':
+                depth += 1
+            elif kind == '}':
+                depth -= 1
+            elif kind == 'ident' and depth == 1:
+                arguments.append(value)
+            pos += 1
+        if pos < len(tokens) and tokens[pos][0] == 'other' and tokens[pos][1][0] in ':@':
+            yield from arguments
+
+    depth = 0
+    # Brace depth of the dependency attribute being read, or None outside of one
+    dependency_depth = None
+    for index in range(pos, len(tokens)):
+        kind, value = tokens[index]
+        if kind == '{':
+            depth += 1
+        elif kind == '}':
+            depth -= 1
+            if dependency_depth is not None and depth < dependency_depth:
+                dependency_depth = None
+        elif kind == ';':
+            # `with ps;` is part of the value, not the end of the binding
+            if dependency_depth == depth and tokens[index - 2] != ('ident', 'with'):
+                dependency_depth = None
+        elif kind == '=':
+            previous = tokens[index - 1]
+            if dependency_depth is None and previous[0] == 'ident' and previous[1] in DEPENDENCY_ATTRS:
+                dependency_depth = depth
+        elif kind == 'ident' and dependency_depth is not None:
+            yield value
+
+class _Scope:
+    """An attribute set (or the file's top level) and the simple bindings made in it."""
+    __slots__ = ('parent', 'fetcher', 'bindings')
+
+    def __init__(self, parent=None, fetcher=None):
+        self.parent = parent
+        self.fetcher = fetcher
+        # name -> ('str', raw text) or ('ref', identifier)
+        self.bindings = {}
+
+def _resolve_name(name, scope, depth=0):
+    while scope is not None and depth < _MAX_RESOLVE_DEPTH:
+        binding = scope.bindings.get(name)
+        if binding is not None:
+            kind, value = binding
+            if kind == 'str':
+                return _resolve_string(value, scope, depth + 1)
+            # `x = x;` (or `inherit x;`) refers to the enclosing scope
+            return _resolve_name(value, scope.parent if value == name else scope, depth + 1)
+        scope = scope.parent
+    return None
+
+def _resolve_string(raw, scope, depth=0):
+    """Substitutes `${name}` interpolations. Returns None if any remain unresolved."""
+    if '${' not in raw:
+        return raw
+    def substitute(match):
+        value = _resolve_name(match.group(1), scope, depth)
+        return match.group() if value is None else value
+    resolved = _INTERPOLATION.sub(substitute, raw)
+    return None if '${' in resolved else resolved
+
+def _resolve_attr(scope, name):
+    binding = scope.bindings.get(name)
+    if binding is None:
+        return None
+    kind, value = binding
+    if kind == 'str':
+        return _resolve_string(value, scope)
+    return _resolve_name(value, scope.parent if value == name else scope)
+
+def _describe(scope):
+    fetcher = {'fetcher': scope.fetcher, 'owner': None, 'repo': None, 'rev': None, 'tag': None}
+    for attr in ('rev', 'tag'):
+        value = _resolve_attr(scope, attr)
+        binding = scope.bindings.get(attr)
+        if value is None and binding and binding[0] == 'str':
+            # Keep unresolved revisions as written, e.g. "v${version}"
+            value = binding[1]
+        fetcher[attr] = value
+    if scope.fetcher in GITHUB_FETCHERS:
+        fetcher['owner'] = _resolve_attr(scope, 'owner')
+        fetcher['repo'] = _resolve_attr(scope, 'repo')
+        return fetcher
+    url = _resolve_attr(scope, 'url')
+    match = _GITHUB_URL.match(url) if url else None
+    if not match:
+        return None
+    fetcher['owner'], fetcher['repo'] = match.group(1), match.group(2)
+    return fetcher
+
+def iter_fetchers(text, tokens=None):
+    """Yields a dict with fetcher/owner/repo/rev/tag for every GitHub-backed fetcher call in a Nix file.
+
+    Runs in time linear in the size of the file. Attributes given as identifiers (`repo = pname;`),
+    `inherit`s and simple `${name}` interpolations are resolved against enclosing bindings;
+    values that can't be resolved statically are None. `tokens` is as for iter_dependency_names().
+    """
+    root = _Scope()
+    scopes = [root]
+    fetcher_scopes = []
+    pending_fetcher = None
+    prev_kind = prev_value = None
+    # The attribute currently being assigned, and its value if it is a single token
+    binding_name = binding_value = None
+    inheriting = False
+
+    for kind, value in tokenize(text) if tokens is None else tokens:
+        if kind == '{':
+            scope = _Scope(scopes[-1], pending_fetcher)
+            if pending_fetcher:
+                fetcher_scopes.append(scope)
+            scopes.append(scope)
+            pending_fetcher = binding_name = binding_value = None
+            inheriting = False
+        elif kind in ('}', ';'):
+            if binding_name and binding_value:
+                scopes[-1].bindings[binding_name] = binding_value
+            if kind == '}' and len(scopes) > 1:
+                scopes.pop()
+            pending_fetcher = binding_name = binding_value = None
+            inheriting = False
+        elif kind == '=':
+            binding_name = prev_value if prev_kind == 'ident' and not inheriting else None
+            binding_value = None
+            pending_fetcher = None
+        elif kind == 'ident':
+            if inheriting:
+                scopes[-1].bindings[value] = ('ref', value)
+            elif value == 'inherit' and binding_name is None:
+                inheriting = True
+            elif binding_name:
+                binding_value = ('ref', value) if binding_value is None and prev_kind == '=' else False
+            if value in GITHUB_FETCHERS or value in URL_FETCHERS:
+                pending_fetcher = value
+            elif not (value == 'rec' and pending_fetcher):
+                pending_fetcher = None
+        elif kind == 'str':
+            if binding_name:
+                binding_value = ('str', value) if binding_value is None and prev_kind == '=' else False
+            pending_fetcher = None
+        else:
+            if binding_name:
+                binding_value = False
+            pending_fetcher = None
+            inheriting = False
+        prev_kind, prev_value = kind, value
+
+    for scope in fetcher_scopes:
+        fetcher = _describe(scope)
+        if fetcher:
+            yield fetcher
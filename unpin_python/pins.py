@@ -0,0 +1,100 @@
+import operator
+import re
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '>': operator.gt,
+    '<': operator.lt,
+}
+
+_SEARCH_OPERATOR = re.compile(r'(==|!=|>=|<=|>|<)')
+_CLAUSE = re.compile(r'(===|==|~=|!=|>=|<=|<|>)\s*([^,;\s"\']+)')
+_VERSION = re.compile(r'^v?(\d+(?:\.\d+)*)(.*)$', re.IGNORECASE)
+_SUFFIX_PART = re.compile(r'([a-z]+)?[._-]?(\d*)')
+# Pre-releases sort before the final release, post-releases after it
+_SUFFIX_RANKS = {'dev': 0, 'a': 1, 'alpha': 1, 'b': 2, 'beta': 2, 'rc': 3, 'c': 3, 'pre': 3, 'preview': 3,
+                 'post': 5, 'rev': 5, 'r': 5}
+_FINAL_RANK = 4
+
+def parse_specifier(spec_str):
+    """Splits a specifier such as 'hatchling>=1.26' into (package_name, 'hatchling >= 1.26', 'hatchling>=1.26')."""
+    match = _SEARCH_OPERATOR.search(spec_str)
+    if match:
+        op = match.group(1)
+        parts = re.split(f'({re.escape(op)})', spec_str, maxsplit=1)
+        if len(parts) >= 3:
+            package_name = parts[0].strip()
+            version_part = parts[2].strip()
+            search_string_with_spaces = f"{package_name} {op} {version_part}"
+            canonical_search_string = f"{package_name}{op}{version_part}"
+            return package_name, search_string_with_spaces, canonical_search_string
+    # Fallback for no operator or malformed specifier
+    package_name = spec_str.strip()
+    search_string_with_spaces = f"{package_name} == "
+    canonical_search_string = f"{package_name}=="
+    return package_name, search_string_with_spaces, canonical_search_string
+
+def parse_search_string(canonical_search_string):
+    """Splits a canonical search string such as 'hatchling>=1.26' into (operator, version)."""
+    match = _SEARCH_OPERATOR.search(canonical_search_string)
+    if not match:
+        return '==', ''
+    return match.group(1), canonical_search_string[match.end():].strip()
+
+def version_key(version):
+    """A sort key for PEP 440-style versions, without depending on `packaging`.
+
+    Each suffix part (`rc10`, `.post1`, `.dev2`, or `-1` for a post-release) becomes (rank, number),
+    so 'rc2' sorts before 'rc10'. The parts end with the final release's rank, which puts
+    '1.0a1.dev1' before '1.0a1'. A local version label ('+ubuntu1') is ignored.
+    """
+    match = _VERSION.match(version.strip())
+    if not match:
+        return ((), ((_FINAL_RANK, 0),), version)
+    release = [int(part) for part in match.group(1).split('.')]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    suffix = match.group(2).lower().split('+', 1)[0].lstrip('._')
+    parts = []
+    if suffix.startswith('-') and suffix[1:].isdigit():
+        parts.append((_SUFFIX_RANKS['post'], int(suffix[1:])))
+        suffix = ''
+    for word, number in _SUFFIX_PART.findall(suffix.lstrip('-')):
+        if word or number:
+            parts.append((_SUFFIX_RANKS.get(word, _FINAL_RANK), int(number or 0)))
+    parts.append((_FINAL_RANK, 0))
+    return (tuple(release), tuple(parts), '')
+
+def extract_requirements(text, package_name):
+    """Returns the quoted requirement strings for a package that carry a version constraint.
+
+    Works on whole pyproject.toml files as well as code search text-match fragments.
+    """
+    pattern = re.compile(
+        r'["\'](\s*' + re.escape(package_name) + r'\s*(?:\[[^\]"\']*\])?\s*(?:===|==|~=|!=|>=|<=|<|>)[^"\']*)["\']',
+        re.IGNORECASE)
+    return list(dict.fromkeys(match.group(1).strip() for match in pattern.finditer(text)))
+
+def requirement_satisfies(requirement, search_operator, search_version):
+    """Whether a stored requirement answers a search for `<package><operator><version>`.
+
+    It does if the requirement literally contains that clause, or if it pins an exact version
+    that satisfies it (e.g. 'hatchling==1.27.0' answers '>=1.26'). An empty search version
+    matches any exact pin.
+    """
+    wanted = version_key(search_version) if search_version else None
+    for clause_operator, clause_version in _CLAUSE.findall(requirement):
+        if clause_operator == search_operator and clause_version == search_version:
+            return True
+        if clause_operator not in ('==', '===') or '*' in clause_version:
+            continue
+        if wanted is None:
+            if search_operator == '==':
+                return True
+            continue
+        if OPERATORS[search_operator](version_key(clause_version), wanted):
+            return True
+    return False
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+_NULL_SPAN = nullcontext()
+
+class Profile:
+    """Named spans (call count and total seconds) and counters collected during one run. Thread-safe."""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.spans = {}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds, calls=1):
+        with self._lock:
+            previous_calls, previous_seconds = self.spans.get(name, (0, 0.0))
+            self.spans[name] = (previous_calls + calls, previous_seconds + seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def take(self):
+        """Returns the spans and counters collected so far and starts over; see merge()."""
+        with self._lock:
+            state = {"spans": self.spans, "counters": dict(self.counters)}
+            self.spans, self.counters = {}, Counter()
+        return state
+
+    def merge(self, state):
+        """Adds the spans and counters another process take()s."""
+        for name, (calls, seconds) in state["spans"].items():
+            self.add_span(name, seconds, calls)
+        for name, value in state["counters"].items():
+            self.count(name, value)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "wall_seconds": round(self.clock() - self.started, 6),
+                "spans": {name: {"calls": calls, "seconds": round(seconds, 6)}
+                          for name, (calls, seconds) in sorted(self.spans.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+class _Span:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.profile.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.add_span(self.name, self.profile.clock() - self.start)
+
+# The profile of this process, or None when profiling is off (the default)
+_profile = None
+
+def enable():
+    """Starts collecting spans and counters in this process and returns the Profile."""
+    global _profile
+    _profile = Profile()
+    return _profile
+
+def disable():
+    global _profile
+    _profile = None
+
+def enabled():
+    return _profile is not None
+
+def span(name):
+    """A context manager timing the block under `name`; a shared no-op when profiling is off."""
+    if _profile is None:
+        return _NULL_SPAN
+    return _Span(_profile, name)
+
+def count(name, value=1):
+    if _profile is not None:
+        _profile.count(name, value)
+
+def add_time(name, seconds):
+    """Adds a duration measured elsewhere, such as time slept, to a span."""
+    if _profile is not None:
+        _profile.add_span(name, seconds)
+
+def take():
+    """Hands this process's spans and counters to its parent (None when profiling is off)."""
+    return _profile.take() if _profile is not None else None
+
+def merge(state):
+    if _profile is not None and state:
+        _profile.merge(state)
+
+def write_summary(path=None, out=None):
+    """Writes the JSON summary to `path`, or to `out` when no path is given."""
+    if _profile is None:
+        return
+    text = json.dumps(_profile.summary(), indent=2) + "\n"
+    if path:
+        with open(path, "w") as f:
+            f.write(text)
+    else:
+        out.write(text)
@@ -0,0 +1,183 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+import requests
+from tqdm import tqdm
+from . import profiling
+
+# The code search endpoint allows 10 requests per minute per authenticated user
+CODE_SEARCH_REQUESTS_PER_MINUTE = 10
+MAX_RETRIES = 5
+# Base delays for jittered exponential backoff, in seconds
+SERVER_ERROR_BACKOFF = 2
+SECONDARY_LIMIT_BACKOFF = 60
+MAX_BACKOFF = 900
+
+PLACEHOLDER_TOKEN = "your_github_token_here"
+
+def load_tokens():
+    """Returns the GitHub tokens configured in the environment.
+
+    GITHUB_SEARCH_TOKENS may list several tokens separated by commas or whitespace; they are
+    rotated when one runs out of quota. GITHUB_SEARCH_TOKEN is used as well.
+    """
+    candidates = re.split(r'[\s,]+', os.getenv("GITHUB_SEARCH_TOKENS", ""))
+    candidates.append(os.getenv("GITHUB_SEARCH_TOKEN", ""))
+    tokens = [token for token in candidates if token and token != PLACEHOLDER_TOKEN]
+    return list(dict.fromkeys(tokens))
+
+def backoff_delay(attempt, base):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(MAX_BACKOFF, base * 2 ** attempt))
+
+def is_secondary_limit(response):
+    """Whether a 403 or 429 without Retry-After is GitHub's secondary rate limit.
+
+    Other 403s (a bad or unscoped token, an SSO-protected organization, a forbidden resource)
+    won't succeed on retry.
+    """
+    return response.status_code == 429 or 'secondary rate limit' in response.text.lower()
+
+class TokenBucket:
+    """Paces requests to `rate` per second with bursts of up to `capacity`. Thread-safe."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, sleeping until it is available. Returns the time slept."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now so concurrent callers queue up behind each other
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+class _TokenState:
+    """The last rate-limit headers GitHub returned for one token."""
+
+    def __init__(self, token):
+        self.token = token
+        self.remaining = None
+        self.reset = 0
+
+    def update(self, headers):
+        if 'X-RateLimit-Remaining' in headers:
+            self.remaining = int(headers['X-RateLimit-Remaining'])
+        if 'X-RateLimit-Reset' in headers:
+            self.reset = int(headers['X-RateLimit-Reset'])
+
+    def available_at(self, now):
+        """When this token can be used again (`now` if it still has quota)."""
+        if self.remaining == 0 and self.reset > now:
+            return self.reset
+        return now
+
+class RequestScheduler:
+    """Sends GitHub API requests within the real rate limits of one or more tokens.
+
+    A token bucket paces requests across all tokens; `X-RateLimit-*` and `Retry-After` headers
+    decide when an exhausted token can be used again, and a token with quota left is preferred.
+    Secondary limits and server errors are retried with jittered exponential backoff; any other
+    403 is returned at once.
+    """
+
+    def __init__(self, tokens, requests_per_minute=CODE_SEARCH_REQUESTS_PER_MINUTE, max_retries=MAX_RETRIES,
+                 session=None, clock=time.time, sleep=time.sleep):
+        if not tokens:
+            raise ValueError("At least one GitHub token is required.")
+        self._tokens = [_TokenState(token) for token in tokens]
+        self._next = 0
+        self._lock = threading.Lock()
+        self.max_retries = max_retries
+        self.session = session or requests.Session()
+        self.clock = clock
+        self.sleep = sleep
+        self.bucket = TokenBucket(len(tokens) * requests_per_minute / 60, len(tokens), sleep=sleep)
+
+    def _pick_token(self):
+        """Returns (token state, seconds to wait), rotating round-robin over tokens with quota."""
+        with self._lock:
+            now = self.clock()
+            count = len(self._tokens)
+            for offset in range(count):
+                state = self._tokens[(self._next + offset) % count]
+                if state.available_at(now) <= now:
+                    self._next = (self._next + offset + 1) % count
+                    return state, 0
+            state = min(self._tokens, key=lambda s: s.reset)
+            # One extra second absorbs clock skew against GitHub's reset time
+            return state, state.reset - now + 1
+
+    def _wait(self, seconds, reason):
+        tqdm.write(f"-> {reason}. Waiting {seconds:.0f}s...", file=sys.stderr)
+        profiling.add_time("http.backoff_sleep", seconds)
+        self.sleep(seconds)
+
+    def get(self, url, headers=None):
+        """GETs `url`, retrying around rate limits. Returns the last response received."""
+        response = None
+        for attempt in range(self.max_retries + 1):
+            profiling.add_time("http.pacing_sleep", self.bucket.acquire())
+            state, wait = self._pick_token()
+            if wait > 0:
+                self._wait(wait, "Rate limit exhausted for all tokens")
+            request_headers = {"Authorization": f"Bearer {state.token}", "Accept": "application/vnd.github.v3+json"}
+            request_headers.update(headers or {})
+            profiling.count("http.requests")
+            try:
+                with profiling.span("http.request"):
+                    response = self.session.get(url, headers=request_headers)
+            except requests.exceptions.RequestException as e:
+                if attempt == self.max_retries:
+                    raise
+                self._wait(backoff_delay(attempt, SERVER_ERROR_BACKOFF), f"Request error ({e})")
+                continue
+
+            profiling.count(f"http.status.{response.status_code}")
+            with self._lock:
+                state.update(response.headers)
+            if attempt == self.max_retries:
+                break
+            if response.status_code in (403, 429):
+                retry_after = response.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    self._wait(int(retry_after), "Rate limited (Retry-After)")
+                elif state.remaining == 0:
+                    # The next pick rotates tokens or waits for the reset
+                    pass
+                elif is_secondary_limit(response):
+                    # A secondary rate limit without guidance: back off
+                    self._wait(backoff_delay(attempt, SECONDARY_LIMIT_BACKOFF), "Secondary rate limit hit")
+                else:
+                    return response
+                continue
+            if response.status_code >= 500:
+                self._wait(backoff_delay(attempt, SERVER_ERROR_BACKOFF), f"Server error {response.status_code}")
+                continue
+            return response
+        return response
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(tokens):
+    """Returns the process-wide scheduler for a set of tokens, so every query shares one budget."""
+    key = tuple(tokens)
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = RequestScheduler(tokens)
+        return _schedulers[key]
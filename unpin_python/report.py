@@ -1,16 +1,29 @@
+import csv
+import json
+import sys
 from collections import defaultdict
-from .database import Database
+from itertools import groupby
+from operator import itemgetter
+from . import profiling
+from .database import WORKING_TREE, open_database
 
-def run_report(package_name, canonical_search_string, db_path):
+REPORT_FORMATS = ('text', 'jsonl', 'csv')
+MATRIX_FIELDS = ('path', 'package', 'search_string', 'repository')
+
+def run_report(package_name, canonical_search_string, db_path, revision=WORKING_TREE, out=None):
     """Generates a grouped and sorted report in the format: path<TAB>package1, package2..."""
-    print(f"--- Generating Report for '{package_name}' (search: '{canonical_search_string}') ---")
-    
-    db = Database(db_path)
-    matches = db.get_latest_search_report(package_name, canonical_search_string)
-    db.close()
+    with open_database(db_path) as db, profiling.span("report.query"):
+        matches = db.get_latest_search_report(package_name, canonical_search_string, revision)
+    profiling.count("report.rows", len(matches or ()))
+    write_report(package_name, canonical_search_string, matches, revision, out)
+
+def write_report(package_name, canonical_search_string, matches, revision=WORKING_TREE, out=None):
+    """Writes run_report()'s output for `matches`, the {'path', 'package'} rows of the latest search."""
+    at_revision = f" at {revision}" if revision != WORKING_TREE else ""
+    print(f"--- Generating Report for '{package_name}' (search: '{canonical_search_string}'){at_revision} ---", file=out)
     
     if not matches:
-        print("No matching packages found in the database for this search.")
+        print("No matching packages found in the database for this search.", file=out)
         return
 
     # Group packages by their Nixpkgs file path
@@ -18,7 +31,7 @@ def run_report(package_name, canonical_search_string, db_path):
     for match in matches:
         grouped_results[match['path']].append(match['package'])
         
-    print(f"\nFound {len(matches)} total package matches across {len(grouped_results)} Nixpkgs files:")
+    print(f"\nFound {len(matches)} total package matches across {len(grouped_results)} Nixpkgs files:", file=out)
     
     # Sort by Nixpkgs file path and print in the specified format
     for path, packages in sorted(grouped_results.items()):
@@ -27,4 +40,44 @@ def run_report(package_name, canonical_search_string, db_path):
         # Join them with a comma
         joined_packages = ", ".join(sorted_packages)
         # Print in the desired format
-        print(f"{path}\t{joined_packages}")
+        print(f"{path}\t{joined_packages}", file=out)
+
+def run_changes_report(package_name, canonical_search_string, db_path, since):
+    """Prints the repositories the searches since `since` (a datetime) added (+) or removed (-),
+    with the Nixpkgs files of the working tree scan that fetch them."""
+    print(f"--- Changes for '{package_name}' (search: '{canonical_search_string}') since {since:%Y-%m-%d %H:%M} UTC ---")
+    with open_database(db_path) as db:
+        added, removed = db.get_search_changes(package_name, canonical_search_string, since)
+        paths = defaultdict(set)
+        for repo in db.get_scan_repositories(package_name, WORKING_TREE):
+            paths[f"{repo['owner']}/{repo['repo']}".lower()].add(repo['path'])
+
+    if not added and not removed:
+        print("No changes.")
+        return
+    for sign, names in (('+', added), ('-', removed)):
+        for name in names:
+            print(f"{sign} {name}\t{', '.join(sorted(paths.get(name.lower(), ())))}".rstrip('\t'))
+
+def run_matrix_report(specifiers, db_path, output_format='jsonl', out=None, revision=WORKING_TREE):
+    """Streams the Nixpkgs path x pinned package matrix over the latest search runs, in one query.
+
+    `specifiers` is a list of (package_name, canonical_search_string), or None for every search run.
+    Output is one row per (path, package, search string, repository): JSON Lines, CSV with a header,
+    or text grouped per path as `path<TAB>search1, search2...`.
+    """
+    out = out or sys.stdout
+    with open_database(db_path) as db:
+        rows = db.iter_report_matrix(specifiers, revision)
+        if output_format == 'jsonl':
+            for row in rows:
+                out.write(json.dumps(dict(zip(MATRIX_FIELDS, row))) + "\n")
+        elif output_format == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(MATRIX_FIELDS)
+            writer.writerows(rows)
+        else:
+            # Rows arrive sorted by path, so each path's group is complete once the next one starts
+            for path, path_rows in groupby(rows, key=itemgetter(0)):
+                search_strings = dict.fromkeys(search_string for _, _, search_string, _ in path_rows)
+                out.write(f"{path}\t{', '.join(search_strings)}\n")
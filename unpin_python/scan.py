@@ -1,63 +1,415 @@
+import mmap
 import os
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import chain, islice
 from tqdm import tqdm
-from .database import Database
+from . import profiling
+from .database import open_database, package_key, shard_of
+from .nixparse import iter_dependency_names, iter_fetchers, might_contain_fetchers, tokenize
 
-def find_package_files(search_dir, package_name):
+PYTHON_PACKAGES_FILE = os.path.join("pkgs", "top-level", "python-packages.nix")
+PYTHON_MODULES_DIR = os.path.join("pkgs", "development", "python-modules")
+# `attr = callPackage ../development/python-modules/attr { };` and similar definitions
+_PYTHON_ATTRIBUTE = re.compile(r"^\s*([A-Za-z_][\w'-]*)\s*=[^;]*?(\.\./development/python-modules/[^\s;{}()]+)", re.MULTILINE)
+# Characters that can continue a Nix identifier
+_IDENT_CHARS = "A-Za-z0-9_'-"
+
+# Files at least this large are searched through mmap instead of being read into memory
+MMAP_MIN_BYTES = 1024 * 1024
+# Most directories listed by one task of the built-in walk
+WALK_CHUNK_SIZE = 16
+# Below this many files, a process pool costs more than it saves
+PARALLEL_MIN_FILES = 256
+CHUNK_SIZE = 64
+# Repositories buffered before they are written to the database during a scan
+WRITE_BATCH_SIZE = 512
+# Chunks queued per worker process: enough to keep them busy without reading ahead of the walk
+QUEUED_CHUNKS_PER_WORKER = 2
+
+def name_pattern(package_name):
+    """A regex matching the package name as a whole Nix identifier, with '-', '_' and '.' interchangeable.
+
+    Written in the syntax shared by Python's re and ripgrep.
+    """
+    parts = [re.escape(part) for part in re.split(r'[-_.]+', package_name) if part]
+    return f"(^|[^{_IDENT_CHARS}])" + "[-_.]+".join(parts) + f"([^{_IDENT_CHARS}]|$)"
+
+def python_attribute_index(file_paths, python_packages_text):
+    """Maps the package_key() of each Python attribute to the files that define it.
+
+    `file_paths` are the relative paths of the tree's files (only those under the python-modules
+    directory matter) and `python_packages_text` is the contents of python-packages.nix.
+    """
+    files = set(file_paths)
+    index = {}
+
+    def add(name, relative_path):
+        for candidate in (relative_path, os.path.join(relative_path, "default.nix"), os.path.join(relative_path, "package.nix")):
+            if candidate in files:
+                index.setdefault(package_key(name), set()).add(candidate)
+
+    modules_prefix = PYTHON_MODULES_DIR + os.sep
+    for path in files:
+        if path.startswith(modules_prefix):
+            name = path[len(modules_prefix):].split(os.sep, 1)[0]
+            add(name, os.path.join(PYTHON_MODULES_DIR, name))
+    for match in _PYTHON_ATTRIBUTE.finditer(python_packages_text):
+        add(match.group(1), os.path.normpath(os.path.join(os.path.dirname(PYTHON_PACKAGES_FILE), match.group(2))))
+    return index
+
+def build_python_attribute_index(nixpkgs_path):
+    """python_attribute_index() for a nixpkgs working tree.
+
+    Read from the definitions in pkgs/top-level/python-packages.nix and the package
+    directories under pkgs/development/python-modules.
+    """
+    file_paths = []
+    modules_dir = os.path.join(nixpkgs_path, PYTHON_MODULES_DIR)
+    if os.path.isdir(modules_dir):
+        with os.scandir(modules_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                with os.scandir(entry.path) as package_entries:
+                    file_paths.extend(os.path.join(PYTHON_MODULES_DIR, entry.name, package_entry.name)
+                                      for package_entry in package_entries
+                                      if package_entry.name.endswith(".nix") and package_entry.is_file())
     try:
-        cmd = ["rg", "-l", "--ignore-case", package_name, search_dir]
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return [line for line in proc.stdout.strip().split('\n') if line]
-    except FileNotFoundError:
-        tqdm.write("Error: 'rg' (ripgrep) is not installed.", file=sys.stderr)
-        return []
-    except subprocess.CalledProcessError as e:
-        tqdm.write(f"Error during file search for '{package_name}': {e.stderr}", file=sys.stderr)
-        return []
-
-def extract_repo_info(file_path, nixpkgs_path):
+        with open(os.path.join(nixpkgs_path, PYTHON_PACKAGES_FILE), encoding='utf-8') as f:
+            text = f.read()
+    except OSError:
+        text = ''
+    return python_attribute_index(file_paths, text)
+
+def find_candidate_files(search_dir, package_names):
+    """Runs a single ripgrep traversal over *.nix files naming any of the packages as a whole word."""
+    return list(iter_candidate_files(search_dir, package_names))
+
+def iter_candidate_files(search_dir, package_names):
+    """Like find_candidate_files, but yields each path as soon as ripgrep prints it.
+
+    Falls back to iter_builtin_candidate_files() when ripgrep isn't installed.
+    """
+    if shutil.which("rg") is None:
+        tqdm.write("'rg' (ripgrep) not found; using the built-in file search.", file=sys.stderr)
+        yield from iter_builtin_candidate_files(search_dir, package_names)
+        return
+    cmd = ["rg", "-l", "--ignore-case", "--glob", "*.nix"]
+    for package_name in package_names:
+        cmd.extend(["-e", name_pattern(package_name)])
+    cmd.append(search_dir)
+    # stderr goes to a file so a burst of warnings can't block ripgrep while stdout is read
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        except FileNotFoundError:
+            tqdm.write("Error: 'rg' (ripgrep) is not installed.", file=sys.stderr)
+            return
+        try:
+            while True:
+                with profiling.span("scan.find_candidates"):
+                    line = proc.stdout.readline()
+                if not line:
+                    break
+                line = line.rstrip('\n')
+                if line:
+                    yield line
+        finally:
+            # If the consumer stops early, closing the pipe ends ripgrep with SIGPIPE
+            proc.stdout.close()
+            returncode = proc.wait()
+        # ripgrep exits with 1 when nothing matched
+        if returncode not in (0, 1):
+            stderr.seek(0)
+            tqdm.write(f"Error during file search for {', '.join(repr(p) for p in package_names)}: {stderr.read()}",
+                       file=sys.stderr)
+
+def content_matcher(package_names):
+    """Returns (lowercase literals, bytes regex) for the built-in search.
+
+    The literals are the longest part of each name, a cheap case-insensitive prefilter; the
+    regex combines the name_pattern()s and is matched one line at a time, as ripgrep does.
+    """
+    literals = []
+    for package_name in package_names:
+        parts = [part for part in re.split(r'[-_.]+', package_name) if part]
+        if parts:
+            literals.append(max(parts, key=len).lower().encode())
+    pattern = "|".join(f"(?:{name_pattern(package_name)})" for package_name in package_names)
+    return literals, re.compile(pattern.encode(), re.IGNORECASE)
+
+def buffer_mentions(buffer, literals, pattern):
+    """Whether `pattern` matches a line of `buffer` (bytes or an mmap).
+
+    Only lines holding one of the lowercase literals, ignoring ASCII case, are matched against the
+    regex. The buffer is lowercased one window at a time, so a large mmap is never copied whole.
+    """
+    overlap = max(len(literal) for literal in literals) - 1
+    for start in range(0, len(buffer), MMAP_MIN_BYTES):
+        offset = max(start - overlap, 0)
+        window = buffer[offset:start + MMAP_MIN_BYTES].lower()
+        for literal in literals:
+            position = window.find(literal)
+            while position != -1:
+                line_start = buffer.rfind(b'\n', 0, offset + position) + 1
+                line_end = buffer.find(b'\n', offset + position)
+                if line_end == -1:
+                    line_end = len(buffer)
+                if pattern.search(buffer[line_start:line_end]):
+                    return True
+                position = window.find(literal, line_end - offset)
+    return False
+
+def file_mentions(file_path, literals, pattern):
+    """Whether any line of a file matches `pattern`, like `rg -l`."""
+    if not literals:
+        return False
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        block_pattern = re.compile(r'fetchFromGitHub\s*{\s*([\s\S]*?)\s*};', re.DOTALL)
-        owner_pattern = re.compile(r'owner\s*=\s*"([^"]+)"')
-        repo_pattern = re.compile(r'repo\s*=\s*"([^"]+)"')
-        
-        found_repos = []
-        for match in block_pattern.finditer(content):
-            owner = owner_pattern.search(match.group(1))
-            repo = repo_pattern.search(match.group(1))
-            if owner and repo:
-                relative_path = os.path.relpath(file_path, start=nixpkgs_path)
-                found_repos.append({"path": relative_path, "owner": owner.group(1), "repo": repo.group(1)})
-        return found_repos
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return False
+            if size < MMAP_MIN_BYTES:
+                return buffer_mentions(f.read(), literals, pattern)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return buffer_mentions(data, literals, pattern)
+    except (OSError, ValueError):
+        return False
+
+def search_directories(directories, literals, pattern):
+    """Lists each directory once; returns (*.nix files in them that mention a package, their subdirectories).
+
+    Like ripgrep, hidden entries (including .git) and symlinks are skipped.
+    """
+    matches, subdirectories = [], []
+    for directory in directories:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif (entry.name.endswith('.nix') and entry.is_file(follow_symlinks=False)
+                          and file_mentions(entry.path, literals, pattern)):
+                        matches.append(entry.path)
+        except OSError as e:
+            tqdm.write(f"Could not list directory {directory}: {e}", file=sys.stderr)
+    return matches, subdirectories
+
+_search_matcher = None
+
+def _init_search_worker(package_names):
+    global _search_matcher
+    _search_matcher = content_matcher(package_names)
+
+def _search_directories_in_worker(directories):
+    return search_directories(directories, *_search_matcher)
+
+def iter_builtin_candidate_files(search_dir, package_names, workers=None):
+    """A pure-Python equivalent of the ripgrep search, yielding the same paths in no particular order.
+
+    The walk is itself spread over a process pool: each task lists a few directories and searches
+    their *.nix files, and the subdirectories it returns become new tasks. Ignore files such as
+    .gitignore are not read.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        literals, pattern = content_matcher(package_names)
+        directories = [search_dir]
+        while directories:
+            with profiling.span("scan.find_candidates"):
+                matches, subdirectories = search_directories([directories.pop()], literals, pattern)
+            yield from matches
+            directories.extend(subdirectories)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_search_worker,
+                             initargs=(package_names,)) as executor:
+        directories = [search_dir]
+        running = set()
+        while directories or running:
+            # Small tasks while the walk is narrow, so every worker gets some of it
+            size = max(1, min(WALK_CHUNK_SIZE, len(directories) // workers))
+            while directories and len(running) < workers * QUEUED_CHUNKS_PER_WORKER:
+                running.add(executor.submit(_search_directories_in_worker, directories[-size:]))
+                del directories[-size:]
+            with profiling.span("scan.find_candidates"):
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                matches, subdirectories = future.result()
+                yield from matches
+                directories.extend(subdirectories)
+
+def parse_repo_info(content, relative_path, tokens=None):
+    """Returns the owner/repo of every GitHub-backed fetcher call in a Nix expression.
+
+    `tokens` is the list of tokenize(content), when the caller already has it.
+    """
+    return [{"path": relative_path, "owner": fetcher['owner'], "repo": fetcher['repo']}
+            for fetcher in iter_fetchers(content, tokens)
+            if fetcher['owner'] and fetcher['repo']]
+
+def read_fetcher_file(file_path):
+    """Returns the decoded file contents, or None if the file can't contain a GitHub fetcher."""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    profiling.count("scan.files_read")
+    profiling.count("scan.bytes_read", len(data))
+    if not might_contain_fetchers(data):
+        return None
+    return data.decode('utf-8', errors='replace')
+
+def extract_batch_repo_info(file_path, nixpkgs_path, package_names):
+    """Reads a file once and returns (package names it declares as dependencies, repositories found)."""
+    try:
+        content = read_fetcher_file(file_path)
+        if content is None:
+            return [], []
+        with profiling.span("scan.parse"):
+            # One tokenizer pass serves both the dependencies and the fetchers
+            tokens = list(tokenize(content))
+            dependencies = {package_key(name) for name in iter_dependency_names(content, tokens)}
+            matching = [name for name in package_names if package_key(name) in dependencies]
+            if not matching:
+                return [], []
+            return matching, parse_repo_info(content, os.path.relpath(file_path, start=nixpkgs_path), tokens)
     except Exception as e:
         tqdm.write(f"Could not process file {file_path}: {e}", file=sys.stderr)
-        return []
+        return [], []
+
+_worker_args = None
+
+def _init_worker(nixpkgs_path, package_names, profile=False):
+    global _worker_args
+    _worker_args = (nixpkgs_path, package_names)
+    # A forked worker starts with a copy of the parent's profile, which it must not report again
+    if profile:
+        profiling.enable()
+    else:
+        profiling.disable()
+
+def _extract_chunk_in_worker(file_paths):
+    """Returns the chunk's results and, when profiling, the worker's spans and counters for it."""
+    return [extract_batch_repo_info(file_path, *_worker_args) for file_path in file_paths], profiling.take()
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def bounded_map(executor, fn, iterable, queued):
+    """Like executor.map, but consumes `iterable` lazily, with at most `queued` calls outstanding."""
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= queued:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def extract_files(files, nixpkgs_path, package_names, workers=None):
+    """Yields (matching package names, repositories) for each file, in order, as `files` is consumed.
+
+    `files` may be a stream such as iter_candidate_files(). Once it turns out to hold at least
+    PARALLEL_MIN_FILES paths, files are parsed on a process pool fed through a bounded queue.
+    """
+    workers = workers or os.cpu_count() or 1
+    total = len(files) if hasattr(files, '__len__') else None
+    files = iter(files)
+    head = list(islice(files, PARALLEL_MIN_FILES))
+    with tqdm(total=total, desc="Scanning files") as progress:
+        if workers == 1 or len(head) < PARALLEL_MIN_FILES:
+            for path in chain(head, files):
+                yield extract_batch_repo_info(path, nixpkgs_path, package_names)
+                progress.update(1)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(nixpkgs_path, package_names, profiling.enabled())) as executor:
+            file_chunks = chunks(chain(head, files), CHUNK_SIZE)
+            for results, profile in bounded_map(executor, _extract_chunk_in_worker, file_chunks, workers * QUEUED_CHUNKS_PER_WORKER):
+                profiling.merge(profile)
+                yield from results
+                progress.update(len(results))
+
+def unique_repositories(repos):
+    return [dict(t) for t in {tuple(d.items()) for d in repos}]
 
 def run_scan(package_name, nixpkgs_path, db_path):
+    """Scans for a single package; see run_batch_scan()."""
+    run_batch_scan([package_name], nixpkgs_path, db_path)
+
+def run_batch_scan(package_names, nixpkgs_path, db_path, workers=None, shard=None):
+    """Scans Nixpkgs once for several packages, committing results in batches as they are found.
+
+    With `shard` = (shard, shard_count), only the files shard_of() assigns to that shard are parsed.
+    """
     if not nixpkgs_path:
         print("--- Skipping Nixpkgs Scan: --nixpkgs-path not provided ---")
         return
-        
-    print(f"--- Starting Nixpkgs Scan for '{package_name}' in {nixpkgs_path} ---")
+
+    # Preserve order while dropping duplicate package names
+    package_names = list(dict.fromkeys(package_names))
+    of_shard = f" (shard {shard[0]} of {shard[1]})" if shard else ""
+    print(f"--- Starting Nixpkgs Scan for {', '.join(repr(p) for p in package_names)} in {nixpkgs_path}{of_shard} ---")
     if not os.path.isdir(nixpkgs_path):
         print(f"Error: Nixpkgs directory not found at {nixpkgs_path}")
         return
 
-    files = find_package_files(nixpkgs_path, package_name)
-    if not files:
-        print(f"No files referencing '{package_name}' were found in {nixpkgs_path}.")
+    files = iter_candidate_files(nixpkgs_path, package_names)
+    if shard:
+        files = (path for path in files if shard_of(os.path.relpath(path, nixpkgs_path), shard[1]) == shard[0])
+    first = next(files, None)
+    if first is None:
+        print(f"No files referencing any of the packages were found in {nixpkgs_path}.")
         return
 
-    print(f"Found {len(files)} files. Extracting repository info...")
-    all_repos = [info for path in tqdm(files, desc="Scanning files") for info in extract_repo_info(path, nixpkgs_path)]
-    unique_repos = [dict(t) for t in {tuple(d.items()) for d in all_repos}]
-    
-    db = Database(db_path)
-    upserted_count = db.upsert_scan_result(package_name, unique_repos)
-    db.close()
-    
-    print(f"Scan complete. Upserted {upserted_count} unique repositories for '{package_name}'.")
+    # A package's own definition mentions its name but doesn't depend on it
+    definitions = build_python_attribute_index(nixpkgs_path)
+    # Seen (path, owner, repo) per package, so each repository is written once
+    seen = {name: set() for name in package_names}
+    batch = []
+    candidates = 0
+
+    def count(files):
+        nonlocal candidates
+        for path in files:
+            candidates += 1
+            yield path
+
+    # ripgrep walks the tree, workers parse the files it has found so far, and results are
+    # committed in batches as they come back, so the write lock is only held briefly
+    print("Extracting repository info as candidate files are found...")
+    with open_database(db_path) as db:
+        db.start_scan_results(package_names)
+        files = count(chain([first], files))
+        for matching, repos in extract_files(files, nixpkgs_path, package_names, workers):
+            for name in matching:
+                own_files = definitions.get(package_key(name), ())
+                for repo in repos:
+                    key = (repo['path'], repo['owner'], repo['repo'])
+                    if repo['path'] not in own_files and key not in seen[name]:
+                        seen[name].add(key)
+                        batch.append((name, repo))
+            if len(batch) >= WRITE_BATCH_SIZE:
+                db.add_scan_repositories(batch)
+                batch = []
+        db.add_scan_repositories(batch)
+        # Readers see the previous scan until this point
+        db.finish_scan_results(package_names, shard=shard)
+
+    profiling.count("scan.candidate_files", candidates)
+    print(f"Scanned {candidates} candidate files.")
+    for name, repos in seen.items():
+        print(f"Upserted {len(repos)} unique repositories for '{name}'.")
+    print(f"Scan complete. Upserted {sum(len(repos) for repos in seen.values())} unique repositories for {len(seen)} packages.")
@@ -1,80 +1,296 @@
 import os
 import re
 import sys
-import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
 import requests
 from dotenv import load_dotenv
 from tqdm import tqdm
-from .database import Database
-
-def search_github_all_repos(query, token):
-    headers = {"Authorization": f"Bearer {token}", "Accept": "application/vnd.github.v3+json"}
-    url = f"https://api.github.com/search/code?q={query}&per_page=100"
-    all_items = []
-    
-    with tqdm(desc="Fetching GitHub pages", leave=False) as pbar:
-        while url:
-            try:
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-                all_items.extend(data.get("items", []))
-                url = response.links.get('next', {}).get('url')
+from . import profiling
+from .database import open_database
+from .pins import extract_requirements, parse_search_string, requirement_satisfies
+from .ratelimit import get_scheduler, load_tokens
+
+# Overridden by the GITHUB_API_URL environment variable, e.g. for GitHub Enterprise or a local stand-in
+GITHUB_API_URL = "https://api.github.com"
+# HEAD resolves to the repository's default branch; raw file fetches don't use the API quota
+RAW_PYPROJECT_URL = "https://raw.githubusercontent.com/{owner}/{repo}/HEAD/pyproject.toml"
+TARGETED_WORKERS = 16
+# How long pins fetched from a pyproject.toml answer later searches without going back to the network
+PIN_MAX_AGE = timedelta(hours=24)
+# Asks code search to include the matched fragments, which hold the pinned requirement
+TEXT_MATCH_MEDIA_TYPE = "application/vnd.github.v3.text-match+json"
+# Pages fetched at once across all queries; the scheduler still paces the actual requests
+SEARCH_WORKERS = 8
+_PAGE_PARAM = re.compile(r'[?&]page=(\d+)')
+
+def search_url(query):
+    api_url = os.getenv("GITHUB_API_URL") or GITHUB_API_URL
+    return f"{api_url.rstrip('/')}/search/code?q={query}&per_page=100"
+
+def page_number(url):
+    """The `page` parameter of a search URL (GitHub's first page has none)."""
+    match = _PAGE_PARAM.search(url)
+    return int(match.group(1)) if match else 1
+
+def with_page(url, number):
+    """Returns `url` asking for page `number`, leaving the rest of it exactly as it was."""
+    if _PAGE_PARAM.search(url):
+        return _PAGE_PARAM.sub(lambda m: f"{m.group(0)[0]}page={number}", url, count=1)
+    return f"{url}{'&' if '?' in url else '?'}page={number}"
+
+def fetch_search_page(url, scheduler, cache=None, offline=False):
+    """Fetches one page of a code search.
+
+    Returns (matches, links), where each match keeps only the repository's full name and the
+    matched fragments, and `links` maps Link relations ('next', 'last', ...) to URLs.
+    Returns None offline when the page isn't cached; raises RequestException on errors.
+    """
+    headers = {"Accept": TEXT_MATCH_MEDIA_TYPE}
+    if cache:
+        response = cache.get(url, scheduler, headers=headers, offline=offline)
+        if response is None:
+            return None
+    else:
+        # The scheduler paces requests and retries around rate limits
+        response = scheduler.get(url, headers=headers)
+    response.raise_for_status()
+    matches = [{"full_name": item['repository']['full_name'],
+                "fragments": [match.get('fragment', '') for match in item.get('text_matches', [])]}
+               for item in response.json().get("items", [])]
+    links = {rel: link['url'] for rel, link in response.links.items() if link.get('url')}
+    profiling.count("search.pages")
+    profiling.count("search.matches", len(matches))
+    return matches, links
+
+class QueryCrawl:
+    """The pages of one search query: the ones known so far, in order, and the ones fetched."""
+
+    def __init__(self, search_id, query, url):
+        self.search_id = search_id
+        self.query = query
+        self.pages = [url]
+        self.done = set()
+        self.failed = False
+        self.expanded = False
+
+    def checkpoint(self):
+        """The first page not fetched yet, where a resumed search starts; None once all are."""
+        return next((url for url in self.pages if url not in self.done), None)
+
+    def follow(self, url, links):
+        """Records a fetched page and returns the URLs of the pages to fetch next.
+
+        Once the last page number is known every remaining page is returned at once, so they can
+        be fetched concurrently; without it the crawl follows `next` links one by one.
+        """
+        self.done.add(url)
+        if self.expanded:
+            return []
+        last = links.get('last')
+        if last and _PAGE_PARAM.search(last):
+            self.expanded = True
+            new_pages = [with_page(url, number) for number in range(page_number(url) + 1, page_number(last) + 1)]
+        elif links.get('next'):
+            new_pages = [links['next']]
+        else:
+            return []
+        new_pages = [page for page in new_pages if page not in self.pages]
+        self.pages.extend(new_pages)
+        # A failed crawl keeps its cursor but stops asking for more pages
+        return [] if self.failed else new_pages
+
+def crawl_searches(crawls, scheduler, cache=None, offline=False, workers=SEARCH_WORKERS):
+    """Fetches the pages of many search queries concurrently, all under one scheduler's budget.
+
+    Yields (crawl, matches) in the calling thread as pages arrive, so the caller can store each
+    page and `crawl.checkpoint()` together. A query stops at its first failed page.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            tqdm(desc="Fetching GitHub pages", total=len(crawls), leave=False) as pbar:
+        futures = {}
+
+        def submit(crawl, urls):
+            for url in urls:
+                futures[executor.submit(fetch_search_page, url, scheduler, cache, offline)] = (crawl, url)
+            pbar.total += len(urls)
+            pbar.refresh()
+
+        for crawl in crawls:
+            futures[executor.submit(fetch_search_page, crawl.pages[0], scheduler, cache, offline)] = (crawl, crawl.pages[0])
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                crawl, url = futures.pop(future)
                 pbar.update(1)
-                if url: time.sleep(10)
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 403:
-                    tqdm.write(f"-> Rate limit hit. Waiting 60s for {url}...", file=sys.stderr)
-                    time.sleep(60)
-                else:
+                try:
+                    page = future.result()
+                except requests.exceptions.HTTPError as e:
                     tqdm.write(f"HTTP error for {url}: {e}", file=sys.stderr)
-                    break
-            except requests.exceptions.RequestException as e:
-                tqdm.write(f"Request error for {url}: {e}", file=sys.stderr)
-                break
-    return all_items
+                    crawl.failed = True
+                    continue
+                except requests.exceptions.RequestException as e:
+                    tqdm.write(f"Request error for {url}: {e}", file=sys.stderr)
+                    crawl.failed = True
+                    continue
+                if page is None:
+                    tqdm.write(f"Offline: no cached response for {url}", file=sys.stderr)
+                    crawl.failed = True
+                    continue
+                matches, links = page
+                submit(crawl, crawl.follow(url, links))
+                yield crawl, matches
+
+def fetch_pyproject(session, owner, repo):
+    """Returns the text of a repository's top-level pyproject.toml on its default branch.
+
+    Returns '' if the repository has no pyproject.toml, and None if it couldn't be fetched.
+    """
+    url = RAW_PYPROJECT_URL.format(owner=owner, repo=repo)
+    try:
+        response = session.get(url, timeout=30)
+    except requests.exceptions.RequestException as e:
+        tqdm.write(f"Request error for {url}: {e}", file=sys.stderr)
+        return None
+    if response.status_code == 404:
+        return ''
+    if not response.ok:
+        tqdm.write(f"HTTP error {response.status_code} for {url}", file=sys.stderr)
+        return None
+    return response.text
 
-def run_search(package_name, search_string_with_spaces, canonical_search_string, db_path):
+def fetch_repo_pins(repos, package_name, workers=TARGETED_WORKERS):
+    """Fetches the pyproject.toml of each (owner, repo) concurrently.
+
+    Returns `{owner/repo: [requirement, ...]}` for every repository that could be fetched.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+
+    pins_by_repo = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        texts = executor.map(lambda owner_repo: fetch_pyproject(session, *owner_repo), repos)
+        for (owner, repo), text in tqdm(zip(repos, texts), total=len(repos), desc="Checking repositories", leave=False):
+            if text is not None:
+                pins_by_repo[f"{owner}/{repo}"] = extract_requirements(text, package_name)
+    session.close()
+    return pins_by_repo
+
+def fragment_pins(matches, package_name):
+    """Returns `{owner/repo: [requirement, ...]}` from the text-match fragments of code search matches."""
+    pins_by_repo = {}
+    for match in matches:
+        requirements = extract_requirements(" ".join(match['fragments']), package_name)
+        if requirements:
+            pins_by_repo.setdefault(match['full_name'], []).extend(requirements)
+    return pins_by_repo
+
+def run_targeted_search(db, package_name, canonical_search_string, local_repos, pin_max_age, offline):
+    # Only look at the repositories nixpkgs actually packages
+    repos = sorted({(repo['owner'], repo['repo']) for repo in local_repos})
+    print(f"--- Checking pins of {len(repos)} scanned repositories for '{canonical_search_string}' ---")
+    pins_by_repo = db.get_cached_pins(package_name, [f"{owner}/{repo}" for owner, repo in repos], pin_max_age)
+    if offline:
+        # Any cached pins will do; nothing else can be checked
+        pins_by_repo = db.get_cached_pins(package_name, [f"{owner}/{repo}" for owner, repo in repos], None)
+    stale_repos = [(owner, repo) for owner, repo in repos if f"{owner}/{repo}" not in pins_by_repo]
+    print(f"{len(pins_by_repo)} repositories answered from the pin cache, fetching {len(stale_repos)}.")
+    if offline and stale_repos:
+        print(f"Offline: skipping {len(stale_repos)} repositories without cached pins.")
+    elif stale_repos:
+        fetched = fetch_repo_pins(stale_repos, package_name)
+        db.store_pins(package_name, fetched, source='pyproject')
+        pins_by_repo.update(fetched)
+
+    store_pin_matches(db, package_name, canonical_search_string, pins_by_repo)
+
+def store_pin_matches(db, package_name, canonical_search_string, pins_by_repo):
+    """Stores the repositories whose pins satisfy the specifier as a search run, evaluated locally."""
+    search_operator, search_version = parse_search_string(canonical_search_string)
+    found_repos_on_github = {repo_full_name for repo_full_name, requirements in pins_by_repo.items()
+                             if any(requirement_satisfies(r, search_operator, search_version) for r in requirements)}
+    search_id = db.insert_search_result(package_name, canonical_search_string, found_repos_on_github)
+    print(f"Search complete. Stored {len(found_repos_on_github)} matching repos under search ID {search_id}.")
+
+def run_searches(specifiers, db_path, targeted=False, pin_max_age=PIN_MAX_AGE, cache=None, offline=False,
+                 resume=False, workers=SEARCH_WORKERS, scheduler=None):
+    """Searches GitHub for several (package_name, search_string_with_spaces, canonical_search_string) at once.
+
+    Every query variant of every specifier is crawled concurrently; each specifier's variants are
+    merged into one search run. `scheduler` replaces the process-wide one for the configured tokens.
+    """
     load_dotenv()
-    github_token = os.getenv("GITHUB_SEARCH_TOKEN")
-    if not github_token or github_token == "your_github_token_here":
+    github_tokens = load_tokens()
+    if not targeted and not offline and not github_tokens and scheduler is None:
         print("Error: GITHUB_SEARCH_TOKEN not found.")
         return
-        
-    db = Database(db_path)
-    local_repos = db.get_scan_repositories(package_name)
-    if not local_repos:
-        print(f"No scan data found for '{package_name}'. A scan must be run at least once.")
-        db.close()
-        return
 
-    print(f"--- Starting GitHub-wide search for '{canonical_search_string}' (and variants) ---")
-    
-    query1 = f'"{canonical_search_string}"+filename:pyproject.toml'
-    print(f"Searching for: {canonical_search_string}")
-    results1 = search_github_all_repos(query1, github_token)
-    
-    all_github_results_map = {item['repository']['full_name']: item for item in results1}
-
-    if search_string_with_spaces != canonical_search_string:
-        query2 = f'"{search_string_with_spaces}"+filename:pyproject.toml'
-        print(f"Searching for: {search_string_with_spaces}")
-        results2 = search_github_all_repos(query2, github_token)
-        all_github_results_map.update({item['repository']['full_name']: item for item in results2})
-    
-    found_repos_on_github = set(all_github_results_map.keys())
-    
-    if not found_repos_on_github:
-        print("No results found on GitHub for either query variant.")
-        db.insert_search_result(package_name, canonical_search_string, set())
-        db.close()
-        return
-        
-    print(f"\nFound {len(found_repos_on_github)} unique repositories on GitHub with matches.")
+    with open_database(db_path) as db:
+        runs = {}
+        crawls = []
+        for package_name, search_string_with_spaces, canonical_search_string in specifiers:
+            local_repos = db.get_scan_repositories(package_name)
+            if not local_repos:
+                print(f"No scan data found for '{package_name}'. A scan must be run at least once.")
+                continue
+            if targeted:
+                with db.transaction():
+                    run_targeted_search(db, package_name, canonical_search_string, local_repos, pin_max_age, offline)
+                continue
 
-    # In the new schema, we just store the full set of repos found on GH.
-    # The report command is responsible for joining this with the scan data.
-    search_id = db.insert_search_result(package_name, canonical_search_string, found_repos_on_github)
-    db.close()
-    
-    print(f"Search complete. Stored {len(found_repos_on_github)} found GitHub repos under search ID {search_id}.")
\ No newline at end of file
+            queries = {f'"{canonical_search_string}"+filename:pyproject.toml': canonical_search_string}
+            if search_string_with_spaces != canonical_search_string:
+                queries[f'"{search_string_with_spaces}"+filename:pyproject.toml'] = search_string_with_spaces
+
+            resumable = db.get_resumable_search_run(package_name, canonical_search_string) if resume else None
+            if resumable:
+                search_id, cursors = resumable
+                print(f"--- Resuming GitHub-wide search for '{canonical_search_string}' (search ID {search_id}) ---")
+            else:
+                if resume:
+                    print(f"No interrupted search found for '{canonical_search_string}'; starting a new one.")
+                # Once every scanned repository has fresh pins, any specifier is answered without a query
+                repo_names = sorted({f"{repo['owner']}/{repo['repo']}" for repo in local_repos})
+                pins_by_repo = db.get_cached_pins(package_name, repo_names, None if offline else pin_max_age)
+                if len(pins_by_repo) == len(repo_names):
+                    print(f"--- Answering '{canonical_search_string}' from the pins of {len(repo_names)} scanned repositories ---")
+                    with db.transaction():
+                        store_pin_matches(db, package_name, canonical_search_string, pins_by_repo)
+                    continue
+                cursors = {query: search_url(query) for query in queries}
+                search_id = db.start_search_run(package_name, canonical_search_string, cursors)
+                print(f"--- Starting GitHub-wide search for '{canonical_search_string}' (and variants) ---")
+            runs[search_id] = (package_name, canonical_search_string)
+            for query, url in cursors.items():
+                if url is not None:
+                    print(f"Searching for: {queries.get(query, query)}")
+                    crawls.append(QueryCrawl(search_id, query, url))
+
+        if crawls:
+            if scheduler is None and github_tokens:
+                scheduler = get_scheduler(github_tokens)
+            for crawl, matches in crawl_searches(crawls, scheduler, cache, offline, workers):
+                package_name = runs[crawl.search_id][0]
+                # Each page is its own checkpoint: matches, pins and the query's cursor are committed together
+                with db.transaction():
+                    db.add_search_page(crawl.search_id, crawl.query, {match['full_name'] for match in matches},
+                                       crawl.checkpoint())
+                    db.store_pins(package_name, fragment_pins(matches, package_name), source='fragment')
+
+        interrupted = {crawl.search_id for crawl in crawls if crawl.checkpoint() is not None}
+        with db.transaction():
+            for search_id, (package_name, canonical_search_string) in runs.items():
+                if search_id in interrupted:
+                    print(f"Search interrupted. Run 'search --resume {canonical_search_string}' to continue search ID {search_id}.")
+                    continue
+                db.finish_search_run(search_id)
+                found_count = db.count_search_matches(search_id)
+                if not found_count:
+                    print(f"No results found on GitHub for either query variant of '{canonical_search_string}'.")
+                    continue
+                # The report command is responsible for joining these matches with the scan data.
+                print(f"Search complete. Stored {found_count} found GitHub repos under search ID {search_id}.")
+
+def run_search(package_name, search_string_with_spaces, canonical_search_string, db_path, **options):
+    run_searches([(package_name, search_string_with_spaces, canonical_search_string)], db_path, **options)
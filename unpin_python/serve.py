@@ -0,0 +1,283 @@
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+from . import profiling
+from .database import WORKING_TREE, open_database, package_key, repo_key
+from .index import git_revision, sync_index
+from .pins import parse_specifier
+from .report import write_report
+from .scan import build_python_attribute_index
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Seconds between checks of the nixpkgs checkout for a new commit
+WATCH_INTERVAL = 10
+
+class FetcherIndex:
+    """The persistent fetcher index, held in memory: the fetchers of each file and the files declaring each dependency.
+
+    Paths are interned, so every structure shares one string per file.
+    """
+
+    def __init__(self):
+        self.fetchers = {}                 # {nix_path: ((owner, repo), ...)}, files with fetchers only
+        self.dependencies = {}             # {nix_path: (package key, ...)}
+        self.dependents = defaultdict(set) # {package key: {nix_path, ...}}
+
+    @classmethod
+    def load(cls, db):
+        index = cls()
+        fetchers = defaultdict(dict)
+        for nix_path, owner, repo in db.get_indexed_fetchers():
+            fetchers[sys.intern(nix_path)][(owner, repo)] = None
+        index.fetchers = {nix_path: tuple(repos) for nix_path, repos in fetchers.items()}
+        dependencies = defaultdict(list)
+        for nix_path, name in db.get_indexed_dependencies():
+            dependencies[sys.intern(nix_path)].append(name)
+        for nix_path, names in dependencies.items():
+            index._add_dependencies(nix_path, names)
+        return index
+
+    def _add_dependencies(self, nix_path, keys):
+        self.dependencies[nix_path] = tuple(keys)
+        for key in keys:
+            self.dependents[key].add(nix_path)
+
+    def _drop(self, nix_path):
+        self.fetchers.pop(nix_path, None)
+        for key in self.dependencies.pop(nix_path, ()):
+            self.dependents[key].discard(nix_path)
+            if not self.dependents[key]:
+                del self.dependents[key]
+
+    def update(self, entries, removed_paths):
+        """Applies what sync_index() re-parsed and removed, as Database.update_index() does."""
+        for nix_path in removed_paths:
+            self._drop(nix_path)
+        for nix_path, _, repositories, dependencies in entries:
+            nix_path = sys.intern(nix_path)
+            self._drop(nix_path)
+            if repositories:
+                self.fetchers[nix_path] = tuple(dict.fromkeys((repo['owner'], repo['repo']) for repo in repositories))
+                self._add_dependencies(nix_path, dict.fromkeys(package_key(name) for name in dependencies))
+
+    def find(self, package_name, definitions):
+        """Returns sorted (nix_path, owner, repo) for run_index_scan()'s answer: the fetchers of the files
+        declaring the package, other than the package's own definition."""
+        key = package_key(package_name)
+        excluded = definitions.get(key, ())
+        return sorted({(nix_path, owner, repo)
+                       for nix_path in self.dependents.get(key, ()) if nix_path not in excluded
+                       for owner, repo in self.fetchers.get(nix_path, ())})
+
+class ReportCache:
+    """Scanned repositories and latest search matches read from the database, kept until another
+    connection (a scan, a search, a merge) commits to it."""
+
+    def __init__(self, db):
+        self.db = db
+        self.version = None
+        self.repositories = {}  # {(package_name, revision): ((nix_path, repo_key), ...)}
+        self.matches = {}       # {(package_name, search_string): frozenset of repo keys, or None}
+
+    def _check(self):
+        version = self.db.data_version()
+        if version != self.version:
+            self.version = version
+            self.repositories.clear()
+            self.matches.clear()
+
+    def report(self, package_name, search_string, revision=WORKING_TREE):
+        """Returns the rows Database.get_latest_search_report() would, from memory once warm."""
+        self._check()
+        specifier = (package_name, search_string)
+        if specifier not in self.matches:
+            search_id = self.db.get_latest_search_id(package_name, search_string)
+            self.matches[specifier] = frozenset(self.db.get_search_run_matches(search_id)) if search_id is not None else None
+        latest = self.matches[specifier]
+        if latest is None:
+            return None
+        if (package_name, revision) not in self.repositories:
+            self.repositories[package_name, revision] = tuple(
+                (sys.intern(repo['path']), repo_key(f"{repo['owner']}/{repo['repo']}"))
+                for repo in self.db.get_scan_repositories(package_name, revision))
+        paths = dict.fromkeys(nix_path for nix_path, key in self.repositories[package_name, revision] if key in latest)
+        return [{'path': nix_path, 'package': package_name} for nix_path in paths]
+
+class QueryServer:
+    """Answers scan and report queries from memory, re-indexing nixpkgs when its HEAD moves."""
+
+    def __init__(self, db, nixpkgs_path, watch_interval=WATCH_INTERVAL):
+        self.db = db
+        self.nixpkgs_path = nixpkgs_path
+        self.watch_interval = watch_interval
+        self.reports = ReportCache(db)
+        self.index = None
+        self.definitions = {}
+        self.revision = None
+        self.next_check = 0
+
+    def refresh(self):
+        """Re-indexes the files changed since the last refresh (all of them the first time)."""
+        if not self.nixpkgs_path or not os.path.isdir(self.nixpkgs_path):
+            return
+        with profiling.span("serve.refresh"):
+            self.revision = git_revision(self.nixpkgs_path)
+            with self.db.transaction():
+                entries, removed = sync_index(self.db, self.nixpkgs_path)
+            if self.index is None:
+                self.index = FetcherIndex.load(self.db)
+            else:
+                self.index.update(entries, removed)
+            self.definitions = build_python_attribute_index(self.nixpkgs_path)
+
+    def watch(self):
+        """Refreshes when the checkout has a new commit; checked at most every watch_interval seconds."""
+        if self.index is None or time.monotonic() < self.next_check:
+            return
+        self.next_check = time.monotonic() + self.watch_interval
+        if git_revision(self.nixpkgs_path) != self.revision:
+            self.refresh()
+
+    def status(self):
+        return {
+            "revision": self.revision,
+            "files": len(self.index.fetchers) if self.index else 0,
+            "fetchers": sum(map(len, self.index.fetchers.values())) if self.index else 0,
+            "cached_specifiers": len(self.reports.matches),
+        }
+
+    def answer(self, method, target):
+        """Returns (status, content type, body) for a request."""
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        route = (method, url.path)
+        if route == ('GET', '/status'):
+            return 200, 'application/json', json.dumps(self.status()) + "\n"
+        if route == ('POST', '/refresh'):
+            # Also picks up uncommitted edits, which the watch doesn't see
+            self.refresh()
+            return 200, 'application/json', json.dumps(self.status()) + "\n"
+        if route not in (('GET', '/report'), ('GET', '/scan')):
+            return 404, 'text/plain', f"Unknown query: {method} {url.path}\n"
+        specifiers = [parse_specifier(specifier) for specifier in params.get('specifier', [])]
+        if not specifiers:
+            return 400, 'text/plain', "Pass at least one specifier, e.g. ?specifier=hatchling==1.27.0\n"
+
+        out = io.StringIO()
+        if url.path == '/report':
+            revision = params.get('rev', [WORKING_TREE])[0]
+            with profiling.span("serve.report"):
+                for package_name, _, canonical_search_string in specifiers:
+                    matches = self.reports.report(package_name, canonical_search_string, revision)
+                    write_report(package_name, canonical_search_string, matches, revision, out)
+            return 200, 'text/plain', out.getvalue()
+
+        if self.index is None:
+            return 503, 'text/plain', f"No fetcher index: nixpkgs directory not found at {self.nixpkgs_path}\n"
+        with profiling.span("serve.scan"):
+            for package_name in dict.fromkeys(package_name for package_name, _, _ in specifiers):
+                for nix_path, owner, repo in self.index.find(package_name, self.definitions):
+                    out.write(json.dumps({"path": nix_path, "package": package_name, "repository": f"{owner}/{repo}"}) + "\n")
+        return 200, 'application/x-ndjson', out.getvalue()
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._respond(*self.server.queries.answer('GET', self.path))
+
+    def do_POST(self):
+        self._respond(*self.server.queries.answer('POST', self.path))
+
+    def _respond(self, status, content_type, body):
+        profiling.count("serve.requests")
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class _WatchingServer:
+    """Handles one request at a time (queries share one SQLite connection) and checks the checkout in between."""
+
+    def service_actions(self):
+        self.queries.watch()
+
+class _HTTPServer(_WatchingServer, HTTPServer):
+    pass
+
+class _UnixHTTPServer(_WatchingServer, socketserver.UnixStreamServer):
+    pass
+
+def socket_in_use(socket_path):
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+def remove_stale_socket(socket_path):
+    """Removes a socket left behind by a server that didn't shut down cleanly.
+
+    Raises FileExistsError if the path is anything else, or a server still answers on it.
+    """
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{socket_path} exists and is not a socket")
+    if socket_in_use(socket_path):
+        raise FileExistsError(f"another server is listening on {socket_path}")
+    os.unlink(socket_path)
+
+def make_server(queries, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """An HTTP server for `queries` on localhost, or on the Unix socket `socket_path` if given."""
+    if socket_path:
+        remove_stale_socket(socket_path)
+        server = _UnixHTTPServer(socket_path, _Handler)
+    else:
+        server = _HTTPServer((host, port), _Handler)
+    server.queries = queries
+    return server
+
+def run_serve(db_path, nixpkgs_path, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, watch_interval=WATCH_INTERVAL):
+    """Serves /scan, /report, /status and /refresh until interrupted."""
+    if socket_path:
+        try:
+            remove_stale_socket(socket_path)
+        except FileExistsError as e:
+            print(f"Error: {e}")
+            return
+    with open_database(db_path) as db:
+        queries = QueryServer(db, nixpkgs_path, watch_interval)
+        if nixpkgs_path and os.path.isdir(nixpkgs_path):
+            queries.refresh()
+        else:
+            print(f"--- Nixpkgs directory not found at {nixpkgs_path}: serving reports only ---")
+        server = make_server(queries, host, port, socket_path)
+        where = socket_path or "http://%s:%d" % server.server_address[:2]
+        print(f"--- Serving scan and report queries on {where} ---")
+        # Stop as cleanly on SIGTERM (systemd, kill) as on Ctrl-C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever(poll_interval=0.5)
+        except KeyboardInterrupt:
+            print("Stopped.")
+        finally:
+            server.server_close()
+            if socket_path and os.path.exists(socket_path):
+                os.unlink(socket_path)